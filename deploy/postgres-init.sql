@@ -0,0 +1,4 @@
+-- у каждого сервиса своя база на общем сервере PostgreSQL
+CREATE DATABASE gateway;
+CREATE DATABASE file_service;
+CREATE DATABASE analysis_service;
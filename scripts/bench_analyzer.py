@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""Пропускная способность и пиковая память анализатора текста (analysis_service/analyzer.py) на корпусах от 1 КБ до 100 МБ.
+
+Корпуса синтетические, но с распределением как у живого текста: словарь русских и английских слов с частотами
+по закону Ципфа, стоп-слова, заглавные буквы в начале предложений, пунктуация и переводы строк. Генерируются
+детерминированно (--seed) во временный каталог. Файл читается чанками по 1 МиБ, как в сервисе. Этапы:
+- tokenize — WordStream.feed: декодирование, нормализация, отсев стоп-слов (список слов чанка);
+- count    — WordStream.count: подсчёт частот без списка слов (word_counts_file, матрица близости);
+- analyze  — analyze_file целиком: частоты, шинглы и MinHash (как в пуле процессов сервиса).
+
+Для каждой пары (этап, корпус) печатаются МБ/с (лучший из --repeat прогонов) и пик памяти Python (tracemalloc,
+отдельным прогоном). --save сохраняет результаты в JSON; --compare сравнивает с сохранёнными и завершается с кодом 1,
+если пропускная способность упала или пик памяти вырос больше чем на --tolerance (по умолчанию 20%).
+
+Пример:
+    python3 scripts/bench_analyzer.py --save /tmp/analyzer.json
+    python3 scripts/bench_analyzer.py --compare /tmp/analyzer.json
+    python3 scripts/bench_analyzer.py --sizes 1K,1M,100M --stages tokenize,count
+"""
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / "services" / "analysis_service" / "src"
+
+SIZES = {"1K": 1 << 10, "64K": 64 << 10, "1M": 1 << 20, "10M": 10 << 20, "100M": 100 << 20}
+STAGES = ("tokenize", "count", "analyze")
+CHUNK_SIZE = 1024 * 1024
+
+_SYLLABLES = {
+    "ru": ["ра", "но", "ст", "ко", "ве", "ли", "про", "ть", "ни", "ен", "то", "ва", "да", "ска", "мо", "пре",
+           "ри", "ла", "ет", "ны", "ого", "ся", "ём", "жи", "ще", "ю", "ую", "об", "за", "ши"],
+    "en": ["the", "re", "in", "con", "er", "ti", "on", "al", "ing", "pro", "ment", "ex", "de", "ly", "ter",
+           "com", "ate", "ous", "ble", "str", "ac", "per", "ive", "un", "sion", "ent", "or", "ca", "im", "ow"],
+}
+_STOPWORDS_EN = ["the", "of", "and", "to", "in", "is", "that", "it", "for", "as", "with", "was", "on", "be"]
+
+
+def _vocabulary(lang: str, rnd: random.Random, size: int = 20_000) -> list[str]:
+    syllables = _SYLLABLES[lang]
+    words = {"".join(rnd.choices(syllables, k=rnd.choice((1, 2, 2, 3, 3, 4)))) for _ in range(size * 2)}
+    return sorted(words)[:size]
+
+
+def write_corpus(path: Path, lang: str, size: int, seed: int) -> None:
+    """Текст из предложений по 5-25 слов; около трети слов — стоп-слова, как в обычной прозе."""
+    sys.path.insert(0, str(SRC))
+    from analysis_service.analyzer import STOPWORDS
+
+    rnd = random.Random(f"{seed}:{lang}")
+    vocab = _vocabulary(lang, rnd)
+    stop = sorted(STOPWORDS) if lang == "ru" else _STOPWORDS_EN
+    weights = [1 / (rank + 1) for rank in range(len(vocab))]
+    written = 0
+    with path.open("wb") as out:
+        while written < size:
+            words = rnd.choices(vocab, weights=weights, k=20_000)
+            for i in rnd.sample(range(len(words)), len(words) // 3):
+                words[i] = rnd.choice(stop)
+            parts = []
+            i = 0
+            while i < len(words):
+                n = rnd.randint(5, 25)
+                sentence = words[i:i + n]
+                sentence[0] = sentence[0].capitalize()
+                parts.append(" ".join(sentence) + rnd.choice((". ", ". ", ", ", "! ", "? ", ".\n")))
+                i += n
+            block = "".join(parts).encode("utf-8")[:size - written]
+            out.write(block)
+            written += len(block)
+
+
+def _chunks(path: Path):
+    with path.open("rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            yield chunk
+
+
+def run_stage(stage: str, path: Path, shingle_size: int, num_perm: int) -> None:
+    from analysis_service.analyzer import WordStream, analyze_file
+
+    if stage == "tokenize":
+        tokens = WordStream()
+        for chunk in _chunks(path):
+            tokens.feed(chunk)
+        tokens.finish()
+    elif stage == "count":
+        tokens = WordStream()
+        counts: Counter[str] = Counter()
+        if not hasattr(WordStream, "count"):
+            # анализатор до потокового подсчёта: частоты — по спискам слов (для сравнения со старыми версиями)
+            for chunk in _chunks(path):
+                counts.update(tokens.feed(chunk))
+            counts.update(tokens.finish())
+            return
+        for chunk in _chunks(path):
+            tokens.count(chunk, counts)
+        tokens.count(b"", counts, final=True)
+    else:
+        analyze_file(str(path), shingle_size, num_perm)
+
+
+def measure(stage: str, path: Path, repeat: int, shingle_size: int, num_perm: int) -> dict:
+    size = path.stat().st_size
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        run_stage(stage, path, shingle_size, num_perm)
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    run_stage(stage, path, shingle_size, num_perm)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"bytes": size, "seconds": round(best, 4), "mb_per_s": round(size / best / 1e6, 2), "peak_mib": round(peak / 2**20, 2)}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for key, cur in results.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        if cur["mb_per_s"] < old["mb_per_s"] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {old['mb_per_s']} -> {cur['mb_per_s']} MB/s")
+        # пик памяти маленьких корпусов — доли МиБ и шумит, поэтому сравнивается с запасом в 1 МиБ
+        if cur["peak_mib"] > old["peak_mib"] * (1 + tolerance) + 1:
+            regressions.append(f"{key}: peak memory {old['peak_mib']} -> {cur['peak_mib']} MiB")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1K,64K,1M,10M,100M", help=f"через запятую из {', '.join(SIZES)}")
+    parser.add_argument("--langs", default="ru,en")
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--analyze-max-size", default="1M",
+                        help="analyze (MinHash на чистом Python) на корпусах крупнее этого не запускается")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--shingle-size", type=int, default=5)
+    parser.add_argument("--num-perm", type=int, default=128)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="записать результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона: регрессия — код возврата 1")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(SRC))
+    from analysis_service.analyzer import ANALYZER_VERSION
+
+    sizes = [s.strip() for s in args.sizes.split(",")]
+    stages = [s.strip() for s in args.stages.split(",")]
+    analyze_max = SIZES[args.analyze_max_size]
+    results: dict[str, dict] = {}
+    print(f"analyzer version {ANALYZER_VERSION}, python {sys.version.split()[0]}")
+    print(f"{'stage':<9} {'corpus':<8} {'MB/s':>9} {'seconds':>9} {'peak MiB':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for lang in args.langs.split(","):
+            for size_name in sizes:
+                path = Path(tmp) / f"{lang}_{size_name}.txt"
+                write_corpus(path, lang, SIZES[size_name], args.seed)
+                for stage in stages:
+                    if stage == "analyze" and SIZES[size_name] > analyze_max:
+                        continue
+                    # маленький корпус прогоняется много раз, чтобы время не утонуло в шуме таймера
+                    repeat = args.repeat * max(1, (1 << 20) // SIZES[size_name] // 16)
+                    r = measure(stage, path, repeat, args.shingle_size, args.num_perm)
+                    key = f"{stage}/{lang}_{size_name}"
+                    results[key] = r
+                    print(f"{stage:<9} {lang + '_' + size_name:<8} {r['mb_per_s']:>9.2f} {r['seconds']:>9.4f} {r['peak_mib']:>9.2f}")
+                path.unlink()
+
+    if args.save:
+        Path(args.save).write_text(json.dumps({"analyzer_version": ANALYZER_VERSION, "results": results}, indent=2))
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line)
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+"""Нагрузочный тест конвейера сдачи целиком: gateway -> File Service -> очередь и воркеры Analysis Service.
+
+Работы генерируются детерминированно (--seed): текст из словаря с частотами по Ципфу, размеры — по распределению
+--sizes (например, "4K=70,64K=25,1M=5"), доля точных копий более ранних работ того же задания (--dup-ratio)
+и почти-копий с заменой 10% слов (--near-dup-ratio). Первые --warmup работ не учитываются.
+
+Сценарии (--scenario):
+- submit — POST /works с --concurrency параллельными клиентами, затем ожидание анализа каждой работы
+  (опрос GET /works/{id}) и GET /works/{id}/reports. Латентность анализа — от ответа POST /works до статуса
+  ANALYZED (с точностью до --poll-interval);
+- report — синхронный анализ POST /reports Analysis Service (create_report) на файлах, заранее загруженных
+  в File Service;
+- all — оба по очереди.
+
+Печатаются пропускная способность, p50/p95/p99 по каждому эндпоинту, средние времена этапов анализа и commit-ов
+(разница /metrics сервисов до и после прогона) и, с --start, ресурсы процессов сервисов: CPU-секунды на работу и
+пик RSS (с дочерними процессами пула анализа; по /proc, только Linux).
+
+С --start скрипт сам поднимает три сервиса (uvicorn текущего интерпретатора) на чистых данных во временном
+каталоге; переменные окружения передаются сервисам, так что конфигурацию можно менять от прогона к прогону.
+--save сохраняет результаты в JSON; --compare сравнивает с сохранёнными и завершается с кодом 1, если пропускная
+способность упала, p95/p99 или CPU на работу выросли больше чем на --tolerance (по умолчанию 20%).
+
+Пример:
+    python3 scripts/bench_pipeline.py --start --works 500 --concurrency 16 --save /tmp/pipeline.json
+    ANALYSIS_WORKERS=8 python3 scripts/bench_pipeline.py --start --works 500 --concurrency 16 --compare /tmp/pipeline.json
+    python3 scripts/bench_pipeline.py --scenario report --sizes 4K --dup-ratio 0.5   # уже запущенные сервисы
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime as dt
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+
+import httpx
+
+SERVICES_DIR = Path(__file__).resolve().parent.parent / "services"
+UNITS = {"K": 1 << 10, "M": 1 << 20}
+DONE_STATUSES = {"ANALYZED", "ANALYSIS_FAILED"}
+
+
+def parse_size(value: str) -> int:
+    value = value.strip().upper()
+    return int(value[:-1]) * UNITS[value[-1]] if value[-1] in UNITS else int(value)
+
+
+def parse_distribution(spec: str) -> list[tuple[int, float]]:
+    """"4K=70,64K=25,1M=5" -> [(4096, 70.0), ...]; вес можно опустить ("4K" — вес 1)."""
+    out = []
+    for part in spec.split(","):
+        size, _, weight = part.partition("=")
+        out.append((parse_size(size), float(weight or 1)))
+    return out
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+@dataclass
+class Submission:
+    student_id: str
+    assignment_id: str
+    filename: str
+    payload: bytes
+    kind: str  # original / duplicate / near_duplicate
+
+
+class Corpus:
+    """Тексты из синтетического словаря; частоты слов по закону Ципфа, как в живом тексте."""
+
+    def __init__(self, rnd: random.Random, vocabulary: int = 20_000):
+        letters = "абвгдежзиклмнопрстуфхцчшщэюя"
+        self.rnd = rnd
+        self.words = ["".join(rnd.choices(letters, k=rnd.randint(2, 10))) for _ in range(vocabulary)]
+        self.weights = [1 / (rank + 1) for rank in range(vocabulary)]
+
+    def text(self, size: int) -> bytes:
+        parts, written = [], 0
+        while written < size:
+            chunk = " ".join(self.rnd.choices(self.words, weights=self.weights, k=2000)) + ".\n"
+            parts.append(chunk)
+            written += len(chunk.encode())
+        return "".join(parts).encode()[:size]
+
+    def near_duplicate(self, payload: bytes, share: float = 0.1) -> bytes:
+        words = payload.decode(errors="ignore").split()
+        for i in self.rnd.sample(range(len(words)), int(len(words) * share)):
+            words[i] = self.rnd.choice(self.words)
+        return " ".join(words).encode()
+
+
+def plan(args: argparse.Namespace, total: int) -> list[Submission]:
+    rnd = random.Random(args.seed)
+    corpus = Corpus(rnd)
+    sizes, weights = zip(*parse_distribution(args.sizes))
+    earlier: dict[str, list[bytes]] = defaultdict(list)
+    out = []
+    for i in range(total):
+        assignment = f"bench-{i % args.assignments}"
+        roll = rnd.random()
+        if earlier[assignment] and roll < args.dup_ratio:
+            kind, payload = "duplicate", rnd.choice(earlier[assignment])
+        elif earlier[assignment] and roll < args.dup_ratio + args.near_dup_ratio:
+            kind, payload = "near_duplicate", corpus.near_duplicate(rnd.choice(earlier[assignment]))
+        else:
+            kind, payload = "original", corpus.text(rnd.choices(sizes, weights=weights)[0])
+            earlier[assignment].append(payload)
+        out.append(Submission(f"student-{i}", assignment, f"work-{i}.txt", payload, kind))
+    return out
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.enabled = True
+
+    async def request(self, client: httpx.AsyncClient, endpoint: str, method: str, url: str, **kwargs) -> httpx.Response | None:
+        t0 = time.perf_counter()
+        try:
+            resp = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            resp = None
+        if self.enabled:
+            self.latencies[endpoint].append((time.perf_counter() - t0) * 1000)
+            if resp is None or resp.status_code >= 400:
+                self.errors[endpoint] += 1
+        return resp
+
+    def observe(self, endpoint: str, ms: float) -> None:
+        if self.enabled:
+            self.latencies[endpoint].append(ms)
+
+    def summary(self, elapsed: dict[str, float]) -> dict[str, dict]:
+        out = {}
+        for endpoint, values in self.latencies.items():
+            out[endpoint] = {
+                "count": len(values),
+                "errors": self.errors[endpoint],
+                "p50_ms": round(percentile(values, 50), 2),
+                "p95_ms": round(percentile(values, 95), 2),
+                "p99_ms": round(percentile(values, 99), 2),
+                "max_ms": round(max(values), 2),
+            }
+            if endpoint in elapsed:
+                out[endpoint]["per_s"] = round(len(values) / elapsed[endpoint], 2)
+        return out
+
+
+async def _pool(items, concurrency: int, fn) -> None:
+    queue = iter(items)
+
+    async def worker():
+        for item in queue:
+            await fn(item)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_submit(args, subs: list[Submission], rec: Recorder, elapsed: dict[str, float]) -> None:
+    async with httpx.AsyncClient(base_url=args.base, timeout=120.0) as client:
+        submitted: dict[str, float] = {}
+
+        async def submit(sub: Submission) -> None:
+            resp = await rec.request(
+                client, "POST /works", "POST", "/works",
+                data={"student_id": sub.student_id, "assignment_id": sub.assignment_id},
+                files={"file": (sub.filename, sub.payload, "text/plain")},
+            )
+            if resp is not None and resp.status_code == 200:
+                submitted[resp.json()["work"]["id"]] = time.perf_counter()
+
+        t0 = time.perf_counter()
+        await _pool(subs, args.concurrency, submit)
+        elapsed["POST /works"] = time.perf_counter() - t0
+
+        # ожидание анализа: раз в --poll-interval опрашиваются самые ранние незавершённые работы (очередь разбирается
+        # по порядку сдачи). Опрос всех сразу сам нагружал бы gateway и Analysis Service и искажал замер
+        pending = dict(sorted(submitted.items(), key=lambda item: item[1]))
+        deadline = time.perf_counter() + args.analysis_timeout
+        while pending and time.perf_counter() < deadline:
+            async def poll(work_id: str) -> None:
+                resp = await rec.request(client, "GET /works/{work_id}", "GET", f"/works/{work_id}")
+                if resp is not None and resp.status_code == 200 and resp.json()["status"] in DONE_STATUSES:
+                    rec.observe("analysis (submit -> ANALYZED)", (time.perf_counter() - pending.pop(work_id)) * 1000)
+                    if resp.json()["status"] != "ANALYZED":
+                        rec.errors["analysis (submit -> ANALYZED)"] += 1
+
+            round_start = time.perf_counter()
+            await _pool(list(pending)[:args.concurrency], args.concurrency, poll)
+            await asyncio.sleep(max(0.0, args.poll_interval - (time.perf_counter() - round_start)))
+        elapsed["analysis (submit -> ANALYZED)"] = time.perf_counter() - t0
+        if pending:
+            rec.errors["analysis (submit -> ANALYZED)"] += len(pending)
+            print(f"warning: {len(pending)} works were not analyzed within {args.analysis_timeout} s", file=sys.stderr)
+
+        t1 = time.perf_counter()
+        await _pool(list(submitted), args.concurrency,
+                    lambda work_id: rec.request(client, "GET /works/{work_id}/reports", "GET", f"/works/{work_id}/reports"))
+        elapsed["GET /works/{work_id}/reports"] = time.perf_counter() - t1
+
+
+async def run_report(args, subs: list[Submission], rec: Recorder, elapsed: dict[str, float]) -> None:
+    async with httpx.AsyncClient(timeout=120.0) as client:
+        # загрузка файлов — подготовка, в замер не входит
+        files: list[tuple[Submission, dict]] = []
+
+        async def upload(sub: Submission) -> None:
+            resp = await client.post(f"{args.file_service}/files/stream", content=sub.payload,
+                                     headers={"Content-Type": "text/plain", "X-Filename": sub.filename})
+            resp.raise_for_status()
+            files.append((sub, resp.json()["file"]))
+
+        await _pool(subs, args.concurrency, upload)
+        base_time = dt.datetime(2026, 1, 1)
+
+        async def create_report(item: tuple[int, tuple[Submission, dict]]) -> None:
+            i, (sub, meta) = item
+            await rec.request(client, "POST /reports", "POST", f"{args.analysis_service}/reports", json={
+                "work_id": str(uuid.uuid4()),
+                "student_id": sub.student_id,
+                "assignment_id": sub.assignment_id,
+                "submitted_at": (base_time + dt.timedelta(seconds=i)).isoformat(),
+                "file_id": meta["id"],
+                "file_sha256": meta["sha256"],
+            })
+
+        t0 = time.perf_counter()
+        await _pool(list(enumerate(files)), args.concurrency, create_report)
+        elapsed["POST /reports"] = time.perf_counter() - t0
+
+
+# --- ресурсы и метрики сервисов ---
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def _proc_tree(pid: int) -> list[int]:
+    """Процесс и его потомки (процессы пула анализа) по /proc."""
+    parents: dict[int, list[int]] = defaultdict(list)
+    for entry in Path("/proc").iterdir():
+        if entry.name.isdigit():
+            with contextlib.suppress(OSError):
+                stat = (entry / "stat").read_text()
+                parents[int(stat.rsplit(")", 1)[1].split()[1])].append(int(entry.name))
+    out, stack = [], [pid]
+    while stack:
+        p = stack.pop()
+        out.append(p)
+        stack.extend(parents.get(p, ()))
+    return out
+
+
+def _cpu_rss(pids: list[int]) -> tuple[float, int]:
+    cpu, rss = 0.0, 0
+    for pid in pids:
+        with contextlib.suppress(OSError):
+            fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / _CLK_TCK
+            rss += int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+    return cpu, rss
+
+
+class ResourceSampler(threading.Thread):
+    """Раз в `interval` секунд снимает CPU-время и RSS процессов каждого сервиса вместе с потомками.
+
+    CPU-время завершившихся потомков в сумму не попадает, поэтому пул процессов не должен перезапускаться во время прогона.
+    """
+
+    def __init__(self, pids: dict[str, int], interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.pids = pids
+        self.interval = interval
+        self.peak_rss = defaultdict(int)
+        self.cpu_start = {name: _cpu_rss(_proc_tree(pid))[0] for (name, pid) in pids.items()}
+        self.cpu_last = dict(self.cpu_start)
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        while not self._done.wait(self.interval):
+            self.sample()
+
+    def sample(self) -> None:
+        for name, pid in self.pids.items():
+            cpu, rss = _cpu_rss(_proc_tree(pid))
+            self.cpu_last[name] = max(self.cpu_last[name], cpu)
+            self.peak_rss[name] = max(self.peak_rss[name], rss)
+
+    def stop(self) -> dict[str, dict]:
+        self._done.set()
+        self.join()
+        self.sample()
+        return {
+            name: {"cpu_s": round(self.cpu_last[name] - self.cpu_start[name], 2), "peak_rss_mib": round(self.peak_rss[name] / 2**20, 1)}
+            for name in self.pids
+        }
+
+
+_SAMPLE = re.compile(r'^(\w+)(?:\{([^}]*)\})? ([0-9.eE+-]+)$')
+
+
+def scrape(url: str) -> dict[tuple[str, str], float]:
+    """Суммы и счётчики гистограмм из /metrics: {(имя, метки): значение}; сервис без /metrics — пусто."""
+    try:
+        text = httpx.get(f"{url}/metrics", timeout=10).text
+    except httpx.HTTPError:
+        return {}
+    out = {}
+    for line in text.splitlines():
+        m = _SAMPLE.match(line)
+        if m and m.group(1).endswith(("_sum", "_count")):
+            out[(m.group(1), m.group(2) or "")] = float(m.group(3))
+    return out
+
+
+def stage_means(before: dict, after: dict) -> dict[str, dict]:
+    """Среднее время этапов и commit-ов за прогон: разница сумм, делённая на разницу счётчиков."""
+    out = {}
+    for (name, labels), total in after.items():
+        if not name.endswith("_sum") or name.startswith("http_"):
+            continue
+        count_key = (name[:-4] + "_count", labels)
+        count = after.get(count_key, 0) - before.get(count_key, 0)
+        if count <= 0:
+            continue
+        values = re.findall(r'="([^"]*)"', labels)
+        key = name[:-len("_duration_seconds_sum")] + (f"[{','.join(values)}]" if values else "")
+        out[key] = {"count": int(count), "mean_ms": round((total - before.get((name, labels), 0)) / count * 1000, 2)}
+    return out
+
+
+# --- запуск сервисов ---
+
+@contextlib.contextmanager
+def local_services(ports: list[int]):
+    """Три сервиса на чистых данных во временном каталоге; останавливаются при выходе."""
+    gw, fs, an = ports
+    with tempfile.TemporaryDirectory(prefix="bench_pipeline_") as tmp:
+        data = Path(tmp)
+        specs = {
+            "file_service": (fs, {"DATA_DIR": f"{data}/fs", "FILES_DIR": f"{data}/fs/files"}),
+            "analysis_service": (an, {
+                "DATA_DIR": f"{data}/an", "REPORTS_DIR": f"{data}/an/reports", "SHINGLE_INDEX_DIR": f"{data}/an/shingles",
+                "SPOOL_DIR": f"{data}/an/spool", "WORDCLOUD_DIR": f"{data}/an/wordclouds",
+                "FILE_SERVICE_URL": f"http://127.0.0.1:{fs}",
+            }),
+            "gateway": (gw, {
+                "DATA_DIR": f"{data}/gw", "FILE_SERVICE_URL": f"http://127.0.0.1:{fs}",
+                "ANALYSIS_SERVICE_URL": f"http://127.0.0.1:{an}",
+            }),
+        }
+        procs: dict[str, subprocess.Popen] = {}
+        try:
+            for name, (port, env) in specs.items():
+                Path(env["DATA_DIR"]).mkdir(parents=True)
+                procs[name] = subprocess.Popen(
+                    [sys.executable, "-m", "uvicorn", f"{name}.main:app", "--port", str(port), "--log-level", "warning"],
+                    cwd=SERVICES_DIR / name / "src",
+                    env={**os.environ, **env},
+                )
+            for name, (port, _) in specs.items():
+                for _ in range(120):
+                    with contextlib.suppress(httpx.HTTPError):
+                        if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                            break
+                    if procs[name].poll() is not None:
+                        raise SystemExit(f"{name} exited with code {procs[name].returncode}")
+                    time.sleep(0.25)
+                else:
+                    raise SystemExit(f"{name} did not start on port {port}")
+            yield {name: proc.pid for (name, proc) in procs.items()}
+        finally:
+            for proc in procs.values():
+                proc.terminate()
+            for proc in procs.values():
+                with contextlib.suppress(subprocess.TimeoutExpired):
+                    proc.wait(timeout=30)
+
+
+# --- сравнение с базой ---
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for endpoint, cur in results["endpoints"].items():
+        old = baseline["endpoints"].get(endpoint)
+        if old is None:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            # задержки в единицы миллисекунд шумят, поэтому к допуску добавляется 2 мс
+            if cur[key] > old[key] * (1 + tolerance) + 2:
+                regressions.append(f"{endpoint}: {key} {old[key]} -> {cur[key]}")
+        if "per_s" in cur and "per_s" in old and cur["per_s"] < old["per_s"] * (1 - tolerance):
+            regressions.append(f"{endpoint}: throughput {old['per_s']} -> {cur['per_s']} per s")
+        if cur["errors"] > old["errors"]:
+            regressions.append(f"{endpoint}: errors {old['errors']} -> {cur['errors']}")
+    old_cpu, cur_cpu = baseline.get("cpu_ms_per_work"), results.get("cpu_ms_per_work")
+    if old_cpu and cur_cpu and cur_cpu > old_cpu * (1 + tolerance):
+        regressions.append(f"cpu per work {old_cpu} -> {cur_cpu} ms")
+    return regressions
+
+
+def report(results: dict) -> None:
+    print(f"{'endpoint':<32} {'count':>6} {'err':>4} {'per s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for endpoint, r in results["endpoints"].items():
+        per_s = f"{r['per_s']:.1f}" if "per_s" in r else "-"
+        print(f"{endpoint:<32} {r['count']:>6} {r['errors']:>4} {per_s:>8} "
+              f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['max_ms']:>9.1f}")
+    for service, stages in results["stages"].items():
+        if stages:
+            print(f"\n{service}: mean ms per stage / commit")
+            for key, s in sorted(stages.items(), key=lambda item: -item[1]["mean_ms"] * item[1]["count"]):
+                print(f"    {key:<58} {s['count']:>7} x {s['mean_ms']:>9.2f}")
+    if results["resources"]:
+        print("\nresources")
+        for service, r in results["resources"].items():
+            print(f"    {service:<20} cpu {r['cpu_s']:>8.2f} s   peak rss {r['peak_rss_mib']:>8.1f} MiB")
+        print(f"    cpu per work: {results['cpu_ms_per_work']} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=("submit", "report", "all"), default="submit")
+    parser.add_argument("--start", action="store_true", help="поднять три сервиса на чистых данных")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--ports", default="8000,8001,8002", help="gateway, File Service, Analysis Service")
+    parser.add_argument("--works", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--sizes", default="4K=70,64K=25,1M=5", help="распределение размеров файлов: размер=вес")
+    parser.add_argument("--dup-ratio", type=float, default=0.1)
+    parser.add_argument("--near-dup-ratio", type=float, default=0.1)
+    parser.add_argument("--assignments", type=int, default=4)
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--analysis-timeout", type=float, default=600.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="записать результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона: регрессия — код возврата 1")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    gw, fs, an = (int(p) for p in args.ports.split(","))
+    args.base = f"http://{args.host}:{gw}"
+    args.file_service = f"http://{args.host}:{fs}"
+    args.analysis_service = f"http://{args.host}:{an}"
+    urls = {"gateway": args.base, "file_service": args.file_service, "analysis_service": args.analysis_service}
+    scenarios = ("submit", "report") if args.scenario == "all" else (args.scenario,)
+
+    subs = plan(args, args.warmup + args.works)
+    kinds = defaultdict(int)
+    for sub in subs[args.warmup:]:
+        kinds[sub.kind] += 1
+    print(f"{args.works} works ({dict(kinds)}), {sum(len(s.payload) for s in subs[args.warmup:]) / 2**20:.1f} MiB, "
+          f"concurrency {args.concurrency}, scenario {args.scenario}")
+
+    with (local_services([gw, fs, an]) if args.start else contextlib.nullcontext(None)) as pids:
+        rec = Recorder()
+        rec.enabled = False
+        for scenario in scenarios:
+            asyncio.run((run_submit if scenario == "submit" else run_report)(args, subs[:args.warmup], rec, {}))
+        rec.enabled = True
+
+        before = {name: scrape(url) for (name, url) in urls.items()}
+        sampler = ResourceSampler(pids) if pids else None
+        if sampler:
+            sampler.start()
+        elapsed: dict[str, float] = {}
+        for scenario in scenarios:
+            asyncio.run((run_submit if scenario == "submit" else run_report)(args, subs[args.warmup:], rec, elapsed))
+        resources = sampler.stop() if sampler else {}
+        stages = {name: stage_means(before[name], scrape(url)) for (name, url) in urls.items()}
+
+    results = {
+        "config": {k: v for (k, v) in vars(args).items() if k not in ("save", "compare", "tolerance")},
+        "endpoints": rec.summary(elapsed),
+        "stages": stages,
+        "resources": resources,
+    }
+    if resources:
+        results["cpu_ms_per_work"] = round(sum(r["cpu_s"] for r in resources.values()) / (args.works * len(scenarios)) * 1000, 2)
+    report(results)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2))
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        changed = {k for (k, v) in results["config"].items() if baseline["config"].get(k) != v}
+        if changed:
+            print(f"warning: run parameters differ from the baseline: {', '.join(sorted(changed))}")
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line)
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
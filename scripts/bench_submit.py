@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Замер латентности и нагрузочный тест POST /works: p50/p99 при заданной конкурентности.
+
+С --duration работает как нагрузочный тест: отправляет работы заданное число секунд
+и печатает устойчивую пропускную способность (submissions/s) и её значения по каждым 10 секундам.
+
+Пример:
+    python3 scripts/bench_submit.py --requests 500 --concurrency 16
+    python3 scripts/bench_submit.py --duration 60 --concurrency 16
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+async def run(base: str, total: int, concurrency: int, size: int, duration: float | None = None) -> None:
+    latencies: list[float] = []
+    finished_at: list[float] = []
+    errors = 0
+    counter = iter(range(total)) if duration is None else itertools.count()
+    started = time.perf_counter()
+    deadline = None if duration is None else started + duration
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        nonlocal errors
+        for i in counter:
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            payload = os.urandom(size // 2).hex().encode()
+            t0 = time.perf_counter()
+            resp = await client.post(
+                f"{base}/works",
+                data={"student_id": f"bench-{i}", "assignment_id": "bench"},
+                files={"file": (f"bench-{i}.txt", payload, "text/plain")},
+            )
+            t1 = time.perf_counter()
+            latencies.append((t1 - t0) * 1000)
+            finished_at.append(t1 - started)
+            if resp.status_code != 200:
+                errors += 1
+
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    done = len(latencies)
+
+    print(f"requests:    {done} (errors: {errors}), concurrency: {concurrency}, file size: {size} B")
+    print(f"throughput:  {done / elapsed:.1f} req/s")
+    print(f"latency ms:  p50={percentile(latencies, 50):.1f} p99={percentile(latencies, 99):.1f} "
+          f"mean={statistics.mean(latencies):.1f} max={max(latencies):.1f}")
+    if duration is not None:
+        windows = [0] * (int(elapsed // 10) + 1)
+        for t in finished_at:
+            windows[int(t // 10)] += 1
+        full = windows[:int(elapsed // 10)] or windows
+        print("per 10 s:    " + " ".join(f"{n / 10:.1f}" for n in full) + " req/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base", default="http://localhost:8000")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--size", type=int, default=4096, help="размер файла в байтах")
+    parser.add_argument("--duration", type=float, default=None, help="длительность нагрузки в секундах (вместо --requests)")
+    args = parser.parse_args()
+    asyncio.run(run(args.base, args.requests, args.concurrency, args.size, args.duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -16,10 +16,18 @@ echo "Work id: $WID1"
 
 echo "Submitting second work (student B, same content -> plagiarism expected)..."
 RESP2="$(curl -s -F "student_id=studentB" -F "assignment_id=hw3" -F "file=@$TMPDIR/a_copy.txt" "$BASE/works")"
-echo "$RESP2" | python3 -c "import sys,json; d=json.loads(sys.stdin.read()); print(d['report']['plagiarism'], d['report'].get('plagiarized_from_work_id'))"
+WID2="$(echo "$RESP2" | python3 -c "import sys,json; print(json.loads(sys.stdin.read())['work']['id'])")"
+echo "Work id: $WID2"
+
+echo "Waiting for queued analysis..."
+for _ in $(seq 1 30); do
+  STATUS="$(curl -s "$BASE/works/$WID2" | python3 -c "import sys,json; print(json.loads(sys.stdin.read())['status'])")"
+  [ "$STATUS" != "ANALYSIS_QUEUED" ] && break
+  sleep 1
+done
+echo "Status: $STATUS"
 
 echo "Fetching reports for second work..."
-WID2="$(echo "$RESP2" | python3 -c "import sys,json; print(json.loads(sys.stdin.read())['work']['id'])")"
 curl -s "$BASE/works/$WID2/reports" | python3 -m json.tool
 
 echo "Smoke test done."
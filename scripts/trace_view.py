@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Разбор трасс из файлов спанов (TRACE_FILE сервисов): самые медленные запросы и дерево одного запроса.
+
+Без --trace печатает --slowest самых долгих трасс (по корневому спану) и для каждой — спаны с наибольшим
+собственным временем (длительность минус вложенные спаны): там и сидит хвост латентности. С --trace печатает
+дерево трассы по всем сервисам: смещение от начала запроса, длительность, сервис и спан.
+Файлы всех сервисов передаются вместе; можно указать и один общий файл.
+
+Пример:
+    python3 scripts/trace_view.py /data/traces/*.jsonl --slowest 5
+    python3 scripts/trace_view.py /data/traces/*.jsonl --trace 4bf92f3577b34da6a3ce929d0e0e4736
+    python3 scripts/trace_view.py /data/traces/*.jsonl --name "POST /works"
+"""
+import argparse
+import json
+from collections import defaultdict
+
+
+def load(paths: list[str]) -> dict[str, list[dict]]:
+    traces: dict[str, list[dict]] = defaultdict(list)
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    span = json.loads(line)
+                    traces[span["trace_id"]].append(span)
+    return traces
+
+
+def _children(spans: list[dict]) -> dict[str | None, list[dict]]:
+    ids = {s["span_id"] for s in spans}
+    children: dict[str | None, list[dict]] = defaultdict(list)
+    for s in spans:
+        # родитель мог не попасть в файлы (сервис без TRACE_FILE) — такой спан показывается корнем
+        children[s["parent_id"] if s["parent_id"] in ids else None].append(s)
+    for group in children.values():
+        group.sort(key=lambda s: s["start_ns"])
+    return children
+
+
+def self_times(spans: list[dict]) -> list[tuple[float, dict]]:
+    """Собственное время спанов; параллельные вложенные спаны могут перекрываться, поэтому не меньше нуля."""
+    children = _children(spans)
+    out = []
+    for s in spans:
+        nested = sum(c["duration_ms"] for c in children.get(s["span_id"], ()))
+        out.append((max(0.0, s["duration_ms"] - nested), s))
+    out.sort(key=lambda item: item[0], reverse=True)
+    return out
+
+
+def root_of(spans: list[dict]) -> dict:
+    return min(_children(spans)[None], key=lambda s: s["start_ns"])
+
+
+def print_tree(spans: list[dict]) -> None:
+    children = _children(spans)
+    t0 = min(s["start_ns"] for s in spans)
+
+    def walk(span: dict, depth: int) -> None:
+        offset = (span["start_ns"] - t0) / 1e6
+        mark = "  ERROR " + span["error"] if span.get("error") else ""
+        print(f"{offset:>10.1f} {span['duration_ms']:>10.1f}  {span['service']:<17} {'  ' * depth}{span['name']}{mark}")
+        for child in children.get(span["span_id"], ()):
+            walk(child, depth + 1)
+
+    print(f"{'start ms':>10} {'dur ms':>10}  {'service':<17} span")
+    for root in children[None]:
+        walk(root, 0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--trace", help="trace id (заголовок ответа X-Trace-Id)")
+    parser.add_argument("--slowest", type=int, default=10)
+    parser.add_argument("--name", help="только трассы с таким корневым спаном, например \"POST /works\"")
+    parser.add_argument("--top-spans", type=int, default=5, help="спанов с наибольшим собственным временем на трассу")
+    args = parser.parse_args()
+
+    traces = load(args.files)
+    if args.trace:
+        if args.trace not in traces:
+            raise SystemExit(f"trace {args.trace} not found")
+        print_tree(traces[args.trace])
+        return
+
+    roots = [(root_of(spans), trace_id) for (trace_id, spans) in traces.items()]
+    if args.name:
+        roots = [(root, trace_id) for (root, trace_id) in roots if root["name"] == args.name]
+    roots.sort(key=lambda item: item[0]["duration_ms"], reverse=True)
+    print(f"{len(roots)} traces")
+    for (root, trace_id) in roots[:args.slowest]:
+        spans = traces[trace_id]
+        # трасса сдачи продолжается заданием анализа после ответа клиенту: end-to-end — до конца последнего спана
+        end_to_end = (max(s["start_ns"] + s["duration_ms"] * 1e6 for s in spans) - root["start_ns"]) / 1e6
+        print(f"\n{trace_id}  {root['name']}  {root['duration_ms']:.1f} ms, end-to-end {end_to_end:.1f} ms  ({len(spans)} spans)")
+        for (own, span) in self_times(spans)[:args.top_spans]:
+            print(f"    {own:>10.1f} ms self  {span['service']:<17} {span['name']}")
+
+
+if __name__ == "__main__":
+    main()
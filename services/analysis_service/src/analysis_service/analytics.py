@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import datetime as dt
+from collections import Counter
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .db import backend
+from .models import AssignmentStats, AssignmentWord, Work, WorkOutcome
+from .schemas import AssignmentSummary, ClusterMember, DuplicateCluster
+
+
+def _insert(model):
+    return (postgresql.insert if backend == "postgresql" else sqlite.insert)(model)
+
+
+async def _bump(db: AsyncSession, assignment_id: str, **deltas: int) -> None:
+    """Прибавляет дельты к счётчикам задания одним upsert: параллельные анализы не теряют приращения."""
+    stmt = _insert(AssignmentStats).values(assignment_id=assignment_id, updated_at=dt.datetime.utcnow(), **deltas)
+    set_ = {name: getattr(AssignmentStats, name) + value for name, value in deltas.items()}
+    set_["updated_at"] = stmt.excluded.updated_at
+    await db.execute(stmt.on_conflict_do_update(index_elements=[AssignmentStats.assignment_id], set_=set_))
+
+
+async def _add_words(db: AsyncSession, assignment_id: str, top_words: list[dict]) -> None:
+    counts = Counter()
+    for item in top_words:
+        if item.get("word"):
+            counts[str(item["word"])] += int(item.get("count", 1))
+    if not counts:
+        return
+    # слова по порядку: параллельные транзакции берут блокировки строк в одном порядке и не ловят взаимоблокировку
+    stmt = _insert(AssignmentWord).values(
+        [{"assignment_id": assignment_id, "word": w, "total": n} for (w, n) in sorted(counts.items())]
+    )
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[AssignmentWord.assignment_id, AssignmentWord.word],
+        set_={"total": AssignmentWord.total + stmt.excluded.total},
+    ))
+
+
+async def record(
+    db: AsyncSession, work: Work, plagiarism: bool, source_work_id: str | None, top_words: list[dict]
+) -> None:
+    """Учитывает итог анализа работы в агрегатах её задания; пишет в сессию анализа, commit — у вызывающего.
+
+    Повторный анализ работы меняет только разницу: число работ и слова не удваиваются, флаг плагиата
+    пересчитывается. Работа, совпавшая с более ранней (`source_work_id`), попадает в кластер оригинала;
+    если она сама была оригиналом другого кластера, кластеры сливаются. Из кластера работа не выходит.
+    """
+    outcome = await db.get(WorkOutcome, work.id)
+    deltas = Counter()
+    if outcome is None:
+        outcome = WorkOutcome(work_id=work.id, assignment_id=work.assignment_id, plagiarism=False)
+        db.add(outcome)
+        deltas["works"] += 1
+        await _add_words(db, work.assignment_id, top_words)
+    deltas["plagiarized"] += int(plagiarism) - int(outcome.plagiarism)
+    outcome.plagiarism = plagiarism
+
+    # совпадение по sha256 ищется во всех заданиях; кластеры строятся только внутри задания
+    source = await db.get(WorkOutcome, source_work_id) if plagiarism and source_work_id else None
+    if source is not None and source.assignment_id != work.assignment_id:
+        source_work_id = None
+    elif plagiarism and source is None and source_work_id:
+        source_work = await db.get(Work, source_work_id)
+        if source_work is None or source_work.assignment_id != work.assignment_id:
+            source_work_id = None
+
+    if plagiarism and source_work_id:
+        if source is None:
+            # оригинал проанализирован до появления агрегатов (см. rebuild_analytics.py)
+            root = source_work_id
+            known = (await db.execute(
+                select(WorkOutcome.work_id)
+                .where(WorkOutcome.assignment_id == work.assignment_id, WorkOutcome.cluster_id == root)
+                .limit(1)
+            )).first()
+            if known is None:
+                deltas["clusters"] += 1
+        elif source.cluster_id is None:
+            root = source.cluster_id = source.work_id
+            deltas["clusters"] += 1
+            deltas["clustered_works"] += 1
+        else:
+            root = source.cluster_id
+        if outcome.cluster_id is None:
+            outcome.cluster_id = root
+            deltas["clustered_works"] += 1
+        elif outcome.cluster_id != root:
+            await db.execute(
+                update(WorkOutcome)
+                .where(WorkOutcome.assignment_id == work.assignment_id, WorkOutcome.cluster_id == outcome.cluster_id)
+                .values(cluster_id=root)
+                .execution_options(synchronize_session=False)
+            )
+            outcome.cluster_id = root
+            deltas["clusters"] -= 1
+    await db.flush()
+    await _bump(db, work.assignment_id, **{name: value for name, value in deltas.items() if value})
+
+
+async def summary(db: AsyncSession, assignment_id: str, top: int) -> AssignmentSummary | None:
+    stats = await db.get(AssignmentStats, assignment_id)
+    if stats is None:
+        return None
+    words = (await db.execute(
+        select(AssignmentWord.word, AssignmentWord.total)
+        .where(AssignmentWord.assignment_id == assignment_id)
+        .order_by(AssignmentWord.total.desc(), AssignmentWord.word)
+        .limit(top)
+    )).all()
+    return AssignmentSummary(
+        assignment_id=assignment_id,
+        works=stats.works,
+        plagiarized=stats.plagiarized,
+        plagiarism_rate=round(stats.plagiarized / stats.works, 4) if stats.works else 0.0,
+        duplicate_clusters=stats.clusters,
+        works_in_clusters=stats.clustered_works,
+        top_words=[{"word": w, "count": n} for (w, n) in words],
+        updated_at=stats.updated_at,
+    )
+
+
+async def clusters(db: AsyncSession, assignment_id: str, limit: int) -> list[DuplicateCluster]:
+    """Кластеры дубликатов задания, крупные первыми; читаются только работы, попавшие в кластеры."""
+    rows = (await db.execute(
+        select(WorkOutcome.cluster_id, WorkOutcome.work_id, Work.student_id, Work.submitted_at)
+        .join(Work, Work.id == WorkOutcome.work_id)
+        .where(WorkOutcome.assignment_id == assignment_id, WorkOutcome.cluster_id.is_not(None))
+    )).all()
+    groups: dict[str, list[ClusterMember]] = {}
+    for (cluster_id, work_id, student_id, submitted_at) in rows:
+        groups.setdefault(cluster_id, []).append(
+            ClusterMember(work_id=work_id, student_id=student_id, submitted_at=submitted_at)
+        )
+    result = [
+        DuplicateCluster(cluster_id=cid, size=len(members), works=sorted(members, key=lambda m: m.submitted_at))
+        for cid, members in groups.items()
+    ]
+    result.sort(key=lambda c: (-c.size, c.cluster_id))
+    return result[:limit]
@@ -1,7 +1,17 @@
 from __future__ import annotations
 
+import codecs
 import re
 from collections import Counter
+from functools import lru_cache
+from itertools import filterfalse
+from typing import Iterable, Iterator
+
+from .similarity import MinHasher, ShingleStream
+
+# Версия анализатора: меняется при любом изменении токенизации или статистики,
+# чтобы закэшированные результаты прошлой версии не использовались (см. result_cache.py)
+ANALYZER_VERSION = "2"
 
 # Набор стоп-слов для более осмысленного облака слов
 STOPWORDS = {
@@ -15,15 +25,135 @@ STOPWORDS = {
 }
 
 
-_word_re = re.compile(r"[A-Za-zА-Яа-яЁё]{2,}")
+# Нормализация — один str.lower на весь текст (цикл в C), а не lower() для каждого найденного слова;
+# шаблон ищет слова сразу в нижнем регистре, квантификатор притяжательный (без возвратов, Python 3.11+)
+_word_re = re.compile(r"[a-zа-яё]{2,}+")
+_is_stopword = STOPWORDS.__contains__
+# буквы слова в исходном регистре: по ним от конца чанка отрезается незаконченное слово
+_letters = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+                     "АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯабвгдеёжзийклмнопрстуфхцчшщъыьэюя")
+
+
+def iter_words(text: str) -> Iterator[str]:
+    """Слова текста в нижнем регистре без стоп-слов; стоп-слова отсеиваются лениво, без копии списка."""
+    return filterfalse(_is_stopword, _word_re.findall(text.lower()))
 
 
 def extract_words(text: str) -> list[str]:
-    words = [w.lower() for w in _word_re.findall(text)]
-    words = [w for w in words if w not in STOPWORDS]
-    return words
+    return list(iter_words(text))
 
 
-def top_words(words: list[str], limit: int = 30) -> list[dict]:
+def count_words(text: str, counts: Counter[str]) -> None:
+    """Добавляет в `counts` частоты слов текста за один проход, не собирая список слов."""
+    counts.update(iter_words(text))
+
+
+def top_words(words: Iterable[str], limit: int = 30) -> list[dict]:
     c = Counter(words)
     return [{"word": w, "count": n} for (w, n) in c.most_common(limit)]
+
+
+class WordStream:
+    """Токенизация потока байтов UTF-8 по чанкам.
+
+    Многобайтовый символ, разрезанный границей чанка, дособирается инкрементальным декодером,
+    а незаконченное слово в конце чанка переносится в следующий.
+    """
+
+    # слово длиннее этого режется, чтобы хвост не рос вместе с файлом
+    max_word_chars = 64 * 1024
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self._tail = ""
+        self.bytes = 0
+        self.chars = 0
+
+    def _complete(self, chunk: bytes, final: bool) -> str:
+        """Текст чанка до последнего целого слова; незаконченное слово остаётся в хвосте до следующего чанка."""
+        self.bytes += len(chunk)
+        text = self._decoder.decode(chunk, final)
+        self.chars += len(text)
+        text = self._tail + text
+        self._tail = ""
+        if not final:
+            # хвост ищется с конца: поиск регулярным выражением с якорем $ пробовал бы каждую позицию чанка
+            start = len(text)
+            stop = max(0, start - self.max_word_chars)
+            while start > stop and text[start - 1] in _letters:
+                start -= 1
+            if 0 < len(text) - start < self.max_word_chars:
+                self._tail = text[start:]
+                text = text[:start]
+        return text
+
+    def feed(self, chunk: bytes, final: bool = False) -> list[str]:
+        return extract_words(self._complete(chunk, final))
+
+    def finish(self) -> list[str]:
+        return self.feed(b"", final=True)
+
+    def count(self, chunk: bytes, counts: Counter[str], final: bool = False) -> None:
+        """Как `feed`, но слова сразу добавляются в `counts` (когда порядок слов не нужен)."""
+        count_words(self._complete(chunk, final), counts)
+
+
+@lru_cache(maxsize=4)
+def _minhasher(num_perm: int) -> MinHasher:
+    return MinHasher(num_perm=num_perm)
+
+
+def analyze_chunks(chunks: Iterable[bytes], shingle_size: int, num_perm: int, limit: int = 30) -> dict:
+    """Весь CPU-тяжёлый анализ файла за один проход по чанкам; в памяти только словарь частот и шинглы."""
+    tokens = WordStream()
+    counts: Counter[str] = Counter()
+    window = ShingleStream(size=shingle_size)
+    total = 0
+
+    def consume(words: list[str]) -> None:
+        nonlocal total
+        total += len(words)
+        counts.update(words)
+        window.feed(words)
+
+    for chunk in chunks:
+        consume(tokens.feed(chunk))
+    consume(tokens.finish())
+    work_shingles = window.finish()
+
+    return {
+        "stats": {
+            "bytes": tokens.bytes,
+            "approx_chars": tokens.chars,
+            "words": total,
+        },
+        "top_words": [{"word": w, "count": n} for (w, n) in counts.most_common(limit)],
+        "shingles": work_shingles,
+        "signature": _minhasher(num_perm).signature(work_shingles) if work_shingles else None,
+    }
+
+
+def _read_chunks(path: str, chunk_size: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def analyze_file(path: str, shingle_size: int, num_perm: int, limit: int = 30, chunk_size: int = 1024 * 1024) -> dict:
+    """Анализ файла с диска по чанкам; выполняется в пуле процессов (см. cpu_pool.py)."""
+    return analyze_chunks(_read_chunks(path, chunk_size), shingle_size, num_perm, limit=limit)
+
+
+def word_counts_file(path: str, chunk_size: int = 1024 * 1024) -> dict[str, int]:
+    """Частоты всех слов файла (`extract_words` по чанкам) для матрицы документ-термин, см. cohort.py."""
+    tokens = WordStream()
+    counts: Counter[str] = Counter()
+    for chunk in _read_chunks(path, chunk_size):
+        tokens.count(chunk, counts)
+    tokens.count(b"", counts, final=True)
+    return dict(counts)
+
+
+def word_counts_files(paths: list[str | None]) -> list[dict[str, int]]:
+    """`word_counts_file` для пачки файлов одним вызовом пула процессов; None — пустой словарь."""
+    return [word_counts_file(p) if p is not None else {} for p in paths]
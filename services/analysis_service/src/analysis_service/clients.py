@@ -1,34 +1,99 @@
 from __future__ import annotations
 
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from urllib.parse import unquote
+
 import httpx
 from .config import settings
+from .metrics import downstream_seconds
+from . import tracing
 
 
 class FileServiceUnavailable(RuntimeError):
     pass
 
 
-async def get_file_meta(file_id: str) -> dict:
-    url = f"{settings.file_service_url.rstrip('/')}/files/{file_id}/meta"
+# Общий клиент с пулом keep-alive соединений к File Service; живёт вместе с приложением
+_client: httpx.AsyncClient | None = None
+
+
+async def open_client() -> None:
+    global _client
+    _client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive_connections,
+            keepalive_expiry=settings.http_keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(settings.http_default_timeout, connect=settings.http_connect_timeout),
+        http2=settings.http2,
+        event_hooks={"request": [tracing.inject_traceparent]},
+    )
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _http() -> httpx.AsyncClient:
+    if _client is None:
+        raise RuntimeError("HTTP client is not started")
+    return _client
+
+
+def _timeout(seconds: float) -> httpx.Timeout:
+    return httpx.Timeout(seconds, connect=settings.http_connect_timeout)
+
+
+def _meta_from_headers(file_id: str, resp: httpx.Response) -> dict:
+    h = resp.headers
+    return {
+        "id": h.get("x-file-id", file_id),
+        "original_filename": unquote(h.get("x-file-name", "")),
+        "content_type": h.get("content-type", "application/octet-stream"),
+        "size_bytes": int(h["x-file-size"]),
+        "sha256": h["x-file-sha256"],
+        "created_at": h.get("x-file-created-at"),
+    }
+
+
+async def _body_chunks(resp: httpx.Response) -> AsyncIterator[bytes]:
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            resp = await client.get(url)
-        if resp.status_code == 404:
-            raise FileNotFoundError("File not found")
-        resp.raise_for_status()
-        return resp.json()
-    except (httpx.ConnectError, httpx.ReadTimeout) as e:
-        raise FileServiceUnavailable(str(e))
+        async for chunk in resp.aiter_bytes():
+            yield chunk
+    except (httpx.ReadTimeout, httpx.ReadError, httpx.RemoteProtocolError) as e:
+        raise FileServiceUnavailable(f"File download interrupted: {e}")
+
 
+@asynccontextmanager
+async def open_file(file_id: str) -> AsyncIterator[tuple[dict, AsyncIterator[bytes]]]:
+    """Метаданные и поток содержимого файла одним запросом (`GET /files/{id}/content`).
 
-async def download_file_bytes(file_id: str) -> bytes:
-    url = f"{settings.file_service_url.rstrip('/')}/files/{file_id}/download"
+    Метаданные приходят в заголовках, тело читается чанками по мере итерации и не копится в памяти;
+    если тело не нужно, достаточно выйти из контекста — соединение закроется без его чтения.
+    """
+    url = f"{settings.file_service_url.rstrip('/')}/files/{file_id}/content"
+    t0 = time.perf_counter()
+    outcome = "error"
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.get(url)
-        if resp.status_code == 404:
-            raise FileNotFoundError("File not found")
-        resp.raise_for_status()
-        return resp.content
-    except (httpx.ConnectError, httpx.ReadTimeout) as e:
+        # спан охватывает и чтение тела: этап download вызывающего — вложенный спан
+        with tracing.span("file_service.open_file", kind=tracing.CLIENT, file_id=file_id):
+            async with _http().stream("GET", url, timeout=_timeout(settings.download_timeout)) as resp:
+                if resp.status_code in (404, 410):
+                    outcome = "not_found"
+                    raise FileNotFoundError("File not found")
+                resp.raise_for_status()
+                # время до заголовков ответа; чтение тела снимается этапом download
+                outcome = "ok"
+                downstream_seconds.labels(service="file_service", call="open_file", outcome=outcome).observe(time.perf_counter() - t0)
+                yield _meta_from_headers(file_id, resp), _body_chunks(resp)
+    except (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadTimeout, httpx.PoolTimeout) as e:
         raise FileServiceUnavailable(str(e))
+    finally:
+        if outcome != "ok":
+            downstream_seconds.labels(service="file_service", call="open_file", outcome=outcome).observe(time.perf_counter() - t0)
@@ -0,0 +1,301 @@
+"""Матрица попарной близости работ задания и top-k ближайших соседей каждой работы (расчёт после дедлайна).
+
+Частоты слов работ (`extract_words`, см. analyzer.word_counts_file) собираются в разреженную матрицу
+документ-термин, близость (косинусная или Жаккара по множествам слов) — произведение разреженных матриц
+блоками по `SIMILARITY_BLOCK_ROWS` строк: в памяти одновременно только блок строки × работы задания.
+Сохраняются top-k соседей каждой работы (таблица work_neighbors), статус расчёта — в similarity_runs.
+
+Запускается `POST /assignments/{id}/similarity` или из консоли (в контейнере analysis-service):
+    python -m analysis_service.cohort --assignment hw1 --metric cosine --k 10
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime as dt
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import and_, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .analyzer import word_counts_files
+from .clients import open_file, open_client, close_client
+from .config import settings
+from .cpu_pool import analysis_pool
+from .db import AsyncSessionLocal, engine, init_db
+from .models import SimilarityRun, Work, WorkNeighbor
+from .storage import spool_to_file
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("cosine", "jaccard")
+
+
+def term_matrix(docs: list[dict[str, int]]) -> sparse.csr_matrix:
+    """Разреженная матрица документ-термин: строка — документ, значение — частота слова в нём."""
+    vocab: dict[str, int] = {}
+    indptr = np.zeros(len(docs) + 1, dtype=np.int64)
+    indices: list[int] = []
+    data: list[int] = []
+    for row, counts in enumerate(docs):
+        indices.extend(vocab.setdefault(w, len(vocab)) for w in counts)
+        data.extend(counts.values())
+        indptr[row + 1] = len(indices)
+    return sparse.csr_matrix(
+        (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int64), indptr),
+        shape=(len(docs), len(vocab)),
+    )
+
+
+def top_neighbors(matrix: sparse.csr_matrix, metric: str, k: int, block_rows: int) -> tuple[np.ndarray, np.ndarray]:
+    """Для каждой строки матрицы — номера k самых близких других строк и их близость, по убыванию.
+
+    Близость блока строк со всеми строками — одно разреженное произведение X[блок] · Xᵀ; для Жаккара
+    оно даёт размеры пересечений множеств слов, объединение — |A| + |B| - |A ∩ B|.
+    Соседи с нулевой близостью не возвращаются: на их месте номер -1.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown similarity metric: {metric}")
+    n = matrix.shape[0]
+    k = max(0, min(k, n - 1))
+    neighbors = np.full((n, k), -1, dtype=np.int64)
+    scores = np.zeros((n, k), dtype=np.float32)
+    if k == 0:
+        return neighbors, scores
+
+    sizes = None
+    if metric == "cosine":
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1), dtype=np.float32).ravel())
+        inv = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        x = (sparse.diags(inv) @ matrix).tocsr()
+    else:
+        x = matrix.copy()
+        x.data[:] = 1.0
+        sizes = np.asarray(x.sum(axis=1), dtype=np.float32).ravel()
+    xt = x.T.tocsr()
+
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        block = (x[start:stop] @ xt).toarray()
+        if sizes is not None:
+            union = sizes[start:stop, None] + sizes[None, :] - block
+            np.divide(block, union, out=block, where=union > 0)
+        block[np.arange(stop - start), np.arange(start, stop)] = -1.0  # работа сама с собой
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        top[top_scores <= 0] = -1
+        neighbors[start:stop] = top
+        scores[start:stop] = np.clip(top_scores, 0.0, 1.0)  # погрешность float32 у косинуса
+    return neighbors, scores
+
+
+def _neighbors(docs: list[dict[str, int]], metric: str, k: int, block_rows: int):
+    matrix = term_matrix(docs)
+    return (matrix, *top_neighbors(matrix, metric, k, block_rows))
+
+
+async def _download(file_id: str, slots: asyncio.Semaphore) -> Path | None:
+    """Скачивает файл во временный файл в `spool_dir`; None — файла нет или он слишком велик для разбора."""
+    async with slots:
+        try:
+            async with open_file(file_id) as (meta, chunks):
+                if meta["size_bytes"] > settings.analysis_max_bytes:
+                    return None
+                return await spool_to_file(chunks)
+        except FileNotFoundError:
+            return None
+
+
+async def _word_counts(file_ids: list[str], slots: asyncio.Semaphore) -> list[dict[str, int]]:
+    """Частоты слов пачки файлов: файлы скачиваются параллельно и разбираются одним вызовом пула процессов."""
+    paths = await asyncio.gather(*(_download(file_id, slots) for file_id in file_ids), return_exceptions=True)
+    try:
+        for p in paths:
+            if isinstance(p, BaseException):
+                raise p
+        return await analysis_pool.run(word_counts_files, [str(p) if p is not None else None for p in paths])
+    finally:
+        for p in paths:
+            if isinstance(p, Path):
+                p.unlink(missing_ok=True)
+
+
+async def start(db: AsyncSession, assignment_id: str, metric: str, k: int) -> SimilarityRun | None:
+    """Отмечает расчёт задания запущенным; None — расчёт с этой метрикой уже идёт."""
+    now = dt.datetime.utcnow()
+    values = dict(status="RUNNING", k=k, works=0, vocabulary=0, error=None, started_at=now, finished_at=None)
+    res = await db.execute(
+        update(SimilarityRun)
+        .where(
+            SimilarityRun.assignment_id == assignment_id,
+            SimilarityRun.metric == metric,
+            SimilarityRun.status != "RUNNING",
+        )
+        .values(**values)
+    )
+    if res.rowcount == 0:
+        if await db.get(SimilarityRun, (assignment_id, metric)) is not None:
+            await db.rollback()
+            return None
+        db.add(SimilarityRun(assignment_id=assignment_id, metric=metric, **values))
+    try:
+        await db.commit()
+    except IntegrityError:
+        # параллельный запрос успел создать запись о расчёте
+        await db.rollback()
+        return None
+    return await db.get(SimilarityRun, (assignment_id, metric))
+
+
+async def fail_interrupted(db: AsyncSession, stale_after: float = 0.0) -> int:
+    """Помечает FAILED расчёты, прерванные остановкой сервиса (правило то же, что у requeue_running)."""
+    stale = SimilarityRun.status == "RUNNING"
+    if stale_after > 0:
+        stale = and_(stale, SimilarityRun.started_at < dt.datetime.utcnow() - dt.timedelta(seconds=stale_after))
+    res = await db.execute(
+        update(SimilarityRun)
+        .where(stale)
+        .values(status="FAILED", error="Interrupted by service restart", finished_at=dt.datetime.utcnow())
+    )
+    await db.commit()
+    return res.rowcount
+
+
+async def _finish(assignment_id: str, metric: str, **values) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(SimilarityRun)
+            .where(SimilarityRun.assignment_id == assignment_id, SimilarityRun.metric == metric)
+            .values(finished_at=dt.datetime.utcnow(), **values)
+        )
+        await db.commit()
+
+
+async def compute(assignment_id: str, metric: str, k: int) -> None:
+    """Считает матрицу близости задания и перезаписывает соседей его работ (расчёт уже отмечен `start`)."""
+    try:
+        await _compute(assignment_id, metric, k)
+    except Exception as e:
+        logger.exception("Similarity matrix for assignment %s failed", assignment_id)
+        await _finish(assignment_id, metric, status="FAILED", error=str(e) or type(e).__name__)
+
+
+async def _compute(assignment_id: str, metric: str, k: int) -> None:
+    t0 = time.monotonic()
+    async with AsyncSessionLocal() as db:
+        works = (await db.execute(
+            select(Work.id, Work.file_id, Work.file_sha256)
+            .where(Work.assignment_id == assignment_id)
+            .order_by(Work.submitted_at, Work.id)
+        )).all()
+
+    # одинаковое содержимое (тот же sha256) скачивается и разбирается один раз
+    files: dict[str, str] = {}
+    for w in works:
+        files.setdefault(w.file_sha256, w.file_id)
+    # файлы разбираются пачками: на вызов пула процессов приходится не один файл, а SIMILARITY_BATCH_FILES;
+    # одновременно в работе не больше двух пачек на процесс, поэтому временных файлов на диске ограниченное число
+    downloads = asyncio.Semaphore(settings.similarity_fetch_concurrency)
+    batches = asyncio.Semaphore(2 * settings.analysis_processes)
+    file_ids = list(files.values())
+
+    async def batch(start: int) -> list[dict[str, int]]:
+        async with batches:
+            return await _word_counts(file_ids[start:start + settings.similarity_batch_files], downloads)
+
+    parts = await asyncio.gather(*(batch(i) for i in range(0, len(file_ids), settings.similarity_batch_files)))
+    counts = dict(zip(files, (c for part in parts for c in part)))
+    t1 = time.monotonic()
+
+    matrix, neighbors, scores = await asyncio.to_thread(
+        _neighbors, [counts[w.file_sha256] for w in works], metric, k, settings.similarity_block_rows
+    )
+    t2 = time.monotonic()
+
+    rows = [
+        {
+            "work_id": w.id,
+            "metric": metric,
+            "rank": rank,
+            "assignment_id": assignment_id,
+            "neighbor_work_id": works[j].id,
+            "score": round(float(score), 4),
+        }
+        for (i, w) in enumerate(works)
+        for rank, (j, score) in enumerate(zip(neighbors[i].tolist(), scores[i].tolist()), start=1)
+        if j >= 0
+    ]
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            delete(WorkNeighbor).where(WorkNeighbor.assignment_id == assignment_id, WorkNeighbor.metric == metric)
+        )
+        if rows:
+            await db.execute(insert(WorkNeighbor), rows)
+        await db.commit()
+    await _finish(assignment_id, metric, status="COMPLETED", works=len(works), vocabulary=matrix.shape[1])
+    logger.info(
+        "Similarity matrix for assignment %s: %d works, %d words, fetch %.2fs, matrix %.2fs, total %.2fs",
+        assignment_id, len(works), matrix.shape[1], t1 - t0, t2 - t1, time.monotonic() - t0,
+    )
+
+
+async def neighbors_of(db: AsyncSession, assignment_id: str, metric: str, work_id: str | None = None) -> dict[str, list[dict]]:
+    """Сохранённые соседи работ задания: work_id -> [{"work_id", "score"}], по убыванию близости."""
+    query = (
+        select(WorkNeighbor.work_id, WorkNeighbor.neighbor_work_id, WorkNeighbor.score)
+        .where(WorkNeighbor.assignment_id == assignment_id, WorkNeighbor.metric == metric)
+        .order_by(WorkNeighbor.work_id, WorkNeighbor.rank)
+    )
+    if work_id is not None:
+        query = query.where(WorkNeighbor.work_id == work_id)
+    result: dict[str, list[dict]] = {}
+    for (wid, neighbor_id, score) in await db.execute(query):
+        result.setdefault(wid, []).append({"work_id": neighbor_id, "score": score})
+    return result
+
+
+async def _run_once(assignment_id: str, metric: str, k: int) -> None:
+    await init_db()
+    await open_client()
+    analysis_pool.start()
+    try:
+        async with AsyncSessionLocal() as db:
+            run = await start(db, assignment_id, metric, k)
+        if run is None:
+            print(f"similarity matrix for {assignment_id} ({metric}) is already being computed")
+            return
+        t0 = time.monotonic()
+        await compute(assignment_id, metric, k)
+        async with AsyncSessionLocal() as db:
+            run = await db.get(SimilarityRun, (assignment_id, metric))
+        print(
+            f"{run.status}: {run.works} works, {run.vocabulary} words, {time.monotonic() - t0:.2f}s"
+            + (f", error: {run.error}" if run.error else "")
+        )
+    finally:
+        analysis_pool.shutdown()
+        await close_client()
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--assignment", required=True)
+    parser.add_argument("--metric", choices=METRICS, default="cosine")
+    parser.add_argument("--k", type=int, default=settings.similarity_top_k)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(_run_once(args.assignment, args.metric, args.k))
+
+
+if __name__ == "__main__":
+    main()
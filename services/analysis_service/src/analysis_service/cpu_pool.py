@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+from .config import settings
+from .metrics import pool_tasks, stage
+
+
+class PoolSaturated(RuntimeError):
+    pass
+
+
+class AnalysisPool:
+    """Пул процессов для CPU-тяжёлого анализа текста, чтобы не блокировать event loop.
+
+    Число задач в пуле (выполняемых и ожидающих) ограничено `max_pending`: остальные
+    вызывающие ждут свободного места не дольше `acquire_timeout` секунд, затем получают PoolSaturated.
+    """
+
+    def __init__(self, processes: int, max_pending: int, acquire_timeout: float):
+        self.processes = processes
+        self.max_pending = max_pending
+        self.acquire_timeout = acquire_timeout
+        self._executor: ProcessPoolExecutor | None = None
+        self._slots: asyncio.Semaphore | None = None
+
+    def start(self) -> None:
+        # spawn, а не fork: дочерние процессы не наследуют сокеты, обработчики сигналов uvicorn и соединения с БД
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self._slots = asyncio.Semaphore(self.max_pending)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self._executor is None or self._slots is None:
+            raise RuntimeError("Analysis pool is not started")
+        try:
+            with stage("pool_wait"):
+                await asyncio.wait_for(self._slots.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise PoolSaturated(f"All {self.max_pending} analysis slots are busy")
+        pool_tasks.inc()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            pool_tasks.dec()
+            self._slots.release()
+
+
+analysis_pool = AnalysisPool(
+    processes=settings.analysis_processes,
+    max_pending=settings.analysis_max_pending,
+    acquire_timeout=settings.analysis_pool_acquire_timeout,
+)
@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import logging
+import bisect
+import uuid
+
+from sqlalchemy import select, update, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .clients import FileServiceUnavailable
+from .cpu_pool import PoolSaturated
+from .db import AsyncSessionLocal
+from .metrics import stage, workers_busy
+from .models import AnalysisJob
+from .pipeline import commit_analysis, run_analysis
+from .schemas import CreateReportRequest
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+
+def _new_job(req: CreateReportRequest, created_at: dt.datetime) -> AnalysisJob:
+    return AnalysisJob(
+        id=str(uuid.uuid4()),
+        work_id=req.work_id,
+        student_id=req.student_id,
+        assignment_id=req.assignment_id,
+        submitted_at=req.submitted_at,
+        file_id=req.file_id,
+        file_sha256=req.file_sha256,
+        status="QUEUED",
+        trace_parent=tracing.current_traceparent(),
+        created_at=created_at,
+        updated_at=created_at,
+    )
+
+
+async def enqueue(db: AsyncSession, req: CreateReportRequest) -> AnalysisJob:
+    """Ставит анализ работы в очередь (таблица analysis_jobs)."""
+    job = _new_job(req, dt.datetime.utcnow())
+    db.add(job)
+    await db.commit()
+    return job
+
+
+async def enqueue_many(db: AsyncSession, reqs: list[CreateReportRequest]) -> list[AnalysisJob]:
+    """Ставит в очередь пачку анализов одной транзакцией, сохраняя их порядок.
+
+    Очередь разбирается по created_at, поэтому заданиям пачки выдаются возрастающие метки
+    (с шагом в микросекунду), чтобы порядок не зависел от разрешения часов.
+    """
+    now = dt.datetime.utcnow()
+    jobs = [_new_job(req, now + dt.timedelta(microseconds=i)) for (i, req) in enumerate(reqs)]
+    db.add_all(jobs)
+    await db.commit()
+    return jobs
+
+
+async def claim_next(db: AsyncSession) -> AnalysisJob | None:
+    """Атомарно переводит самое старое QUEUED-задание в RUNNING и возвращает его."""
+    while True:
+        job_id = (await db.execute(
+            select(AnalysisJob.id)
+            .where(AnalysisJob.status == "QUEUED")
+            .order_by(AnalysisJob.created_at.asc(), AnalysisJob.id.asc())
+            .limit(1)
+        )).scalar_one_or_none()
+        if job_id is None:
+            return None
+        res = await db.execute(
+            update(AnalysisJob)
+            .where(AnalysisJob.id == job_id, AnalysisJob.status == "QUEUED")
+            .values(status="RUNNING", attempts=AnalysisJob.attempts + 1, updated_at=dt.datetime.utcnow())
+        )
+        await db.commit()
+        if res.rowcount == 1:
+            job = await db.get(AnalysisJob, job_id)
+            # завершаем чтение: соединение возвращается в пул, пока задание скачивает и разбирает файл
+            await db.commit()
+            return job
+        # задание уже забрал другой воркер — пробуем следующее
+
+
+def _running(stale_after: float):
+    """Условие «задание выполняется»; задания, не обновлявшиеся дольше `stale_after` секунд, считаются брошенными."""
+    cond = AnalysisJob.status == "RUNNING"
+    if stale_after > 0:
+        cond = and_(cond, AnalysisJob.updated_at >= dt.datetime.utcnow() - dt.timedelta(seconds=stale_after))
+    return cond
+
+
+async def requeue_running(db: AsyncSession, stale_after: float = 0.0) -> int:
+    """Возвращает в очередь задания, прерванные остановкой сервиса.
+
+    С `stale_after` > 0 (несколько реплик на общей БД) возвращаются только брошенные задания:
+    остальные RUNNING-задания выполняют другие реплики.
+    """
+    stale = AnalysisJob.status == "RUNNING"
+    if stale_after > 0:
+        stale = and_(stale, AnalysisJob.updated_at < dt.datetime.utcnow() - dt.timedelta(seconds=stale_after))
+    res = await db.execute(
+        update(AnalysisJob)
+        .where(stale)
+        .values(status="QUEUED", updated_at=dt.datetime.utcnow())
+    )
+    await db.commit()
+    return res.rowcount
+
+
+async def heartbeat(job_id: str, interval: float) -> None:
+    """Раз в `interval` секунд обновляет updated_at выполняемого задания, пока задачу не отменят.
+
+    Без этого долгий анализ (updated_at ставится только при взятии) через stale_after выглядел бы брошенным:
+    стартующая реплика вернула бы его в очередь, а более поздние сдачи перестали бы его ждать.
+    Своя сессия: сессия воркера занята транзакцией анализа.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(AnalysisJob)
+                    .where(AnalysisJob.id == job_id, AnalysisJob.status == "RUNNING")
+                    .values(updated_at=dt.datetime.utcnow())
+                )
+                await db.commit()
+        except Exception:
+            # пропущенный такт не страшен: до stale_after их ещё два
+            logger.warning("Heartbeat of analysis job %s failed", job_id, exc_info=True)
+
+
+async def _rollback(db: AsyncSession, job: AnalysisJob) -> None:
+    """Откатывает незавершённый анализ и перечитывает задание: rollback сбрасывает загруженные атрибуты."""
+    await db.rollback()
+    await db.refresh(job)
+
+
+async def wait_for_earlier(job: AnalysisJob, stale_after: float, poll_interval: float = 0.2) -> None:
+    """Ждёт, пока не завершатся более ранние задания того же assignment, выполняемые другими репликами.
+
+    Внутри процесса порядок держит _AssignmentTurnstile; на общей БД ранняя сдача может анализироваться
+    в другом процессе. Порядок — (created_at, id), тот же, что у очереди и турникета, поэтому циклов ожидания нет.
+    """
+    earlier = and_(
+        AnalysisJob.assignment_id == job.assignment_id,
+        AnalysisJob.id != job.id,
+        or_(
+            AnalysisJob.created_at < job.created_at,
+            and_(AnalysisJob.created_at == job.created_at, AnalysisJob.id < job.id),
+        ),
+    )
+    while True:
+        async with AsyncSessionLocal() as db:
+            running = (await db.execute(
+                select(AnalysisJob.id).where(earlier, _running(stale_after)).limit(1)
+            )).scalar_one_or_none()
+        if running is None:
+            return
+        await asyncio.sleep(poll_interval)
+
+
+class _AssignmentTurnstile:
+    """Пропускает проверки на плагиат заданий одного assignment строго по порядку (created_at, id).
+
+    Иначе более поздняя копия, обработанная параллельно с оригиналом, не увидела бы его в БД.
+    Повторно взятое (после сбоя) более раннее задание встаёт в очередь перед более поздними.
+    """
+
+    def __init__(self):
+        self._queues: dict[str, list[tuple[dt.datetime, str]]] = {}
+        self._cond = asyncio.Condition()
+
+    def register(self, job: AnalysisJob) -> None:
+        bisect.insort(self._queues.setdefault(job.assignment_id, []), (job.created_at, job.id))
+
+    async def wait_turn(self, job: AnalysisJob) -> None:
+        queue = self._queues[job.assignment_id]
+        async with self._cond:
+            await self._cond.wait_for(lambda: queue[0][1] == job.id)
+
+    async def release(self, job: AnalysisJob) -> None:
+        async with self._cond:
+            queue = self._queues.get(job.assignment_id)
+            key = (job.created_at, job.id)
+            if queue is not None and key in queue:
+                queue.remove(key)
+                if not queue:
+                    del self._queues[job.assignment_id]
+            self._cond.notify_all()
+
+
+class WorkerPool:
+    """Пул asyncio-воркеров, разбирающих очередь анализа.
+
+    Воркеры просыпаются по `notify()` при постановке задания либо раз в `poll_interval` секунд.
+    Скачивание и токенизация идут параллельно, проверки на плагиат внутри задания — по порядку.
+    """
+
+    def __init__(self, concurrency: int, poll_interval: float, max_attempts: int, stale_after: float = 0.0):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.stale_after = stale_after
+        self._wakeup = asyncio.Event()
+        self._turnstile = _AssignmentTurnstile()
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                processed = await self._process_one()
+            except Exception:
+                logger.exception("Analysis worker iteration failed")
+                processed = False
+            if processed:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _process_one(self) -> bool:
+        async with AsyncSessionLocal() as db:
+            job = await claim_next(db)
+            if job is None:
+                return False
+            self._turnstile.register(job)
+            workers_busy.inc()
+            # с stale_after задание отмечается живым втрое чаще порога, так что его не сочтут брошенным
+            beat = asyncio.create_task(heartbeat(job.id, self.stale_after / 3)) if self.stale_after > 0 else None
+            try:
+                with tracing.span("analysis_job", parent=job.trace_parent or "", job_id=job.id, work_id=job.work_id,
+                                  attempt=job.attempts):
+                    await self._run_job(job, db)
+            finally:
+                if beat is not None:
+                    beat.cancel()
+                    await asyncio.gather(beat, return_exceptions=True)
+                workers_busy.dec()
+                await self._turnstile.release(job)
+            return True
+
+    async def _wait_turn(self, job: AnalysisJob) -> None:
+        with stage("turn_wait"):
+            await self._turnstile.wait_turn(job)
+            await wait_for_earlier(job, self.stale_after)
+
+    async def _run_job(self, job: AnalysisJob, db: AsyncSession) -> None:
+        req = CreateReportRequest(
+            work_id=job.work_id,
+            student_id=job.student_id,
+            assignment_id=job.assignment_id,
+            submitted_at=job.submitted_at,
+            file_id=job.file_id,
+            file_sha256=job.file_sha256,
+        )
+        try:
+            report = await run_analysis(req, db, before_checks=lambda: self._wait_turn(job))
+        except FileServiceUnavailable as e:
+            await _rollback(db, job)
+            # файл может стать доступен позже — повторяем, пока не кончатся попытки
+            job.status = "QUEUED" if job.attempts < self.max_attempts else "FAILED"
+            job.error = f"File service unavailable: {e}"
+        except PoolSaturated as e:
+            await _rollback(db, job)
+            # пул процессов перегружен — задание вернётся в очередь без траты попытки
+            job.status = "QUEUED"
+            job.attempts -= 1
+            job.error = str(e)
+        except FileNotFoundError:
+            await _rollback(db, job)
+            job.status = "FAILED"
+            job.error = "File not found in file service"
+        except Exception as e:
+            await _rollback(db, job)
+            logger.exception("Analysis job %s failed (trace %s)", job.id, tracing.current_trace_id())
+            job.status = "FAILED"
+            job.error = str(e)
+        else:
+            job.status = "COMPLETED"
+            job.report_id = report.id
+            job.error = None
+        job.updated_at = dt.datetime.utcnow()
+        await commit_analysis(db)
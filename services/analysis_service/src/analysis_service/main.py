@@ -1,40 +1,74 @@
+import asyncio
 import json
-import uuid
 from pathlib import Path
 
-import httpx
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
 from fastapi.responses import FileResponse, Response
-from sqlalchemy.orm import Session
-from sqlalchemy import select, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
 
 from .config import settings
-from .db import SessionLocal, init_db
-from .models import Work, Report
+from .db import AsyncSessionLocal, get_db, init_db
+from .models import Report, AnalysisJob, SimilarityRun
 from .schemas import (
     CreateReportRequest,
     CreateReportResponse,
     ReportSummary,
     ReportContent,
+    JobOut,
+    AssignmentSummary,
+    DuplicateCluster,
+    SimilarityMatrix,
+    SimilarityRunOut,
+    WorkNeighbors,
 )
-from .clients import get_file_meta, download_file_bytes, FileServiceUnavailable
-from .analyzer import extract_words, top_words
+from .clients import FileServiceUnavailable, open_client, close_client
+from .pipeline import commit_analysis, run_analysis
+from . import analytics, cohort, report_store, word_cloud
+from .report_store import report_cache
+from .cpu_pool import analysis_pool, PoolSaturated
+from .jobs import WorkerPool, enqueue, enqueue_many, requeue_running
+from .metrics import MetricsMiddleware, jobs_queued, render
+from .tracing import TracingMiddleware
 
 app = FastAPI(title="File Analysis Service", version="1.0.0")
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+
+worker_pool = WorkerPool(
+    concurrency=settings.analysis_workers,
+    poll_interval=settings.job_poll_interval,
+    max_attempts=settings.job_max_attempts,
+    stale_after=settings.job_stale_after,
+)
 
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# расчёты матрицы близости (cohort.py), запущенные этим процессом
+_similarity_tasks: set[asyncio.Task] = set()
 
 
 @app.on_event("startup")
-def _startup():
+async def _startup():
     Path(settings.reports_dir).mkdir(parents=True, exist_ok=True)
-    init_db()
+    Path(settings.shingle_index_dir).mkdir(parents=True, exist_ok=True)
+    Path(settings.spool_dir).mkdir(parents=True, exist_ok=True)
+    Path(settings.wordcloud_dir).mkdir(parents=True, exist_ok=True)
+    await init_db()
+    async with AsyncSessionLocal() as db:
+        await requeue_running(db, settings.job_stale_after)
+        await cohort.fail_interrupted(db, settings.job_stale_after)
+    await open_client()
+    analysis_pool.start()
+    worker_pool.start()
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await worker_pool.stop()
+    for task in _similarity_tasks:
+        task.cancel()
+    await asyncio.gather(*_similarity_tasks, return_exceptions=True)
+    analysis_pool.shutdown()
+    await close_client()
 
 
 @app.get("/health")
@@ -42,6 +76,18 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics(db: AsyncSession = Depends(get_db)):
+    # глубина очереди — из БД (её видят все реплики), один GROUP BY на опрос, а не на каждое задание
+    counts = dict((await db.execute(
+        select(AnalysisJob.status, func.count()).group_by(AnalysisJob.status)
+    )).all())
+    for status in ("QUEUED", "RUNNING", "COMPLETED", "FAILED"):
+        jobs_queued.labels(status=status).set(counts.get(status, 0))
+    body, content_type = render()
+    return Response(content=body, media_type=content_type)
+
+
 def _report_summary(r: Report) -> ReportSummary:
     return ReportSummary(
         id=r.id,
@@ -51,191 +97,214 @@ def _report_summary(r: Report) -> ReportSummary:
         plagiarism_reason=r.plagiarism_reason,
         plagiarized_from_work_id=r.plagiarized_from_work_id,
         plagiarized_from_student_id=r.plagiarized_from_student_id,
+        similarity_score=r.similarity_score,
+        similar_work_id=r.similar_work_id,
+        containment_score=r.containment_score,
         created_at=r.created_at,
     )
 
 
 @app.post("/reports", response_model=CreateReportResponse)
-async def create_report(req: CreateReportRequest, db: Session = Depends(get_db)):
-    # 1) Получаем sha256 у File Service (он отвечает за подсчёт хеша при загрузке)
+async def create_report(req: CreateReportRequest, db: AsyncSession = Depends(get_db)):
     try:
-        meta = await get_file_meta(req.file_id)
+        record = await run_analysis(req, db)
+        await commit_analysis(db)
     except FileServiceUnavailable as e:
         raise HTTPException(status_code=503, detail=f"File service unavailable: {e}")
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found in file service")
+    except PoolSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    return CreateReportResponse(report=_report_summary(record))
 
-    file_sha256 = meta["sha256"]
-
-    # 2) Upsert Work (храним копию метаданных для поиска ранних сдач)
-    work = db.get(Work, req.work_id)
-    if not work:
-        work = Work(
-            id=req.work_id,
-            student_id=req.student_id,
-            assignment_id=req.assignment_id,
-            submitted_at=req.submitted_at,
-            file_id=req.file_id,
-            file_sha256=file_sha256,
-        )
-        db.add(work)
-        db.commit()
-        db.refresh(work)
-    else:
-        # если повторный анализ — обновим поля, если они поменялись
-        work.student_id = req.student_id
-        work.assignment_id = req.assignment_id
-        work.submitted_at = req.submitted_at
-        work.file_id = req.file_id
-        work.file_sha256 = file_sha256
-        db.commit()
-        db.refresh(work)
-
-    # 3) Детект «плагиата» = есть более ранняя сдача другим студентом с тем же sha256
-    earlier = db.execute(
-        select(Work)
-        .where(
-            and_(
-                Work.file_sha256 == file_sha256,
-                Work.submitted_at < req.submitted_at,
-                Work.student_id != req.student_id,
-            )
-        )
-        .order_by(Work.submitted_at.asc())
-        .limit(1)
-    ).scalar_one_or_none()
-
-    plagiarism = earlier is not None
-    plagiarism_reason = None
-    plag_from_work_id = None
-    plag_from_student_id = None
-    if plagiarism:
-        plagiarism_reason = "Earlier identical submission exists (same sha256)."
-        plag_from_work_id = earlier.id
-        plag_from_student_id = earlier.student_id
-
-    # 4) (опционально) небольшой текстовый анализ: топ слов, если файл читается как текст
-    stats = {}
-    top = []
-    try:
-        raw = await download_file_bytes(req.file_id)
-        text = raw.decode("utf-8", errors="ignore")
-        words = extract_words(text)
-        stats = {
-            "bytes": len(raw),
-            "approx_chars": len(text),
-            "words": len(words),
-        }
-        top = top_words(words, limit=30)
-    except FileServiceUnavailable:
-        # не валим весь отчёт: сохраняем отчёт, но без статистики/топ-слов
-        stats = {"warning": "file_service_unavailable_for_text_analysis"}
-    except Exception:
-        stats = {"warning": "failed_to_parse_text"}
-
-    report_id = str(uuid.uuid4())
-    report_path = Path(settings.reports_dir) / f"{report_id}.json"
-
-    # 5) Запись в БД + JSON-файл отчёта на диск
-    record = Report(
-        id=report_id,
-        work_id=req.work_id,
-        status="COMPLETED",
-        plagiarism=plagiarism,
-        plagiarism_reason=plagiarism_reason,
-        plagiarized_from_work_id=plag_from_work_id,
-        plagiarized_from_student_id=plag_from_student_id,
-        report_path=str(report_path),
-    )
-    db.add(record)
-    db.commit()
-    db.refresh(record)
-
-    # теперь created_at уже известен
-    content = ReportContent(
-        report_id=report_id,
-        work_id=req.work_id,
-        created_at=record.created_at,  # <-- ВОТ ЭТО главное
-        status=record.status,
-        plagiarism=record.plagiarism,
-        plagiarism_reason=record.plagiarism_reason,
-        plagiarized_from_work_id=record.plagiarized_from_work_id,
-        plagiarized_from_student_id=record.plagiarized_from_student_id,
-        file_id=req.file_id,
-        file_sha256=file_sha256,
-        stats=stats,
-        top_words=top,
+
+async def _job_out(job: AnalysisJob, db: AsyncSession) -> JobOut:
+    report = await db.get(Report, job.report_id) if job.report_id else None
+    return JobOut(
+        id=job.id,
+        work_id=job.work_id,
+        status=job.status,
+        attempts=job.attempts,
+        report=_report_summary(report) if report else None,
+        error=job.error,
+        created_at=job.created_at,
+        updated_at=job.updated_at,
     )
 
-    report_path.write_text(content.model_dump_json(indent=2), encoding="utf-8")
-    return CreateReportResponse(report=_report_summary(record))
+
+@app.post("/jobs", response_model=JobOut, status_code=202)
+async def create_job(req: CreateReportRequest, db: AsyncSession = Depends(get_db)):
+    """Ставит анализ в очередь и сразу отвечает; отчёт создаст пул воркеров."""
+    job = await enqueue(db, req)
+    worker_pool.notify()
+    return await _job_out(job, db)
+
+
+@app.post("/jobs/batch", response_model=list[JobOut], status_code=202)
+async def create_jobs_batch(reqs: list[CreateReportRequest], db: AsyncSession = Depends(get_db)):
+    """Ставит в очередь пачку анализов одной транзакцией (массовый импорт через gateway)."""
+    jobs = await enqueue_many(db, reqs)
+    worker_pool.notify()
+    return [await _job_out(job, db) for job in jobs]
+
+
+@app.get("/jobs/{job_id}", response_model=JobOut)
+async def get_job(job_id: str, db: AsyncSession = Depends(get_db)):
+    job = await db.get(AnalysisJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return await _job_out(job, db)
 
 
 @app.get("/works/{work_id}/reports", response_model=list[ReportSummary])
-def list_reports_for_work(work_id: str, db: Session = Depends(get_db)):
-    rows = db.execute(select(Report).where(Report.work_id == work_id).order_by(Report.created_at.desc())).scalars().all()
+async def list_reports_for_work(work_id: str, db: AsyncSession = Depends(get_db)):
+    rows = (await db.execute(select(Report).where(Report.work_id == work_id).order_by(Report.created_at.desc()))).scalars().all()
     return [_report_summary(r) for r in rows]
 
 
-@app.get("/reports/{report_id}", response_model=ReportContent)
-def get_report_content(report_id: str, db: Session = Depends(get_db)):
-    r = db.get(Report, report_id)
+@app.get("/assignments/{assignment_id}/summary", response_model=AssignmentSummary)
+async def assignment_summary(
+    assignment_id: str, top: int = Query(20, ge=0, le=200), db: AsyncSession = Depends(get_db)
+):
+    """Сводка по заданию из агрегатов (analytics.py): число работ, доля плагиата, кластеры, частые слова."""
+    result = await analytics.summary(db, assignment_id, top)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Assignment not found")
+    return result
+
+
+@app.get("/assignments/{assignment_id}/clusters", response_model=list[DuplicateCluster])
+async def assignment_clusters(
+    assignment_id: str, limit: int = Query(100, ge=1, le=1000), db: AsyncSession = Depends(get_db)
+):
+    """Группы работ задания с одинаковым или почти одинаковым текстом, крупные первыми."""
+    return await analytics.clusters(db, assignment_id, limit)
+
+
+def _similarity_run_out(run: SimilarityRun) -> SimilarityRunOut:
+    return SimilarityRunOut(
+        assignment_id=run.assignment_id,
+        metric=run.metric,
+        status=run.status,
+        k=run.k,
+        works=run.works,
+        vocabulary=run.vocabulary,
+        error=run.error,
+        started_at=run.started_at,
+        finished_at=run.finished_at,
+    )
+
+
+@app.post("/assignments/{assignment_id}/similarity", response_model=SimilarityRunOut, status_code=202)
+async def start_similarity(
+    assignment_id: str,
+    metric: str = Query("cosine", pattern="^(cosine|jaccard)$"),
+    k: int = Query(settings.similarity_top_k, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+):
+    """Запускает в фоне расчёт матрицы попарной близости работ задания (cohort.py) и сразу отвечает."""
+    run = await cohort.start(db, assignment_id, metric, k)
+    if run is None:
+        raise HTTPException(status_code=409, detail="Similarity matrix is already being computed")
+    task = asyncio.create_task(cohort.compute(assignment_id, metric, k))
+    _similarity_tasks.add(task)
+    task.add_done_callback(_similarity_tasks.discard)
+    return _similarity_run_out(run)
+
+
+@app.get("/assignments/{assignment_id}/similarity", response_model=SimilarityMatrix)
+async def get_similarity(
+    assignment_id: str,
+    metric: str = Query("cosine", pattern="^(cosine|jaccard)$"),
+    work_id: str | None = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Статус последнего расчёта и top-k соседей каждой работы задания (или одной работы, `work_id`)."""
+    run = await db.get(SimilarityRun, (assignment_id, metric))
+    if run is None:
+        raise HTTPException(status_code=404, detail="Similarity matrix was not computed for assignment")
+    neighbors = await cohort.neighbors_of(db, assignment_id, metric, work_id)
+    return SimilarityMatrix(
+        run=_similarity_run_out(run),
+        works=[WorkNeighbors(work_id=wid, neighbors=items) for (wid, items) in neighbors.items()],
+    )
+
+
+async def _report_body(report_id: str, db: AsyncSession) -> tuple[bytes, str] | None:
+    """Тело отчёта в каноническом JSON и его ETag: из LRU в памяти, иначе из хранилища (см. report_store.py).
+
+    Отсутствующий отчёт — 404; None — запись об отчёте есть, а тело потеряно.
+    """
+    cached = report_cache.get(report_id)
+    if cached is not None:
+        return cached
+    r = await db.get(Report, report_id)
     if not r:
         raise HTTPException(status_code=404, detail="Report not found")
-    path = Path(r.report_path)
-    if not path.exists():
+    body = await report_store.load(db, r)
+    if body is None:
+        return None
+    # тела в файлах записаны с отступами: в кэш и в ответ идёт единый компактный JSON, ETag от него
+    return report_cache.put(report_id, ReportContent.model_validate_json(body).model_dump_json().encode("utf-8"))
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    # для If-None-Match сравнение слабое: W/"x" совпадает с "x"
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def _report_response(request: Request, body: bytes, etag: str, headers: dict[str, str] | None = None) -> Response:
+    """Ответ с телом отчёта: отчёт неизменяем, поэтому сильный ETag, Cache-Control immutable и 304 по If-None-Match."""
+    cache_headers = {"ETag": etag, "Cache-Control": settings.report_cache_control}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers)
+    return Response(content=body, media_type="application/json", headers={**cache_headers, **(headers or {})})
+
+
+@app.get("/reports/{report_id}", response_model=ReportContent)
+async def get_report_content(report_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    found = await _report_body(report_id, db)
+    if found is None:
         raise HTTPException(status_code=410, detail="Report metadata exists but report file is missing")
-    return ReportContent(**json.loads(path.read_text(encoding="utf-8")))
+    return _report_response(request, *found)
 
 
 @app.get("/reports/{report_id}/download")
-def download_report(report_id: str, db: Session = Depends(get_db)):
-    r = db.get(Report, report_id)
-    if not r:
-        raise HTTPException(status_code=404, detail="Report not found")
-    path = Path(r.report_path)
-    if not path.exists():
+async def download_report(report_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    found = await _report_body(report_id, db)
+    if found is None:
         raise HTTPException(status_code=410, detail="Report file missing")
-    return FileResponse(str(path), media_type="application/json", filename=f"{report_id}.json")
+    return _report_response(
+        request, *found, headers={"Content-Disposition": f'attachment; filename="{report_id}.json"'}
+    )
 
 
 @app.get("/reports/{report_id}/wordcloud")
-async def wordcloud(report_id: str, db: Session = Depends(get_db)):
-    """Возвращает PNG облака слов через quickchart.io (опциональная фича)."""
-    r = db.get(Report, report_id)
-    if not r:
-        raise HTTPException(status_code=404, detail="Report not found")
-
-    # Берём текст напрямую из файла, чтобы не зависеть от формата исходного файла
-    path = Path(r.report_path)
-    if not path.exists():
+async def wordcloud(
+    report_id: str,
+    format: str = Query("png", pattern="^(png|svg)$"),
+    width: int = Query(800, ge=100, le=4000),
+    height: int = Query(500, ge=100, le=4000),
+    db: AsyncSession = Depends(get_db),
+):
+    """Облако слов отчёта (PNG или SVG), рисуется локально и кэшируется на диске по отчёту и размеру (LRU)."""
+    headers = {"Cache-Control": settings.report_cache_control}
+    path = word_cloud.cache_path(report_id, format, width, height)
+    if word_cloud.touch(path):
+        return FileResponse(str(path), media_type=word_cloud.MEDIA_TYPES[format], headers=headers)
+
+    # Берём текст напрямую из отчёта, чтобы не зависеть от формата исходного файла
+    found = await _report_body(report_id, db)
+    if found is None:
         raise HTTPException(status_code=410, detail="Report file missing")
-    data = json.loads(path.read_text(encoding="utf-8"))
-    words = data.get("top_words") or []
+    words = json.loads(found[0]).get("top_words") or []
     if not words:
         raise HTTPException(status_code=422, detail="Not enough text to build wordcloud")
 
-    # quickchart принимает текст, можно повторить слова count раз
-    # чтобы размеры облака соответствовали частотам
-    text = []
-    for item in words:
-        w = item.get("word")
-        n = int(item.get("count", 1))
-        text.append((" " + w) * min(n, 10))  # ограничим повторения
-    text = " ".join(text).strip()
-
-    payload = {
-        "format": "png",
-        "width": 800,
-        "height": 500,
-        "removeStopwords": True,
-        "text": text,
-    }
-    try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.post("https://quickchart.io/wordcloud", json=payload)
-        resp.raise_for_status()
-    except Exception as e:
-        raise HTTPException(status_code=503, detail=f"QuickChart unavailable: {e}")
-
-    return Response(content=resp.content, media_type="image/png")
+    # раскладка и растеризация — CPU, не в event loop
+    data = await asyncio.to_thread(word_cloud.render_to_cache, words, report_id, format, width, height)
+    return Response(content=data, media_type=word_cloud.MEDIA_TYPES[format], headers=headers)
@@ -0,0 +1,105 @@
+"""Метрики сервиса в формате Prometheus (`GET /metrics`).
+
+Запись метрики — несколько микросекунд (счётчик в памяти процесса), поэтому инструментирование включено всегда.
+Латентность запросов снимается ASGI-middleware по шаблону маршрута (`/reports/{report_id}`), а не по пути,
+чтобы число рядов не росло с числом отчётов. Отдельно — время вызовов File Service, этапов анализа и commit-ов БД.
+"""
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Iterator
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+from . import tracing
+
+# от 1 мс до 30 с: и быстрые чтения отчётов, и анализ большого файла
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+http_request_seconds = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", ["method", "route", "status"], buckets=BUCKETS
+)
+http_in_flight = Gauge("http_requests_in_flight", "HTTP-запросы в обработке")
+downstream_seconds = Histogram(
+    "downstream_request_duration_seconds", "Время вызова другого сервиса", ["service", "call", "outcome"], buckets=BUCKETS
+)
+stage_seconds = Histogram("stage_duration_seconds", "Время этапа анализа", ["stage"], buckets=BUCKETS)
+db_commit_seconds = Histogram("db_commit_duration_seconds", "Время commit транзакции БД", buckets=BUCKETS)
+
+jobs_queued = Gauge("analysis_jobs", "Задания очереди анализа по статусу (на момент опроса /metrics)", ["status"])
+workers_busy = Gauge("analysis_workers_busy", "Воркеры очереди, занятые заданием")
+pool_tasks = Gauge("analysis_pool_tasks", "Задачи в пуле процессов: выполняются и ждут процесс")
+result_cache_lookups = Counter("analysis_result_cache_lookups_total", "Поиск результата анализа по sha256", ["result"])
+report_cache_lookups = Counter("report_cache_lookups_total", "Чтение тела отчёта из LRU в памяти", ["result"])
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(**labels) if labels else histogram).observe(time.perf_counter() - t0)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Время этапа анализа: `with stage("report_write"): ...`; этап заодно — спан трассы (tracing.py)."""
+    with tracing.span(name), timed(stage_seconds, stage=name):
+        yield
+
+
+def downstream(service: str, call: str):
+    """Декоратор асинхронного клиентского вызова: время и исход (ok / error)."""
+    def decorate(fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await fn(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                downstream_seconds.labels(service=service, call=call, outcome=outcome).observe(time.perf_counter() - t0)
+        return wrapper
+    return decorate
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: латентность и число запросов в обработке. Тело ответа не буферизуется."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        t0 = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_flight.dec()
+            # FastAPI кладёт найденный маршрут в scope; для несуществующих путей — один общий ряд
+            route = scope.get("route")
+            http_request_seconds.labels(
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status),
+            ).observe(time.perf_counter() - t0)
+
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
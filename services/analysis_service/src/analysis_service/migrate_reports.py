@@ -0,0 +1,85 @@
+"""Перенос уже записанных тел отчётов между хранилищами (REPORT_STORE): файлы JSON <-> таблица report_bodies.
+
+С `--to files` и REPORT_COMPRESS_LEVEL > 0 заодно пересжимаются несжатые файлы `{id}.json` прежнего формата.
+
+Запускается с теми же переменными окружения, что и сервис (DATA_DIR, DATABASE_URL, REPORTS_DIR), можно
+на работающем сервисе. Отчёты переносятся пачками, каждая — одной транзакцией; повторный запуск продолжает с
+оставшихся. Исходные файлы удаляются после фиксации пачки (--keep-files оставляет их).
+
+Первым делом вызывается init_db(): на БД, созданной прежней версией, она создаёт недостающие таблицы и
+добавляет недостающие столбцы (в том числе reports.similarity_score и similar_work_id), без этого запросы
+по модели Report падали бы на отсутствующих столбцах.
+
+Пример (в контейнере analysis-service):
+    python -m analysis_service.migrate_reports --to db
+    python -m analysis_service.migrate_reports --to files
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+from pathlib import Path
+
+from sqlalchemy import delete, select
+
+from . import report_store
+from .config import settings
+from .db import AsyncSessionLocal, engine, init_db
+from .models import Report, ReportBody
+from .schemas import ReportContent
+
+
+async def migrate(to: str, batch_size: int, keep_files: bool) -> None:
+    await init_db()
+    Path(settings.reports_dir).mkdir(parents=True, exist_ok=True)
+    moved = missing = 0
+    after = ""
+    while True:
+        async with AsyncSessionLocal() as db:
+            in_db = Report.report_path.startswith(report_store.DB_PREFIX)
+            source = ~in_db if to == "db" else in_db
+            if to == "files" and settings.report_compress_level > 0:
+                source = source | Report.report_path.endswith(".json")
+            rows = (await db.execute(
+                select(Report)
+                .where(Report.id > after, source)
+                .order_by(Report.id)
+                .limit(batch_size)
+            )).scalars().all()
+            if not rows:
+                break
+            after = rows[-1].id
+            written: list[Path] = []
+            for record in rows:
+                body = await report_store.load(db, record)
+                if body is None:
+                    missing += 1
+                    continue
+                old_path = record.report_path
+                record.report_path = report_store.locator(record.id, to)
+                await report_store.save(db, record, ReportContent.model_validate_json(body))
+                if report_store.in_db(old_path):
+                    await db.execute(delete(ReportBody).where(ReportBody.report_id == record.id))
+                else:
+                    written.append(Path(old_path))
+                moved += 1
+            await db.commit()
+        if not keep_files:
+            for path in written:
+                path.unlink(missing_ok=True)
+        print(f"moved {moved} reports to {to}" + (f", {missing} without body" if missing else ""))
+    print(f"done: {moved} reports moved to {to}, {missing} without body (left as is)")
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--to", choices=("db", "files"), default=settings.report_store)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--keep-files", action="store_true", help="не удалять исходные JSON-файлы (перенесённые в БД или пересжатые)")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.to, args.batch_size, args.keep_files))
+
+
+if __name__ == "__main__":
+    main()
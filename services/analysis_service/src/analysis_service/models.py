@@ -1,11 +1,16 @@
 import datetime as dt
-from sqlalchemy import String, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import String, DateTime, Boolean, ForeignKey, Text, Integer, BigInteger, Float, LargeBinary, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .db import Base
 
 
 class Work(Base):
     __tablename__ = "works"
+    __table_args__ = (
+        # поиск более ранней идентичной сдачи (pipeline.earlier_identical): равенство по sha256, диапазон и порядок
+        # по submitted_at берутся из индекса, student_id и id — из него же, без обращения к таблице
+        Index("ix_works_sha_submitted", "file_sha256", "submitted_at", "student_id", "id"),
+    )
 
     id: Mapped[str] = mapped_column(String, primary_key=True)
     student_id: Mapped[str] = mapped_column(String, nullable=False, index=True)
@@ -13,7 +18,7 @@ class Work(Base):
     submitted_at: Mapped[dt.datetime] = mapped_column(DateTime, nullable=False, index=True)
 
     file_id: Mapped[str] = mapped_column(String, nullable=False, index=True)
-    file_sha256: Mapped[str] = mapped_column(String, nullable=False, index=True)
+    file_sha256: Mapped[str] = mapped_column(String, nullable=False)
 
     reports: Mapped[list["Report"]] = relationship(back_populates="work")
 
@@ -32,6 +37,154 @@ class Report(Base):
     plagiarized_from_work_id: Mapped[str | None] = mapped_column(String, nullable=True)
     plagiarized_from_student_id: Mapped[str | None] = mapped_column(String, nullable=True)
 
+    # близость к наиболее похожей более ранней работе (MinHash/LSH)
+    similarity_score: Mapped[float | None] = mapped_column(Float, nullable=True)
+    similar_work_id: Mapped[str | None] = mapped_column(String, nullable=True)
+    # доля шинглов работы, найденных в одной более ранней работе (инвертированный индекс)
+    containment_score: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    # где лежит тело отчёта: путь к JSON-файлу либо "db:<id>" (таблица report_bodies), см. report_store.py
     report_path: Mapped[str] = mapped_column(String, nullable=False)
 
     work: Mapped[Work] = relationship(back_populates="reports")
+
+
+class ReportBody(Base):
+    """Тело отчёта (JSON ReportContent, сжатый zlib) при REPORT_STORE=db, см. report_store.py."""
+    __tablename__ = "report_bodies"
+
+    report_id: Mapped[str] = mapped_column(String, ForeignKey("reports.id"), primary_key=True)
+    body: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+
+class WorkSignature(Base):
+    """MinHash-сигнатура текста работы."""
+    __tablename__ = "work_signatures"
+
+    work_id: Mapped[str] = mapped_column(String, ForeignKey("works.id"), primary_key=True)
+    num_shingles: Mapped[int] = mapped_column(Integer, nullable=False)
+    signature: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+
+class LshBucket(Base):
+    """LSH-индекс: работы, попавшие в одну корзину полосы сигнатуры, — кандидаты в дубликаты."""
+    __tablename__ = "lsh_buckets"
+    __table_args__ = (
+        Index("ix_lsh_buckets_lookup", "assignment_id", "band", "bucket"),
+    )
+
+    work_id: Mapped[str] = mapped_column(String, ForeignKey("works.id"), primary_key=True)
+    band: Mapped[int] = mapped_column(Integer, primary_key=True)
+    assignment_id: Mapped[str] = mapped_column(String, nullable=False)
+    bucket: Mapped[str] = mapped_column(String, nullable=False)
+
+
+class WorkOutcome(Base):
+    """Итог последнего анализа работы для агрегатов задания (см. analytics.py)."""
+    __tablename__ = "work_outcomes"
+    __table_args__ = (
+        Index("ix_work_outcomes_cluster", "assignment_id", "cluster_id"),
+    )
+
+    work_id: Mapped[str] = mapped_column(String, ForeignKey("works.id"), primary_key=True)
+    assignment_id: Mapped[str] = mapped_column(String, nullable=False)
+    plagiarism: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    # кластер дубликатов: id самой ранней работы кластера (оригинала); NULL — работа ни с кем не совпала
+    cluster_id: Mapped[str | None] = mapped_column(String, nullable=True)
+
+
+class AssignmentStats(Base):
+    """Счётчики задания, обновляемые при каждом анализе: сводка читается одной строкой."""
+    __tablename__ = "assignment_stats"
+
+    assignment_id: Mapped[str] = mapped_column(String, primary_key=True)
+    works: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    plagiarized: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    clusters: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    clustered_works: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    updated_at: Mapped[dt.datetime] = mapped_column(DateTime, default=lambda: dt.datetime.utcnow(), nullable=False)
+
+
+class AssignmentWord(Base):
+    """Частоты слов по всем работам задания (сумма top_words отчётов)."""
+    __tablename__ = "assignment_words"
+    __table_args__ = (
+        Index("ix_assignment_words_top", "assignment_id", "total"),
+    )
+
+    assignment_id: Mapped[str] = mapped_column(String, primary_key=True)
+    word: Mapped[str] = mapped_column(String, primary_key=True)
+    total: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+
+class SimilarityRun(Base):
+    """Расчёт матрицы попарной близости работ задания (см. cohort.py): последний запуск на задание и метрику."""
+    __tablename__ = "similarity_runs"
+
+    assignment_id: Mapped[str] = mapped_column(String, primary_key=True)
+    metric: Mapped[str] = mapped_column(String, primary_key=True)  # cosine / jaccard
+    status: Mapped[str] = mapped_column(String, nullable=False)  # RUNNING / COMPLETED / FAILED
+    k: Mapped[int] = mapped_column(Integer, nullable=False)
+    works: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    vocabulary: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    started_at: Mapped[dt.datetime] = mapped_column(DateTime, nullable=False)
+    finished_at: Mapped[dt.datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class WorkNeighbor(Base):
+    """Top-k ближайших работ того же задания по последнему расчёту матрицы близости."""
+    __tablename__ = "work_neighbors"
+    __table_args__ = (
+        Index("ix_work_neighbors_assignment", "assignment_id", "metric"),
+    )
+
+    work_id: Mapped[str] = mapped_column(String, ForeignKey("works.id"), primary_key=True)
+    metric: Mapped[str] = mapped_column(String, primary_key=True)
+    rank: Mapped[int] = mapped_column(Integer, primary_key=True)
+    assignment_id: Mapped[str] = mapped_column(String, nullable=False)
+    neighbor_work_id: Mapped[str] = mapped_column(String, nullable=False)
+    score: Mapped[float] = mapped_column(Float, nullable=False)
+
+
+class AnalysisJob(Base):
+    """Задание очереди анализа; обрабатывается пулом воркеров (см. jobs.py)."""
+    __tablename__ = "analysis_jobs"
+    __table_args__ = (
+        Index("ix_analysis_jobs_status_created", "status", "created_at"),
+    )
+
+    id: Mapped[str] = mapped_column(String, primary_key=True)
+    work_id: Mapped[str] = mapped_column(String, nullable=False, index=True)
+    student_id: Mapped[str] = mapped_column(String, nullable=False)
+    assignment_id: Mapped[str] = mapped_column(String, nullable=False)
+    submitted_at: Mapped[dt.datetime] = mapped_column(DateTime, nullable=False)
+    file_id: Mapped[str] = mapped_column(String, nullable=False)
+    file_sha256: Mapped[str | None] = mapped_column(String, nullable=True)
+
+    status: Mapped[str] = mapped_column(String, nullable=False, default="QUEUED")  # QUEUED / RUNNING / COMPLETED / FAILED
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    report_id: Mapped[str | None] = mapped_column(String, nullable=True)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # traceparent запроса, поставившего задание: анализ продолжает его трассу (tracing.py)
+    trace_parent: Mapped[str | None] = mapped_column(String, nullable=True)
+
+    created_at: Mapped[dt.datetime] = mapped_column(DateTime, default=lambda: dt.datetime.utcnow(), nullable=False)
+    updated_at: Mapped[dt.datetime] = mapped_column(DateTime, default=lambda: dt.datetime.utcnow(), nullable=False)
+
+
+class AnalysisResult(Base):
+    """Кэш результата анализа текста по содержимому: один на sha256 и версию анализатора."""
+    __tablename__ = "analysis_results"
+    __table_args__ = (
+        Index("ix_analysis_results_last_used", "last_used_at"),
+    )
+
+    sha256: Mapped[str] = mapped_column(String, primary_key=True)
+    analyzer_version: Mapped[str] = mapped_column(String, primary_key=True)
+    stats_json: Mapped[str] = mapped_column(Text, nullable=False)  # stats + top_words
+    shingles: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)  # zlib(array('q'))
+    signature: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    size_bytes: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[dt.datetime] = mapped_column(DateTime, default=lambda: dt.datetime.utcnow(), nullable=False)
+    last_used_at: Mapped[dt.datetime] = mapped_column(DateTime, default=lambda: dt.datetime.utcnow(), nullable=False)
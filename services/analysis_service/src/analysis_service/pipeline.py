@@ -0,0 +1,366 @@
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import uuid
+from typing import Awaitable, Callable
+
+from sqlalchemy import Select, select, and_, delete, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .models import Work, Report, WorkSignature, LshBucket
+from .schemas import CreateReportRequest, ReportContent
+from .clients import open_file, FileServiceUnavailable
+from .analyzer import analyze_file
+from .cpu_pool import analysis_pool, PoolSaturated
+from .result_cache import result_cache
+from .metrics import stage
+from . import analytics, report_store
+from .shingle_index import ShingleIndex
+from .storage import spool_to_file
+from .similarity import (
+    pack_signature,
+    unpack_signature,
+    lsh_buckets,
+    estimate_similarity,
+)
+
+
+async def _save(db: AsyncSession) -> None:
+    """Шаг анализа. В режиме unit of work (DB_UNIT_OF_WORK) изменения только отправляются в БД (flush),
+    а фиксирует их вызывающий одной транзакцией вместе со статусом задания; иначе — commit после каждого шага.
+    """
+    if settings.db_unit_of_work:
+        await db.flush()
+    else:
+        await db.commit()
+
+
+async def _index_signature(
+    db: AsyncSession, work: Work, sig: list[int], buckets: list[tuple[int, str]], num_shingles: int
+) -> None:
+    """Сохраняет сигнатуру работы и её корзины LSH (повторный анализ перезаписывает их)."""
+    await db.merge(WorkSignature(work_id=work.id, num_shingles=num_shingles, signature=pack_signature(sig)))
+    await db.execute(delete(LshBucket).where(LshBucket.work_id == work.id))
+    db.add_all(
+        LshBucket(work_id=work.id, band=band, assignment_id=work.assignment_id, bucket=bucket)
+        for (band, bucket) in buckets
+    )
+
+
+def earlier_identical(file_sha256: str, submitted_at: dt.datetime, student_id: str) -> Select:
+    """Самая ранняя сдача того же файла (sha256) другим студентом до `submitted_at`.
+
+    Выбираются только id и student_id: запрос целиком покрывается индексом ix_works_sha_submitted
+    (поиск по sha256, обход по submitted_at до первой подходящей строки), без сортировки и чтения таблицы.
+    """
+    return (
+        select(Work.id, Work.student_id)
+        .where(
+            and_(
+                Work.file_sha256 == file_sha256,
+                Work.submitted_at < submitted_at,
+                Work.student_id != student_id,
+            )
+        )
+        .order_by(Work.submitted_at.asc())
+        .limit(1)
+    )
+
+
+async def _find_similar(db: AsyncSession, work: Work, sig: list[int], buckets: list[tuple[int, str]]) -> tuple[Work | None, float]:
+    """Ищет самую похожую более раннюю работу другого студента среди кандидатов из LSH."""
+    candidate_ids = select(LshBucket.work_id).where(
+        and_(
+            LshBucket.assignment_id == work.assignment_id,
+            tuple_(LshBucket.band, LshBucket.bucket).in_(buckets),
+            LshBucket.work_id != work.id,
+        )
+    ).distinct()
+    rows = (await db.execute(
+        select(Work, WorkSignature.signature)
+        .join(WorkSignature, WorkSignature.work_id == Work.id)
+        .where(
+            and_(
+                Work.id.in_(candidate_ids),
+                Work.submitted_at < work.submitted_at,
+                Work.student_id != work.student_id,
+            )
+        )
+        .order_by(Work.submitted_at.asc())
+    )).all()
+
+    # при равной близости выигрывает более ранняя сдача
+    best, best_score = None, 0.0
+    for (candidate, packed) in rows:
+        score = estimate_similarity(sig, unpack_signature(packed))
+        if score > best_score:
+            best, best_score = candidate, score
+    return best, best_score
+
+
+def _shingle_index(assignment_id: str) -> ShingleIndex:
+    return ShingleIndex(
+        settings.shingle_index_dir,
+        assignment_id,
+        batch_size=settings.shingle_index_batch_size,
+        max_candidates=settings.shingle_index_max_candidates,
+    )
+
+
+async def _find_containment(db: AsyncSession, work: Work, work_shingles: set[int]) -> tuple[Work | None, float]:
+    """Находит более раннюю работу другого студента, содержащую наибольшую долю шинглов работы.
+
+    Общие шинглы считаются по инвертированному индексу задания (отдельный SQLite-файл, запросы к нему идут
+    в потоке), ранние файлы не перечитываются. Сама работа добавляется в индекс в конце анализа (_index_shingles).
+    """
+    overlaps = await asyncio.to_thread(
+        _shingle_index(work.assignment_id).overlaps,
+        work_shingles,
+        exclude_work_id=work.id,
+        exclude_student_id=work.student_id,
+        submitted_before=work.submitted_at,
+    )
+    if not overlaps:
+        return None, 0.0
+
+    rows = (await db.execute(
+        select(Work)
+        .where(
+            and_(
+                Work.id.in_(overlaps.keys()),
+                Work.submitted_at < work.submitted_at,
+                Work.student_id != work.student_id,
+            )
+        )
+        .order_by(Work.submitted_at.asc())
+    )).scalars().all()
+
+    best, best_common = None, 0
+    for candidate in rows:
+        if overlaps[candidate.id] > best_common:
+            best, best_common = candidate, overlaps[candidate.id]
+    return best, best_common / len(work_shingles)
+
+
+# ключ db.info: (assignment_id, work_id) работы, добавленной в индекс шинглов, пока анализ не зафиксирован
+_PENDING_INDEX = "pending_shingle_index"
+
+
+async def _index_shingles(db: AsyncSession, work: Work, work_shingles: set[int]) -> None:
+    """Добавляет работу в индекс шинглов задания последним шагом анализа, когда всё остальное уже записано.
+
+    Индекс — отдельный файл вне транзакции БД, поэтому добавленная работа запоминается в сессии:
+    если commit вызывающего не пройдёт, commit_analysis уберёт её из индекса. Добавлять до commit,
+    а не после, нужно для реплик: задание другой реплики, дождавшееся этого, найдёт работу в индексе.
+    """
+    await asyncio.to_thread(
+        _shingle_index(work.assignment_id).add, work.id, work_shingles, work.student_id, work.submitted_at
+    )
+    db.info[_PENDING_INDEX] = (work.assignment_id, work.id)
+
+
+async def commit_analysis(db: AsyncSession) -> None:
+    """Фиксирует результат run_analysis; при ошибке commit убирает работу из индекса шинглов и пробрасывает ошибку."""
+    pending = db.info.pop(_PENDING_INDEX, None)
+    try:
+        await db.commit()
+    except Exception:
+        if pending is not None:
+            (assignment_id, work_id) = pending
+            await asyncio.to_thread(_shingle_index(assignment_id).remove, work_id)
+        raise
+
+
+async def run_analysis(
+    req: CreateReportRequest,
+    db: AsyncSession,
+    before_checks: Callable[[], Awaitable[None]] | None = None,
+) -> Report:
+    """Полный анализ работы: статистика текста, поиск плагиата и запись отчёта (commit — за вызывающим,
+    через commit_analysis).
+
+    Скачивание и токенизация не трогают БД и могут идти параллельно; проверки на плагиат
+    зависят от порядка сдач, поэтому перед ними вызывается `before_checks` (очередь ждёт своей очереди).
+    Ошибки запроса файла (FileServiceUnavailable, FileNotFoundError) и переполнение
+    пула анализа (PoolSaturated) пробрасываются вызывающему.
+    """
+    # 1) Результат анализа текста берётся из кэша по sha256 содержимого, если этот файл уже разбирался.
+    #    Иначе метаданные (sha256 считает File Service при загрузке) и содержимое файла запрашиваются одним вызовом;
+    #    тело не держится в памяти целиком: оно пишется во временный файл, который пул процессов
+    #    разбирает по чанкам (токенизация, шинглы и MinHash — не в event loop).
+    file_sha256 = req.file_sha256
+    result = await result_cache.get(file_sha256) if file_sha256 else None
+    analyzed = False
+    stats = {}
+    spool_path = None
+    try:
+        if result is None:
+            async with open_file(req.file_id) as (meta, chunks):
+                file_sha256 = meta["sha256"]
+                if file_sha256 != req.file_sha256:
+                    result = await result_cache.get(file_sha256)
+
+                # 2) (опционально) небольшой текстовый анализ: топ слов, если файл читается как текст
+                if result is not None:
+                    pass  # содержимое уже разбиралось — тело не читаем
+                elif meta["size_bytes"] > settings.analysis_max_bytes:
+                    stats = {"warning": "file_too_large_for_text_analysis", "bytes": meta["size_bytes"]}
+                else:
+                    try:
+                        with stage("download"):
+                            spool_path = await spool_to_file(chunks)
+                    except FileServiceUnavailable:
+                        # не валим весь отчёт: сохраняем отчёт, но без статистики/топ-слов
+                        stats = {"warning": "file_service_unavailable_for_text_analysis"}
+                    except Exception:
+                        stats = {"warning": "failed_to_parse_text"}
+
+        if spool_path is not None:
+            try:
+                with stage("analyze"):
+                    result = await analysis_pool.run(
+                        analyze_file, str(spool_path), settings.shingle_size, settings.minhash_num_perm
+                    )
+                analyzed = True
+            except PoolSaturated:
+                raise
+            except Exception:
+                stats = {"warning": "failed_to_parse_text"}
+    finally:
+        if spool_path is not None:
+            spool_path.unlink(missing_ok=True)
+
+    if analyzed:
+        await result_cache.put(file_sha256, result)
+
+    top = []
+    work_shingles = set()
+    sig = None
+    if result is not None:
+        stats = result["stats"]
+        top = result["top_words"]
+        work_shingles = result["shingles"]
+        sig = result["signature"]
+
+    if before_checks is not None:
+        await before_checks()
+
+    # 3) Upsert Work (храним копию метаданных для поиска ранних сдач).
+    #    В БД всё пишется одним шагом в конце (7): пока идут проверки, блокировка записи SQLite не держится,
+    #    и другие воркеры и обработчики не ждут её на своих await.
+    work = await db.get(Work, req.work_id)
+    if not work:
+        work = Work(
+            id=req.work_id,
+            student_id=req.student_id,
+            assignment_id=req.assignment_id,
+            submitted_at=req.submitted_at,
+            file_id=req.file_id,
+            file_sha256=file_sha256,
+        )
+        db.add(work)
+    else:
+        # если повторный анализ — обновим поля, если они поменялись
+        work.student_id = req.student_id
+        work.assignment_id = req.assignment_id
+        work.submitted_at = req.submitted_at
+        work.file_id = req.file_id
+        work.file_sha256 = file_sha256
+
+    # 4) Детект «плагиата» = есть более ранняя сдача другим студентом с тем же sha256
+    with stage("earlier_identical"):
+        earlier = (await db.execute(earlier_identical(file_sha256, req.submitted_at, req.student_id))).first()
+
+    plagiarism = earlier is not None
+    plagiarism_reason = None
+    plag_from_work_id = None
+    plag_from_student_id = None
+    if plagiarism:
+        plagiarism_reason = "Earlier identical submission exists (same sha256)."
+        plag_from_work_id = earlier.id
+        plag_from_student_id = earlier.student_id
+
+    # 5) Поиск почти-дубликатов: MinHash-сигнатура + кандидаты из LSH-корзин того же задания
+    similarity_score = None
+    similar_work_id = None
+    containment_score = None
+    if earlier is not None:
+        similarity_score = 1.0
+        similar_work_id = earlier.id
+    buckets = []
+    if sig is not None:
+        buckets = lsh_buckets(sig, settings.lsh_bands)
+        if not plagiarism:
+            with stage("similar_lsh"):
+                similar, score = await _find_similar(db, work, sig, buckets)
+            if similar is not None:
+                similarity_score = round(score, 4)
+                similar_work_id = similar.id
+                if score >= settings.similarity_threshold:
+                    plagiarism = True
+                    plagiarism_reason = f"Earlier near-duplicate submission exists (similarity {score:.2f})."
+                    plag_from_work_id = similar.id
+                    plag_from_student_id = similar.student_id
+
+        # 6) Частичное заимствование: доля шинглов, найденных в одной ранней работе
+        with stage("containment"):
+            source, containment = await _find_containment(db, work, work_shingles)
+        if source is not None:
+            containment_score = round(containment, 4)
+            if not plagiarism and containment >= settings.containment_threshold:
+                plagiarism = True
+                plagiarism_reason = f"Large part of the text matches an earlier submission (containment {containment:.2f})."
+                plag_from_work_id = source.id
+                plag_from_student_id = source.student_id
+
+    report_id = str(uuid.uuid4())
+
+    # 7) Запись в БД (работа, сигнатура, отчёт) + тело отчёта (в БД или JSON-файлом, см. report_store.py).
+    #    Работа пишется первой: на неё ссылаются внешние ключи сигнатуры, корзин и отчёта (PostgreSQL их проверяет)
+    await _save(db)
+    if sig is not None:
+        await _index_signature(db, work, sig, buckets, len(work_shingles))
+    with stage("analytics"):
+        await analytics.record(db, work, plagiarism, plag_from_work_id, top)
+    record = Report(
+        id=report_id,
+        work_id=req.work_id,
+        status="COMPLETED",
+        plagiarism=plagiarism,
+        plagiarism_reason=plagiarism_reason,
+        plagiarized_from_work_id=plag_from_work_id,
+        plagiarized_from_student_id=plag_from_student_id,
+        similarity_score=similarity_score,
+        similar_work_id=similar_work_id,
+        containment_score=containment_score,
+        report_path=report_store.locator(report_id),
+    )
+    db.add(record)
+    await _save(db)
+
+    # теперь created_at уже известен
+    content = ReportContent(
+        report_id=report_id,
+        work_id=req.work_id,
+        created_at=record.created_at,  # <-- ВОТ ЭТО главное
+        status=record.status,
+        plagiarism=record.plagiarism,
+        plagiarism_reason=record.plagiarism_reason,
+        plagiarized_from_work_id=record.plagiarized_from_work_id,
+        plagiarized_from_student_id=record.plagiarized_from_student_id,
+        similarity_score=record.similarity_score,
+        similar_work_id=record.similar_work_id,
+        containment_score=record.containment_score,
+        file_id=req.file_id,
+        file_sha256=file_sha256,
+        stats=stats,
+        top_words=top,
+    )
+
+    with stage("report_write"):
+        await report_store.save(db, record, content)
+    if sig is not None:
+        await _index_shingles(db, work, work_shingles)
+    return record
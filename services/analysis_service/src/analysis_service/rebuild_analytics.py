@@ -0,0 +1,72 @@
+"""Пересборка агрегатов заданий (analytics.py) по уже записанным работам и отчётам.
+
+Нужна один раз после обновления (работы, проанализированные раньше, в агрегатах не учтены) или после ручных
+правок БД. Агрегаты очищаются и строятся заново: работы проходятся по времени сдачи, для каждой берётся
+её последний отчёт. Запускать при остановленном сервисе: анализы во время пересборки учлись бы дважды.
+Схема БД прежней версии сначала доводится до текущей через init_db() (недостающие таблицы и столбцы).
+
+Пример (в контейнере analysis-service):
+    python -m analysis_service.rebuild_analytics
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+
+from sqlalchemy import delete, select, tuple_
+
+from . import analytics, report_store
+from .db import AsyncSessionLocal, engine, init_db
+from .models import AssignmentStats, AssignmentWord, Report, Work, WorkOutcome
+
+
+async def rebuild(batch_size: int) -> None:
+    await init_db()
+    async with AsyncSessionLocal() as db:
+        for model in (WorkOutcome, AssignmentWord, AssignmentStats):
+            await db.execute(delete(model))
+        await db.commit()
+
+    done = 0
+    after = None
+    while True:
+        async with AsyncSessionLocal() as db:
+            query = select(Work).order_by(Work.submitted_at, Work.id).limit(batch_size)
+            if after is not None:
+                query = query.where(tuple_(Work.submitted_at, Work.id) > after)
+            works = (await db.execute(query)).scalars().all()
+            if not works:
+                break
+            after = (works[-1].submitted_at, works[-1].id)
+            latest: dict[str, Report] = {}
+            reports = await db.execute(
+                select(Report)
+                .where(Report.work_id.in_([w.id for w in works]), Report.status == "COMPLETED")
+                .order_by(Report.created_at.desc())
+            )
+            for r in reports.scalars():
+                latest.setdefault(r.work_id, r)
+            for work in works:
+                report = latest.get(work.id)
+                if report is None:
+                    continue
+                body = await report_store.load(db, report)
+                top_words = (json.loads(body).get("top_words") or []) if body is not None else []
+                await analytics.record(db, work, report.plagiarism, report.plagiarized_from_work_id, top_words)
+                done += 1
+            await db.commit()
+        print(f"works counted: {done}")
+    print(f"done: {done} works counted")
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(rebuild(args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
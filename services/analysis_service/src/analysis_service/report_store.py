@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import hashlib
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .metrics import report_cache_lookups
+from .models import Report, ReportBody
+from .schemas import ReportContent
+
+# report_path отчёта, тело которого лежит в таблице report_bodies
+DB_PREFIX = "db:"
+# суффикс файла отчёта, сжатого gzip; файлы без него (записанные раньше или с REPORT_COMPRESS_LEVEL=0) — JSON как есть
+GZIP_SUFFIX = ".json.gz"
+
+
+def in_db(report_path: str) -> bool:
+    return report_path.startswith(DB_PREFIX)
+
+
+def locator(report_id: str, store: str | None = None) -> str:
+    """Значение Report.report_path для нового отчёта в хранилище `store` (по умолчанию REPORT_STORE)."""
+    if (store or settings.report_store) == "db":
+        return DB_PREFIX + report_id
+    suffix = GZIP_SUFFIX if settings.report_compress_level > 0 else ".json"
+    return str(Path(settings.reports_dir) / f"{report_id}{suffix}")
+
+
+def encode(content: ReportContent) -> bytes:
+    return zlib.compress(content.model_dump_json().encode("utf-8"), settings.report_compress_level)
+
+
+async def save(db: AsyncSession, record: Report, content: ReportContent) -> None:
+    """Сохраняет тело отчёта туда, куда указывает record.report_path.
+
+    Строка report_bodies добавляется в сессию и фиксируется вместе с записью Report одним commit вызывающего;
+    файл пишется сразу.
+    """
+    if in_db(record.report_path):
+        db.add(ReportBody(report_id=record.id, body=encode(content)))
+    elif record.report_path.endswith(GZIP_SUFFIX):
+        await asyncio.to_thread(_write_gzip, Path(record.report_path), content.model_dump_json().encode("utf-8"))
+    else:
+        await asyncio.to_thread(
+            Path(record.report_path).write_text, content.model_dump_json(indent=2), encoding="utf-8"
+        )
+
+
+def _write_gzip(path: Path, body: bytes) -> None:
+    path.write_bytes(gzip.compress(body, settings.report_compress_level, mtime=0))
+
+
+def _read(path: Path) -> bytes:
+    data = path.read_bytes()
+    return gzip.decompress(data) if path.name.endswith(GZIP_SUFFIX) else data
+
+
+async def load(db: AsyncSession, record: Report) -> bytes | None:
+    """JSON тела отчёта; None, если тело потеряно (файл удалён и т.п.)."""
+    if in_db(record.report_path):
+        row = await db.get(ReportBody, record.id)
+        return zlib.decompress(row.body) if row is not None else None
+    try:
+        return await asyncio.to_thread(_read, Path(record.report_path))
+    except FileNotFoundError:
+        return None
+
+
+class ReportCache:
+    """LRU тел отчётов в памяти процесса: канонический JSON (как его отдаёт API) и его ETag.
+
+    Отчёт после записи не меняется, поэтому записи не инвалидируются, только вытесняются,
+    когда суммарный размер превышает `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lru: OrderedDict[str, tuple[bytes, str]] = OrderedDict()
+        self._used = 0
+
+    def get(self, report_id: str) -> tuple[bytes, str] | None:
+        hit = self._lru.get(report_id)
+        if hit is not None:
+            self._lru.move_to_end(report_id)
+        report_cache_lookups.labels(result="hit" if hit is not None else "miss").inc()
+        return hit
+
+    def put(self, report_id: str, body: bytes) -> tuple[bytes, str]:
+        """Запоминает тело отчёта (если оно помещается в кэш) и возвращает его вместе с ETag."""
+        entry = (body, f'"{hashlib.sha256(body).hexdigest()}"')
+        size = _entry_size(entry)
+        if size > self.max_bytes:
+            return entry
+        old = self._lru.pop(report_id, None)
+        if old is not None:
+            self._used -= _entry_size(old)
+        self._lru[report_id] = entry
+        self._used += size
+        while self._used > self.max_bytes:
+            _, evicted = self._lru.popitem(last=False)
+            self._used -= _entry_size(evicted)
+        return entry
+
+
+def _entry_size(entry: tuple[bytes, str]) -> int:
+    # тело, ETag и грубая оценка накладных расходов на ключ и элементы OrderedDict
+    return len(entry[0]) + len(entry[1]) + 256
+
+
+report_cache = ReportCache(max_bytes=settings.report_cache_bytes)
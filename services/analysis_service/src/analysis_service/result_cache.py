@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import json
+import zlib
+from array import array
+from collections import OrderedDict
+
+from sqlalchemy import select, delete, func, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .analyzer import ANALYZER_VERSION
+from .config import settings
+from .db import AsyncSessionLocal
+from .metrics import result_cache_lookups
+from .models import AnalysisResult
+from .similarity import pack_signature, unpack_signature
+
+
+def analyzer_version() -> str:
+    """Версия результата: версия анализатора и параметры, от которых зависят шинглы и сигнатура."""
+    return f"{ANALYZER_VERSION}:k{settings.shingle_size}:p{settings.minhash_num_perm}"
+
+
+def _encode(sha256: str, version: str, result: dict) -> AnalysisResult:
+    stats_json = json.dumps({"stats": result["stats"], "top_words": result["top_words"]}, ensure_ascii=False)
+    shingles = zlib.compress(array("q", sorted(result["shingles"])).tobytes())
+    signature = pack_signature(result["signature"]) if result["signature"] is not None else None
+    return AnalysisResult(
+        sha256=sha256,
+        analyzer_version=version,
+        stats_json=stats_json,
+        shingles=shingles,
+        signature=signature,
+        size_bytes=len(stats_json.encode("utf-8")) + len(shingles) + len(signature or b""),
+    )
+
+
+def _decode(row: AnalysisResult) -> dict:
+    data = json.loads(row.stats_json)
+    shingles = array("q")
+    shingles.frombytes(zlib.decompress(row.shingles))
+    return {
+        "stats": data["stats"],
+        "top_words": data["top_words"],
+        "shingles": set(shingles),
+        "signature": unpack_signature(row.signature) if row.signature is not None else None,
+    }
+
+
+def _memory_size(result: dict) -> int:
+    # грубая оценка: элемент множества int ~ 64 байта, элемент списка сигнатуры ~ 36 байт
+    return 64 * len(result["shingles"]) + 36 * len(result["signature"] or ()) + 100 * len(result["top_words"]) + 512
+
+
+class ResultCache:
+    """Кэш результатов анализа текста по sha256 содержимого и версии анализатора.
+
+    Перед таблицей analysis_results стоит LRU в памяти процесса (не больше `memory_bytes` по оценке);
+    таблица ограничена `max_bytes` суммарного размера записей, вытесняются давно не использованные.
+    Кэш пишет в БД своими короткими транзакциями, не затрагивая сессию анализа.
+
+    Размер таблицы не пересчитывается на каждую запись: процесс ведёт его оценку (сумма при первой записи плюс
+    свои записи) и считает точно только когда оценка превысила `max_bytes`. Вытеснение идёт с запасом — до
+    `EVICT_TO` от лимита, поэтому случается редко. Записи других реплик оценка не видит: они лишь откладывают
+    вытеснение до следующего точного пересчёта. Попадание в БД обновляет `last_used_at` не чаще раза в
+    `touch_interval` секунд, так что чтение обычно обходится без транзакции записи.
+    """
+
+    # вытеснение освобождает место до этой доли max_bytes
+    EVICT_TO = 0.9
+    # строк за один проход вытеснения (по индексу last_used_at)
+    EVICT_BATCH = 500
+
+    def __init__(self, memory_bytes: int, max_bytes: int, touch_interval: float):
+        self.memory_bytes = memory_bytes
+        self.max_bytes = max_bytes
+        self.touch_interval = dt.timedelta(seconds=touch_interval)
+        self._lru: OrderedDict[tuple[str, str], tuple[dict, int]] = OrderedDict()
+        self._memory_used = 0
+        self._db_bytes: int | None = None
+
+    async def get(self, sha256: str) -> dict | None:
+        key = (sha256, analyzer_version())
+        hit = self._lru.get(key)
+        if hit is not None:
+            self._lru.move_to_end(key)
+            result_cache_lookups.labels(result="memory").inc()
+            return hit[0]
+
+        async with AsyncSessionLocal() as db:
+            row = await db.get(AnalysisResult, key)
+            if row is None:
+                result_cache_lookups.labels(result="miss").inc()
+                return None
+            now = dt.datetime.utcnow()
+            if row.last_used_at < now - self.touch_interval:
+                row.last_used_at = now
+                await db.commit()
+        result_cache_lookups.labels(result="db").inc()
+        # распаковка и сборка множества шинглов большой работы — десятки миллисекунд, не на event loop
+        result = await asyncio.to_thread(_decode, row)
+        self._remember(key, result)
+        return result
+
+    async def put(self, sha256: str, result: dict) -> None:
+        key = (sha256, analyzer_version())
+        row = await asyncio.to_thread(_encode, sha256, key[1], result)
+        async with AsyncSessionLocal() as db:
+            db.add(row)
+            try:
+                await db.commit()
+            except IntegrityError:
+                # этот же файл уже проанализировал параллельный воркер
+                await db.rollback()
+            else:
+                if self._db_bytes is None:
+                    self._db_bytes = await self._table_bytes(db)
+                else:
+                    self._db_bytes += row.size_bytes
+                if self._db_bytes > self.max_bytes:
+                    await self._evict(db)
+        self._remember(key, result)
+
+    def _remember(self, key: tuple[str, str], result: dict) -> None:
+        size = _memory_size(result)
+        if size > self.memory_bytes:
+            return
+        old = self._lru.pop(key, None)
+        if old is not None:
+            self._memory_used -= old[1]
+        self._lru[key] = (result, size)
+        self._memory_used += size
+        while self._memory_used > self.memory_bytes:
+            _, (_, evicted) = self._lru.popitem(last=False)
+            self._memory_used -= evicted
+
+    @staticmethod
+    async def _table_bytes(db: AsyncSession) -> int:
+        return await db.scalar(select(func.coalesce(func.sum(AnalysisResult.size_bytes), 0)))
+
+    async def _evict(self, db: AsyncSession) -> None:
+        # оценка могла разойтись с таблицей (другие реплики пишут и вытесняют сами) — перед вытеснением считаем точно
+        total = await self._table_bytes(db)
+        if total > self.max_bytes:
+            target = int(self.max_bytes * self.EVICT_TO)
+            while total > target:
+                rows = (await db.execute(
+                    select(AnalysisResult.sha256, AnalysisResult.analyzer_version, AnalysisResult.size_bytes)
+                    .order_by(AnalysisResult.last_used_at.asc())
+                    .limit(self.EVICT_BATCH)
+                )).all()
+                if not rows:
+                    break
+                stale = []
+                for (sha256, version, size) in rows:
+                    if total <= target:
+                        break
+                    stale.append((sha256, version))
+                    total -= size
+                await db.execute(
+                    delete(AnalysisResult)
+                    .where(tuple_(AnalysisResult.sha256, AnalysisResult.analyzer_version).in_(stale))
+                )
+                await db.commit()
+        self._db_bytes = total
+
+
+result_cache = ResultCache(
+    memory_bytes=settings.result_cache_memory_bytes,
+    max_bytes=settings.result_cache_max_bytes,
+    touch_interval=settings.result_cache_touch_interval,
+)
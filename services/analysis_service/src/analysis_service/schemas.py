@@ -8,6 +8,8 @@ class CreateReportRequest(BaseModel):
     assignment_id: str
     submitted_at: dt.datetime
     file_id: str
+    # sha256 из File Service, если известен вызывающему: по нему результат анализа берётся из кэша без скачивания файла
+    file_sha256: str | None = None
 
 
 class ReportSummary(BaseModel):
@@ -18,6 +20,9 @@ class ReportSummary(BaseModel):
     plagiarism_reason: str | None = None
     plagiarized_from_work_id: str | None = None
     plagiarized_from_student_id: str | None = None
+    similarity_score: float | None = None
+    similar_work_id: str | None = None
+    containment_score: float | None = None
     created_at: dt.datetime
 
 
@@ -25,6 +30,17 @@ class CreateReportResponse(BaseModel):
     report: ReportSummary
 
 
+class JobOut(BaseModel):
+    id: str
+    work_id: str
+    status: str
+    attempts: int
+    report: ReportSummary | None = None
+    error: str | None = None
+    created_at: dt.datetime
+    updated_at: dt.datetime
+
+
 class ReportContent(BaseModel):
     report_id: str
     work_id: str
@@ -34,7 +50,60 @@ class ReportContent(BaseModel):
     plagiarism_reason: str | None = None
     plagiarized_from_work_id: str | None = None
     plagiarized_from_student_id: str | None = None
+    similarity_score: float | None = None
+    similar_work_id: str | None = None
+    containment_score: float | None = None
     file_id: str
     file_sha256: str
     stats: dict = Field(default_factory=dict)
     top_words: list[dict] = Field(default_factory=list)
+
+
+class AssignmentSummary(BaseModel):
+    assignment_id: str
+    works: int
+    plagiarized: int
+    plagiarism_rate: float
+    duplicate_clusters: int
+    works_in_clusters: int
+    top_words: list[dict] = Field(default_factory=list)
+    updated_at: dt.datetime
+
+
+class ClusterMember(BaseModel):
+    work_id: str
+    student_id: str
+    submitted_at: dt.datetime
+
+
+class DuplicateCluster(BaseModel):
+    cluster_id: str  # самая ранняя работа кластера (оригинал)
+    size: int
+    works: list[ClusterMember]
+
+
+class SimilarityRunOut(BaseModel):
+    assignment_id: str
+    metric: str
+    status: str
+    k: int
+    works: int
+    vocabulary: int
+    error: str | None = None
+    started_at: dt.datetime
+    finished_at: dt.datetime | None = None
+
+
+class Neighbor(BaseModel):
+    work_id: str
+    score: float
+
+
+class WorkNeighbors(BaseModel):
+    work_id: str
+    neighbors: list[Neighbor]
+
+
+class SimilarityMatrix(BaseModel):
+    run: SimilarityRunOut
+    works: list[WorkNeighbors] = Field(default_factory=list)
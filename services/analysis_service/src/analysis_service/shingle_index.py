@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import datetime as dt
+import hashlib
+import re
+import sqlite3
+from collections import Counter
+from pathlib import Path
+from typing import Iterable
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS postings (
+    shingle INTEGER NOT NULL,
+    work_id TEXT NOT NULL,
+    PRIMARY KEY (shingle, work_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_postings_work ON postings (work_id);
+CREATE TABLE IF NOT EXISTS indexed_works (
+    work_id TEXT PRIMARY KEY,
+    num_shingles INTEGER NOT NULL,
+    student_id TEXT,
+    submitted_at TEXT
+);
+"""
+
+# колонки indexed_works, добавленные позже: в файлах, созданных раньше, добавляются при подключении
+_ADDED_COLUMNS = {"student_id": "TEXT", "submitted_at": "TEXT"}
+
+
+def _timestamp(value: dt.datetime) -> str:
+    # фиксированная ширина: строки сравниваются в SQL как моменты времени
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+
+_unsafe_re = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+class ShingleIndex:
+    """Инвертированный индекс шинглов одного задания: хеш шингла -> список работ.
+
+    Хранится отдельным SQLite-файлом на задание. Запрос стоит O(шинглов новой работы)
+    и не зависит от размера архива: читаются только постинги её собственных шинглов.
+    """
+
+    def __init__(self, root: str | Path, assignment_id: str, batch_size: int = 500, max_candidates: int = 1000):
+        digest = hashlib.sha1(assignment_id.encode("utf-8")).hexdigest()[:8]
+        name = f"{_unsafe_re.sub('_', assignment_id)[:64]}__{digest}.sqlite"
+        self.path = Path(root) / name
+        self.batch_size = batch_size
+        self.max_candidates = max_candidates
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(indexed_works)")}
+        for (column, type_) in _ADDED_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE indexed_works ADD COLUMN {column} {type_}")
+        return conn
+
+    def _batches(self, shingle_hashes: Iterable[int]):
+        ordered = sorted(shingle_hashes)
+        for i in range(0, len(ordered), self.batch_size):
+            yield ordered[i:i + self.batch_size]
+
+    def add(
+        self,
+        work_id: str,
+        shingle_hashes: Iterable[int],
+        student_id: str | None = None,
+        submitted_at: dt.datetime | None = None,
+    ) -> None:
+        """Индексирует работу; повторный вызов для той же работы заменяет её постинги."""
+        hashes = set(shingle_hashes)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM postings WHERE work_id = ?", (work_id,))
+                for batch in self._batches(hashes):
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO postings (shingle, work_id) VALUES (?, ?)",
+                        ((h, work_id) for h in batch),
+                    )
+                conn.execute(
+                    "INSERT OR REPLACE INTO indexed_works (work_id, num_shingles, student_id, submitted_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (work_id, len(hashes), student_id, _timestamp(submitted_at) if submitted_at else None),
+                )
+        finally:
+            conn.close()
+
+    def remove(self, work_id: str) -> None:
+        """Убирает работу из индекса (нет такой работы — ничего не делает)."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM postings WHERE work_id = ?", (work_id,))
+                conn.execute("DELETE FROM indexed_works WHERE work_id = ?", (work_id,))
+        finally:
+            conn.close()
+
+    def overlaps(
+        self,
+        shingle_hashes: Iterable[int],
+        exclude_work_id: str | None = None,
+        exclude_student_id: str | None = None,
+        submitted_before: dt.datetime | None = None,
+    ) -> dict[str, int]:
+        """Число общих шинглов с каждой проиндексированной работой.
+
+        Работы студента `exclude_student_id` и сданные не раньше `submitted_before` отсеиваются до подсчёта,
+        поэтому не занимают места кандидатов (работы, проиндексированные без этих данных, не отсеиваются).
+        Постинги сливаются пачками по `batch_size` шинглов; счётчик кандидатов
+        ограничен `max_candidates` (самые слабые совпадения отбрасываются).
+        """
+        counts: Counter[str] = Counter()
+        before = _timestamp(submitted_before) if submitted_before else None
+        conn = self._connect()
+        try:
+            for batch in self._batches(shingle_hashes):
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT p.work_id, COUNT(*) FROM postings p JOIN indexed_works w ON w.work_id = p.work_id "
+                    f"WHERE p.shingle IN ({placeholders}) AND p.work_id != ? "
+                    "AND (? IS NULL OR w.student_id IS NULL OR w.student_id != ?) "
+                    "AND (? IS NULL OR w.submitted_at IS NULL OR w.submitted_at < ?) "
+                    "GROUP BY p.work_id",
+                    (*batch, exclude_work_id or "", exclude_student_id, exclude_student_id, before, before),
+                )
+                for (work_id, n) in rows:
+                    counts[work_id] += n
+                if len(counts) > 2 * self.max_candidates:
+                    counts = Counter(dict(counts.most_common(self.max_candidates)))
+        finally:
+            conn.close()
+        return dict(counts.most_common(self.max_candidates))
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import hashlib
+import random
+from array import array
+from collections import deque
+from typing import Iterable
+
+# Параметры MinHash: универсальное хеширование (a*x + b) mod p, p — простое Мерсенна
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_SEED = 1
+
+
+def _hash64(text: str) -> int:
+    """Стабильный 64-битный хеш строки (знаковый, чтобы помещался в INTEGER SQLite)."""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+class ShingleStream:
+    """Множество хешей словесных n-грамм (шинглов) текста.
+
+    Слова подаются порциями (`feed`), окно переносится между ними, поэтому текст не нужен в памяти целиком.
+    """
+
+    def __init__(self, size: int = 5):
+        self.size = size
+        self.hashes: set[int] = set()
+        self._window: deque[str] = deque(maxlen=size)
+        self._seen = 0
+
+    def feed(self, words: Iterable[str]) -> None:
+        for w in words:
+            self._window.append(w)
+            self._seen += 1
+            if self._seen >= self.size:
+                self.hashes.add(_hash64(" ".join(self._window)))
+
+    def finish(self) -> set[int]:
+        # текст короче шингла — один шингл из всех слов
+        if 0 < self._seen < self.size:
+            self.hashes.add(_hash64(" ".join(self._window)))
+        return self.hashes
+
+
+class MinHasher:
+    """Считает MinHash-сигнатуры фиксированной длины для множеств шинглов."""
+
+    def __init__(self, num_perm: int = 128, seed: int = _SEED):
+        rnd = random.Random(seed)
+        self.num_perm = num_perm
+        self._perms = [
+            (rnd.randint(1, _MERSENNE_PRIME - 1), rnd.randint(0, _MERSENNE_PRIME - 1))
+            for _ in range(num_perm)
+        ]
+
+    def signature(self, shingle_hashes: Iterable[int]) -> list[int]:
+        hashes = list(shingle_hashes)
+        if not hashes:
+            return [_MAX_HASH] * self.num_perm
+        p = _MERSENNE_PRIME
+        return [min(((a * h + b) % p) & _MAX_HASH for h in hashes) for (a, b) in self._perms]
+
+
+def pack_signature(sig: list[int]) -> bytes:
+    return array("I", sig).tobytes()
+
+
+def unpack_signature(data: bytes) -> list[int]:
+    sig = array("I")
+    sig.frombytes(data)
+    return sig.tolist()
+
+
+def lsh_buckets(sig: list[int], bands: int) -> list[tuple[int, str]]:
+    """Разбивает сигнатуру на полосы и возвращает (номер полосы, ключ корзины)."""
+    rows = len(sig) // bands
+    if rows == 0:
+        raise ValueError("Number of LSH bands exceeds signature length")
+    out = []
+    for band in range(bands):
+        chunk = array("I", sig[band * rows:(band + 1) * rows]).tobytes()
+        out.append((band, hashlib.blake2b(chunk, digest_size=8).hexdigest()))
+    return out
+
+
+def estimate_similarity(a: list[int], b: list[int]) -> float:
+    """Оценка коэффициента Жаккара по доле совпавших позиций сигнатур."""
+    if not a or len(a) != len(b):
+        return 0.0
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
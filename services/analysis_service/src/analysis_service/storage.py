@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+import uuid
+from pathlib import Path
+from typing import AsyncIterator
+
+from .config import settings
+
+
+async def spool_to_file(chunks: AsyncIterator[bytes]) -> Path:
+    """Пишет поток содержимого файла во временный файл в `spool_dir`; удалить его — забота вызывающего."""
+    path = Path(settings.spool_dir) / f"{uuid.uuid4()}.part"
+    try:
+        with path.open("wb") as out:
+            async for chunk in chunks:
+                out.write(chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path
@@ -0,0 +1,287 @@
+"""Распределённая трассировка запросов: gateway -> File Service -> Analysis Service.
+
+Контекст передаётся заголовком `traceparent` (W3C Trace Context), поэтому спаны всех сервисов одного запроса
+складываются в одно дерево. Спан — вызов, этап анализа или запрос к БД; текущий спан хранится в contextvar
+и наследуется вложенными корутинами. Законченные спаны копятся в памяти и фоновым потоком раз в
+`TRACE_FLUSH_INTERVAL` секунд пишутся в файл (`TRACE_FILE`, JSON на строку) и/или отправляются коллектору
+OpenTelemetry (`TRACE_OTLP_URL`, OTLP/HTTP JSON). Без них трассировка выключена и `span()` ничего не делает.
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from .config import settings
+
+SERVICE = "analysis_service"
+
+logger = logging.getLogger(__name__)
+
+# виды спанов OTLP
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+
+enabled = bool(settings.trace_file or settings.trace_otlp_url)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "sampled", "name", "kind", "start_ns", "attributes", "error")
+
+    def __init__(self, trace_id: str, parent_id: str | None, sampled: bool, name: str, kind: int, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.attributes = attributes
+        self.error: str | None = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+_current: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def parse_traceparent(header: str | None) -> tuple[str, str, bool] | None:
+    """(trace_id, parent span_id, sampled) из заголовка `traceparent`; None — заголовка нет или он испорчен."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[1] == "0" * 32:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+
+def current_traceparent() -> str | None:
+    """Значение `traceparent` для исходящего вызова (и для задания очереди): текущий спан как родитель."""
+    span = _current.get()
+    return span.traceparent if span is not None else None
+
+
+def current_trace_id() -> str | None:
+    span = _current.get()
+    return span.trace_id if span is not None else None
+
+
+def start_span(
+    name: str, kind: int = INTERNAL, parent: str | None = None, child_only: bool = False, **attributes
+) -> Span | None:
+    """Начинает спан, не делая его текущим (для листьев вроде запроса к БД); закончить — `end_span`.
+
+    Родитель — текущий спан, либо `parent` (значение traceparent; "" — без родителя) для нового корня: входящего
+    запроса или задания, поставленного в очередь другим запросом. Решение о записи трассы (`TRACE_SAMPLE_RATIO`)
+    принимается в её корне и передаётся дальше в traceparent. С `child_only` спан пишется только внутри трассы:
+    запросы к БД фоновых циклов (опрос очереди) не порождают собственных трасс.
+    """
+    if not enabled:
+        return None
+    current = _current.get()
+    if child_only and current is None:
+        return None
+    remote = parse_traceparent(parent) if parent is not None else None
+    if remote is not None:
+        trace_id, parent_id, sampled = remote
+    elif current is not None and parent is None:
+        trace_id, parent_id, sampled = current.trace_id, current.span_id, current.sampled
+    else:
+        trace_id, parent_id, sampled = os.urandom(16).hex(), None, random.random() < settings.trace_sample_ratio
+    return Span(trace_id, parent_id, sampled, name, kind, attributes)
+
+
+def end_span(s: Span | None, error: BaseException | None = None) -> None:
+    if s is None:
+        return
+    if error is not None:
+        s.error = f"{type(error).__name__}: {error}"
+    if s.sampled:
+        _exporter.submit(s, time.time_ns())
+
+
+@contextmanager
+def span(
+    name: str, kind: int = INTERNAL, parent: str | None = None, child_only: bool = False, **attributes
+) -> Iterator[Span | None]:
+    """Спан вокруг блока кода; внутри блока он текущий (родитель вложенных спанов и исходящих вызовов)."""
+    s = start_span(name, kind, parent, child_only, **attributes)
+    if s is None:
+        yield None
+        return
+    token = _current.set(s)
+    error = None
+    try:
+        yield s
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current.reset(token)
+        end_span(s, error)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(s: Span, end_ns: int) -> dict:
+    out = {
+        "traceId": s.trace_id,
+        "spanId": s.span_id,
+        "name": s.name,
+        "kind": s.kind,
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for (k, v) in s.attributes.items()],
+    }
+    if s.parent_id:
+        out["parentSpanId"] = s.parent_id
+    if s.error:
+        out["status"] = {"code": 2, "message": s.error}
+    return out
+
+
+def _file_record(s: Span, end_ns: int) -> dict:
+    return {
+        "trace_id": s.trace_id,
+        "span_id": s.span_id,
+        "parent_id": s.parent_id,
+        "service": SERVICE,
+        "name": s.name,
+        "kind": s.kind,
+        "start_ns": s.start_ns,
+        "duration_ms": round((end_ns - s.start_ns) / 1e6, 3),
+        "attributes": s.attributes,
+        "error": s.error,
+    }
+
+
+class _Exporter:
+    """Выгружает законченные спаны пачками из фонового потока: запрос не ждёт ни диска, ни коллектора.
+
+    Очередь ограничена `TRACE_QUEUE_SIZE`: если выгрузка не успевает, новые спаны отбрасываются.
+    """
+
+    def __init__(self, file: str | None, otlp_url: str | None, flush_interval: float, queue_size: int):
+        self.file = file
+        self.otlp_url = otlp_url
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue[tuple[Span, int]] = queue.Queue(maxsize=queue_size)
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def submit(self, s: Span, end_ns: int) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait((s, end_ns))
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self) -> None:
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return
+        if self.dropped:
+            logger.warning("Dropped %d spans: export queue is full", self.dropped)
+            self.dropped = 0
+        try:
+            if self.file:
+                # одна запись на пачку в режиме добавления: несколько процессов могут писать в один файл
+                lines = "".join(json.dumps(_file_record(s, end), ensure_ascii=False) + "\n" for (s, end) in batch)
+                with open(self.file, "a", encoding="utf-8") as f:
+                    f.write(lines)
+            if self.otlp_url:
+                body = {"resourceSpans": [{
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE}}]},
+                    "scopeSpans": [{"scope": {"name": SERVICE}, "spans": [_otlp_span(s, end) for (s, end) in batch]}],
+                }]}
+                req = urllib.request.Request(
+                    self.otlp_url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"}
+                )
+                urllib.request.urlopen(req, timeout=5).close()
+        except Exception:
+            logger.warning("Failed to export %d spans", len(batch), exc_info=True)
+
+
+_exporter = _Exporter(
+    settings.trace_file, settings.trace_otlp_url, settings.trace_flush_interval, settings.trace_queue_size
+)
+
+
+class TracingMiddleware:
+    """ASGI-middleware: серверный спан на запрос (продолжает трассу из входящего `traceparent`)
+    и заголовок ответа `X-Trace-Id`, по которому медленный запрос находится в выгруженных спанах."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled:
+            await self.app(scope, receive, send)
+            return
+        parent = None
+        for (key, value) in scope["headers"]:
+            if key == b"traceparent":
+                parent = value.decode("latin-1")
+                break
+        with span(scope["method"], kind=SERVER, parent=parent or "") as s:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    s.attributes["http.status_code"] = message["status"]
+                    message["headers"] = [*message.get("headers", []), (b"x-trace-id", s.trace_id.encode())]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                # имя — шаблон маршрута, как у метрик: FastAPI кладёт найденный маршрут в scope
+                route = getattr(scope.get("route"), "path", "unmatched")
+                s.name = f"{scope['method']} {route}"
+                s.attributes["http.route"] = route
+
+
+async def inject_traceparent(request) -> None:
+    """Хук запроса httpx: передаёт текущий спан вызываемому сервису в заголовке `traceparent`."""
+    value = current_traceparent()
+    if value is not None:
+        request.headers["traceparent"] = value
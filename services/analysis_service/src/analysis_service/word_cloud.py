@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import io
+import math
+import os
+import threading
+import uuid
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from PIL import Image, ImageDraw, ImageFont
+
+from .config import settings
+
+MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+_PALETTE = ["#1f77b4", "#d62728", "#2ca02c", "#9467bd", "#ff7f0e", "#17becf", "#8c564b", "#e377c2"]
+_BACKGROUND = "#ffffff"
+_FONT_FAMILY = "DejaVu Sans, Verdana, sans-serif"
+
+
+@dataclass
+class _Placed:
+    word: str
+    size: int
+    x: float  # начало базовой линии
+    y: float
+    color: str
+
+
+@lru_cache(maxsize=64)
+def _font(size: int) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
+    try:
+        return ImageFont.truetype(settings.wordcloud_font, size)
+    except OSError:
+        # шрифта нет (например, локальный запуск без fonts-dejavu-core): встроенный шрифт Pillow, без кириллицы
+        return ImageFont.load_default(size)
+
+
+def _overlaps(box: tuple[float, float, float, float], boxes: list[tuple[float, float, float, float]]) -> bool:
+    left, top, right, bottom = box
+    return any(left < r and l < right and top < b and t < bottom for (l, t, r, b) in boxes)
+
+
+def layout(words: list[dict], width: int, height: int) -> list[_Placed]:
+    """Раскладывает слова по архимедовой спирали от центра: частые — крупнее и ближе к центру.
+
+    Размер шрифта пропорционален корню из частоты. Слово, которое не помещается, уменьшается, пока не дойдёт
+    до минимального размера, иначе пропускается. Раскладка детерминирована: одни слова — одна картинка.
+    """
+    words = sorted((w for w in words if w.get("word")), key=lambda w: -int(w.get("count", 1)))
+    if not words:
+        return []
+    top = math.sqrt(int(words[0].get("count", 1)))
+    max_size = max(12, int(min(width, height) / 5))
+    min_size = max(8, max_size // 8)
+    margin = max(2, min(width, height) // 100)
+    placed: list[_Placed] = []
+    boxes: list[tuple[float, float, float, float]] = []
+
+    for i, item in enumerate(words):
+        word = str(item["word"])
+        size = max(min_size, int(max_size * math.sqrt(int(item.get("count", 1))) / top))
+        while size >= min_size:
+            left, asc, right, desc = _font(size).getbbox(word, anchor="ls")
+            w, h = right - left, desc - asc
+            position = _find_place(w + 2 * margin, h + 2 * margin, width, height, boxes)
+            if position is not None:
+                x, y = position
+                boxes.append((x, y, x + w + 2 * margin, y + h + 2 * margin))
+                placed.append(_Placed(word, size, x + margin - left, y + margin - asc, _PALETTE[i % len(_PALETTE)]))
+                break
+            size = int(size * 0.8)
+    return placed
+
+
+def _find_place(w: float, h: float, width: int, height: int, boxes) -> tuple[float, float] | None:
+    if w > width or h > height:
+        return None
+    cx, cy = (width - w) / 2, (height - h) / 2
+    step = max(1.0, min(width, height) / 200)
+    # спираль r = a·t, растянутая по пропорциям холста; шаг угла уменьшается с радиусом
+    t = 0.0
+    limit = math.hypot(width, height)
+    while step * t < limit:
+        x = cx + step * t * math.cos(t) * width / height
+        y = cy + step * t * math.sin(t)
+        if 0 <= x <= width - w and 0 <= y <= height - h and not _overlaps((x, y, x + w, y + h), boxes):
+            return x, y
+        t += 1.0 / max(1.0, math.sqrt(t))
+    return None
+
+
+def render_png(placed: list[_Placed], width: int, height: int) -> bytes:
+    image = Image.new("RGB", (width, height), _BACKGROUND)
+    draw = ImageDraw.Draw(image)
+    for p in placed:
+        draw.text((p.x, p.y), p.word, font=_font(p.size), fill=p.color, anchor="ls")
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    return out.getvalue()
+
+
+def render_svg(placed: list[_Placed], width: int, height: int) -> bytes:
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">',
+        f'<rect width="100%" height="100%" fill="{_BACKGROUND}"/>',
+        f'<g font-family="{_FONT_FAMILY}">',
+    ]
+    for p in placed:
+        parts.append(
+            f'<text x="{p.x:.1f}" y="{p.y:.1f}" font-size="{p.size}" fill="{p.color}">{escape(p.word)}</text>'
+        )
+    parts.append("</g></svg>")
+    return "\n".join(parts).encode("utf-8")
+
+
+def cache_path(report_id: str, fmt: str, width: int, height: int) -> Path:
+    return Path(settings.wordcloud_dir) / f"{report_id}_{width}x{height}.{fmt}"
+
+
+# Дисковый кэш ограничен WORDCLOUD_CACHE_MAX_BYTES: ключ включает размер, выбранный клиентом, так что без предела
+# один отчёт мог бы породить сколько угодно файлов. Время последнего обращения — mtime файла (обновляется
+# при попадании); при превышении предела удаляются самые старые, с запасом до EVICT_TO от предела.
+EVICT_TO = 0.9
+_cache_lock = threading.Lock()
+_cache_bytes: int | None = None
+
+
+def touch(path: Path) -> bool:
+    """Отмечает попадание в кэш; False — файла уже нет (вытеснен)."""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _cached_files() -> list[tuple[float, int, Path]]:
+    files = []
+    for path in Path(settings.wordcloud_dir).iterdir():
+        if path.name.endswith(".part"):
+            continue
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((st.st_mtime, st.st_size, path))
+    return files
+
+
+def _account(added: int) -> None:
+    global _cache_bytes
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(size for (_, size, _) in _cached_files())
+        else:
+            _cache_bytes += added
+        if _cache_bytes <= settings.wordcloud_cache_max_bytes:
+            return
+        # точный пересчёт: каталог могут делить несколько процессов и реплик
+        files = sorted(_cached_files())
+        total = sum(size for (_, size, _) in files)
+        target = int(settings.wordcloud_cache_max_bytes * EVICT_TO)
+        for (_, size, path) in files:
+            if total <= target:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        _cache_bytes = total
+
+
+def render_to_cache(words: list[dict], report_id: str, fmt: str, width: int, height: int) -> bytes:
+    """Рисует облако слов и кладёт его в дисковый кэш (атомарно, через временный файл). Вызывается в потоке."""
+    placed = layout(words, width, height)
+    data = render_png(placed, width, height) if fmt == "png" else render_svg(placed, width, height)
+    path = cache_path(report_id, fmt, width, height)
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    _account(len(data))
+    return data
@@ -0,0 +1,168 @@
+"""Отдача содержимого файлов: ETag, условные запросы (304) и диапазоны (Range -> 206).
+
+Blob неизменяем и адресуется sha256, поэтому ETag — сам sha256 (сильный валидатор): совпадение If-None-Match
+отвечается 304 без тела, If-Range и Range позволяют докачать или прочитать часть файла.
+Тело отдаётся через расширение ASGI `http.response.zerocopysend` (os.sendfile из файла в сокет), если сервер
+его поддерживает; иначе нужный диапазон читается os.pread блоками по `CHUNK_SIZE` в потоке.
+Blob, сжатый gzip (storage.py), клиенту с `Accept-Encoding: gzip` отдаётся как есть с `Content-Encoding: gzip`;
+иначе — распаковывается потоково, диапазон отсчитывается в исходном содержимом.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import zlib
+from pathlib import Path
+from typing import Mapping
+from urllib.parse import quote
+
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# крупный блок: меньше переходов в поток и вызовов send на мегабайт
+CHUNK_SIZE = 1024 * 1024
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def etag_for(sha256: str, gzip: bool = False) -> str:
+    # представление в gzip — другие байты, поэтому и другой сильный ETag
+    return f'"{sha256}-gzip"' if gzip else f'"{sha256}"'
+
+
+def etag_matches(header: str | None, etag: str) -> bool:
+    """Совпадение If-None-Match с ETag (слабое сравнение, как требует RFC 9110 для If-None-Match)."""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """Диапазон `Range: bytes=...` -> (start, end) включительно.
+
+    None — отдать файл целиком: заголовка нет, он не в байтах, испорчен или диапазонов несколько
+    (RFC позволяет проигнорировать Range). RangeNotSatisfiable — диапазон целиком за концом файла.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = (part.strip() for part in spec.partition("-"))
+    if not sep or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        # суффикс: последние N байт
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    if end < start:
+        return None
+    return start, end
+
+
+def accepts_gzip(header: str | None) -> bool:
+    """Принимает ли клиент gzip (`Accept-Encoding`); явный `q=0` — отказ."""
+    for item in (header or "").split(","):
+        coding, _, params = item.partition(";")
+        if coding.strip().lower() in ("gzip", "*"):
+            q = params.strip().removeprefix("q=").strip()
+            try:
+                return not q or float(q) > 0
+            except ValueError:
+                return True
+    return False
+
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+class BlobResponse(Response):
+    """Ответ с частью файла [start, start + length) без чтения файла целиком в память.
+
+    С `gzip_blob` файл — gzip, а [start, start + length) — диапазон распакованного содержимого.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        start: int,
+        length: int,
+        status_code: int = 200,
+        headers: Mapping[str, str] | None = None,
+        media_type: str | None = None,
+        gzip_blob: bool = False,
+    ) -> None:
+        self.path = path
+        self.gzip_blob = gzip_blob
+        self.start = start
+        self.length = length
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.init_headers({**(headers or {}), "Content-Length": str(length)})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # открываем до заголовков: если blob удалён между проверкой и отдачей, клиент получит 410, а не обрыв
+        try:
+            file = open(self.path, "rb")
+        except FileNotFoundError:
+            await Response("File is missing on disk", status_code=410)(scope, receive, send)
+            return
+        with file:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope["method"] == "HEAD" or self.length == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            elif self.gzip_blob:
+                await self._send_decompressed(file, send)
+            elif "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            else:
+                offset, remaining = self.start, self.length
+                while remaining:
+                    chunk = await asyncio.to_thread(os.pread, file.fileno(), min(CHUNK_SIZE, remaining), offset)
+                    if not chunk:
+                        raise RuntimeError(f"{self.path} is shorter than expected")
+                    offset += len(chunk)
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+
+    async def _send_decompressed(self, file, send: Send) -> None:
+        decompressor = zlib.decompressobj(31)
+        offset, skip, remaining = 0, self.start, self.length
+        pending = b""
+        while remaining:
+            if not pending:
+                pending = await asyncio.to_thread(os.pread, file.fileno(), CHUNK_SIZE, offset)
+                if not pending:
+                    raise RuntimeError(f"{self.path} is shorter than expected")
+                offset += len(pending)
+            # распаковка в потоке (zlib отпускает GIL) и не больше CHUNK_SIZE за раз: память не зависит от степени сжатия
+            chunk = await asyncio.to_thread(decompressor.decompress, pending, CHUNK_SIZE)
+            pending = decompressor.unconsumed_tail
+            if skip:
+                dropped = min(skip, len(chunk))
+                chunk, skip = chunk[dropped:], skip - dropped
+            if chunk:
+                chunk = chunk[:remaining]
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
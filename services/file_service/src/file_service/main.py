@@ -1,31 +1,46 @@
+import asyncio
+import datetime as dt
+import time
 import uuid
 from pathlib import Path
+from urllib.parse import quote, unquote
 
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, UploadFile, File, Header, Request, Depends, HTTPException
+from fastapi.responses import Response
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .config import settings
-from .db import SessionLocal, init_db
-from .models import StoredFile
+from .db import backend, get_db, init_db
+from .downloads import (
+    BlobResponse, RangeNotSatisfiable, accepts_gzip, content_disposition, etag_for, etag_matches, parse_range,
+)
+from .models import StoredFile, Blob
 from .schemas import UploadResponse, FileMeta
-from .storage import save_upload_file
+from .metrics import MetricsMiddleware, render, stage
+from .tracing import TracingMiddleware
+from .storage import StagedUpload, blob_paths, existing_blob, is_compressed, stage_stream, stage_upload_file
 
 app = FastAPI(title="File Storing Service", version="1.0.0")
-
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 
 
 @app.on_event("startup")
-def _startup():
+async def _startup():
     Path(settings.files_dir).mkdir(parents=True, exist_ok=True)
-    init_db()
+    Path(settings.blobs_dir).mkdir(parents=True, exist_ok=True)
+    Path(settings.tmp_dir).mkdir(parents=True, exist_ok=True)
+    # недописанные загрузки, оставшиеся после остановки сервиса (свежие могут принадлежать другой реплике)
+    stale_before = time.time() - settings.tmp_max_age
+    for leftover in Path(settings.tmp_dir).glob("*.part"):
+        try:
+            if leftover.stat().st_mtime < stale_before:
+                leftover.unlink(missing_ok=True)
+        except FileNotFoundError:
+            pass
+    await init_db()
 
 
 @app.get("/health")
@@ -33,44 +48,134 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    body, content_type = render()
+    return Response(content=body, media_type=content_type)
+
+
+def _safe_name(filename: str | None) -> str:
+    return (filename or "uploaded.bin").replace("/", "_").replace("\\", "_")
+
+
+async def _ref_blob(db: AsyncSession, staged: StagedUpload) -> Path:
+    """Добавляет ссылку на blob с этим содержимым; новое содержимое записывается, дубликат отбрасывается.
+
+    Upsert держит блокировку строки blob-а (в SQLite — блокировку записи БД) до commit, поэтому проверка
+    файла на диске не разминётся с удалением последней ссылки на тот же blob, в том числе на другой реплике.
+    """
+    insert = postgresql.insert if backend == "postgresql" else sqlite.insert
+    await db.execute(
+        insert(Blob)
+        .values(sha256=staged.sha256, size_bytes=staged.size, refcount=1, created_at=dt.datetime.utcnow())
+        .on_conflict_do_update(index_elements=[Blob.sha256], set_={"refcount": Blob.refcount + 1})
+    )
+    with stage("blob_store"):
+        # blob мог быть записан сжатым или нет (настройки и содержимое первой загрузки) — подходит любой
+        path = existing_blob(Path(settings.blobs_dir), staged.sha256)
+        if path is not None:
+            staged.discard()
+        else:
+            path = await asyncio.to_thread(staged.store, Path(settings.blobs_dir))
+    return path
+
+
+async def _store_record(db: AsyncSession, safe_name: str, content_type: str, staged: StagedUpload) -> UploadResponse:
+    meta = FileMeta(
+        id=str(uuid.uuid4()),
+        original_filename=safe_name,
+        content_type=content_type,
+        size_bytes=staged.size,
+        sha256=staged.sha256,
+        created_at=dt.datetime.utcnow(),
+    )
+    try:
+        stored_path = await _ref_blob(db, staged)
+        db.add(StoredFile(**meta.model_dump(), stored_path=str(stored_path)))
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        staged.discard()
+        raise
+    # ответ собирается из известных значений: без refresh соединение с БД возвращается в пул сразу после commit
+    return UploadResponse(file=meta)
+
+
 @app.post("/files", response_model=UploadResponse)
-async def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    file_id = str(uuid.uuid4())
-    safe_name = (file.filename or "uploaded.bin").replace("/", "_").replace("\\", "_")
-    stored_path = Path(settings.files_dir) / f"{file_id}__{safe_name}"
+async def upload_file(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    try:
+        with stage("stage_upload"):
+            staged = await stage_upload_file(
+                file, Path(settings.tmp_dir), settings.blob_memory_limit,
+                settings.blob_compress_level, settings.blob_compress_min_ratio,
+            )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to store file: {e}")
+
+    return await _store_record(db, _safe_name(file.filename), file.content_type or "application/octet-stream", staged)
+
 
+@app.post("/files/stream", response_model=UploadResponse)
+async def upload_file_stream(
+    request: Request,
+    x_filename: str | None = Header(default=None),
+    db: AsyncSession = Depends(get_db),
+):
+    """Загрузка сырым телом запроса (имя файла — в заголовке X-Filename, URL-кодированное).
+
+    Тело принимается по мере получения, без промежуточного spool-файла multipart.
+    """
     try:
-        size, sha256 = await save_upload_file(file, stored_path)
+        with stage("stage_upload"):
+            staged = await stage_stream(
+                request.stream(), Path(settings.tmp_dir), settings.blob_memory_limit,
+                settings.blob_compress_level, settings.blob_compress_min_ratio,
+            )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to store file: {e}")
 
-    record = StoredFile(
-        id=file_id,
-        original_filename=safe_name,
-        content_type=file.content_type or "application/octet-stream",
-        size_bytes=size,
-        sha256=sha256,
-        stored_path=str(stored_path),
-    )
-    db.add(record)
-    db.commit()
-    db.refresh(record)
-
-    return UploadResponse(
-        file=FileMeta(
-            id=record.id,
-            original_filename=record.original_filename,
-            content_type=record.content_type,
-            size_bytes=record.size_bytes,
-            sha256=record.sha256,
-            created_at=record.created_at,
-        )
-    )
+    safe_name = _safe_name(unquote(x_filename) if x_filename else None)
+    content_type = request.headers.get("content-type") or "application/octet-stream"
+    return await _store_record(db, safe_name, content_type, staged)
+
+
+@app.delete("/files/{file_id}", status_code=204)
+async def delete_file(file_id: str, db: AsyncSession = Depends(get_db)):
+    """Удаляет запись о файле; blob удаляется вместе с последней ссылкой на него.
+
+    Файл удаляется только после commit: при сбое транзакции запись и blob остаются согласованными
+    (в худшем случае на диске остаётся лишний blob без ссылок, но не запись без содержимого).
+    """
+    record = await db.get(StoredFile, file_id)
+    if not record:
+        raise HTTPException(status_code=404, detail="File not found")
+    path = Path(record.stored_path)
+    sha256 = record.sha256
+    await db.delete(record)
+
+    if path not in blob_paths(Path(settings.blobs_dir), sha256):
+        await db.commit()
+        # файл, сохранённый до появления blob-хранилища, принадлежит только этой записи
+        path.unlink(missing_ok=True)
+        return Response(status_code=204)
+
+    await db.execute(update(Blob).where(Blob.sha256 == sha256).values(refcount=Blob.refcount - 1))
+    refcount = (await db.execute(select(Blob.refcount).where(Blob.sha256 == sha256))).scalar_one_or_none()
+    await db.commit()
+    if refcount is not None and refcount <= 0:
+        # отдельная транзакция: удаление строки блокирует её так же, как upsert в _ref_blob, поэтому
+        # загрузка того же содержимого либо дождётся удаления и запишет blob заново, либо успеет
+        # поднять refcount — и тогда строка не удалится, а файл останется
+        deleted = await db.execute(delete(Blob).where(Blob.sha256 == sha256, Blob.refcount <= 0))
+        if deleted.rowcount:
+            path.unlink(missing_ok=True)
+        await db.commit()
+    return Response(status_code=204)
 
 
 @app.get("/files/{file_id}/meta", response_model=FileMeta)
-def get_file_meta(file_id: str, db: Session = Depends(get_db)):
-    record = db.get(StoredFile, file_id)
+async def get_file_meta(file_id: str, db: AsyncSession = Depends(get_db)):
+    record = await db.get(StoredFile, file_id)
     if not record:
         raise HTTPException(status_code=404, detail="File not found")
     return FileMeta(
@@ -83,17 +188,71 @@ def get_file_meta(file_id: str, db: Session = Depends(get_db)):
     )
 
 
-@app.get("/files/{file_id}/download")
-def download(file_id: str, db: Session = Depends(get_db)):
-    record = db.get(StoredFile, file_id)
+async def _stored_file(db: AsyncSession, file_id: str) -> tuple[StoredFile, Path]:
+    record = await db.get(StoredFile, file_id)
     if not record:
         raise HTTPException(status_code=404, detail="File not found")
     path = Path(record.stored_path)
     if not path.exists():
         raise HTTPException(status_code=410, detail="File metadata exists but file is missing on disk")
+    return record, path
+
+
+def _file_response(request: Request, record: StoredFile, path: Path, headers: dict[str, str] | None = None) -> Response:
+    """Содержимое файла с учётом If-None-Match (304), Range и If-Range (206, 416).
+
+    Сжатый blob отдаётся как есть (`Content-Encoding: gzip`) на запрос всего файла от клиента, принимающего gzip,
+    иначе распаковывается на лету.
+    """
+    compressed = is_compressed(path, Path(settings.blobs_dir), record.sha256)
+    passthrough = compressed and "range" not in request.headers and accepts_gzip(request.headers.get("accept-encoding"))
+    etag = etag_for(record.sha256, gzip=passthrough)
+    common = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": settings.file_cache_control, **(headers or {})}
+    if compressed:
+        common["Vary"] = "Accept-Encoding"
+    # содержимое обоих представлений одно и то же: у клиента актуальна любая копия
+    if_none_match = request.headers.get("if-none-match")
+    if any(etag_matches(if_none_match, etag_for(record.sha256, gzip)) for gzip in (False, True)):
+        return Response(status_code=304, headers=common)
+    if passthrough:
+        common["Content-Disposition"] = content_disposition(record.original_filename)
+        common["Content-Encoding"] = "gzip"
+        return BlobResponse(path, 0, path.stat().st_size, headers=common, media_type=record.content_type)
 
-    return FileResponse(
-        path=str(path),
-        media_type=record.content_type,
-        filename=record.original_filename,
+    size = record.size_bytes
+    byte_range = None
+    # If-Range с другим ETag: файл у клиента устарел — диапазон не применяется, отдаётся весь файл
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range.strip() == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**common, "Content-Range": f"bytes */{size}"})
+
+    common["Content-Disposition"] = content_disposition(record.original_filename)
+    if byte_range is None:
+        return BlobResponse(path, 0, size, headers=common, media_type=record.content_type, gzip_blob=compressed)
+    start, end = byte_range
+    return BlobResponse(
+        path, start, end - start + 1, status_code=206, media_type=record.content_type,
+        headers={**common, "Content-Range": f"bytes {start}-{end}/{size}"}, gzip_blob=compressed,
     )
+
+
+@app.api_route("/files/{file_id}/download", methods=["GET", "HEAD"])
+async def download(file_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    record, path = await _stored_file(db, file_id)
+    return _file_response(request, record, path)
+
+
+@app.api_route("/files/{file_id}/content", methods=["GET", "HEAD"])
+async def content(file_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    """Метаданные и содержимое за один запрос: метаданные — в заголовках X-File-*, тело отдаётся потоком."""
+    record, path = await _stored_file(db, file_id)
+    return _file_response(request, record, path, headers={
+        "X-File-Id": record.id,
+        "X-File-Name": quote(record.original_filename),
+        "X-File-Size": str(record.size_bytes),
+        "X-File-Sha256": record.sha256,
+        "X-File-Created-At": record.created_at.isoformat(),
+    })
@@ -1,5 +1,5 @@
 import datetime as dt
-from sqlalchemy import String, DateTime, Integer
+from sqlalchemy import String, DateTime, Integer, BigInteger
 from sqlalchemy.orm import Mapped, mapped_column
 from .db import Base
 
@@ -10,7 +10,18 @@ class StoredFile(Base):
     id: Mapped[str] = mapped_column(String, primary_key=True)
     original_filename: Mapped[str] = mapped_column(String, nullable=False)
     content_type: Mapped[str] = mapped_column(String, nullable=False, default="application/octet-stream")
-    size_bytes: Mapped[int] = mapped_column(Integer, nullable=False)
+    size_bytes: Mapped[int] = mapped_column(BigInteger, nullable=False)
     sha256: Mapped[str] = mapped_column(String, nullable=False, index=True)
     stored_path: Mapped[str] = mapped_column(String, nullable=False)
     created_at: Mapped[dt.datetime] = mapped_column(DateTime, default=lambda: dt.datetime.utcnow(), nullable=False)
+
+
+class Blob(Base):
+    """Содержимое файла, хранимое один раз на sha256; refcount — число ссылающихся StoredFile."""
+
+    __tablename__ = "blobs"
+
+    sha256: Mapped[str] = mapped_column(String, primary_key=True)
+    size_bytes: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    refcount: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created_at: Mapped[dt.datetime] = mapped_column(DateTime, default=lambda: dt.datetime.utcnow(), nullable=False)
@@ -1,25 +1,174 @@
+import asyncio
+import gzip
 import hashlib
+import os
+import uuid
+import zlib
 from pathlib import Path
+from typing import AsyncIterator
+
 from fastapi import UploadFile
 
 CHUNK_SIZE = 1024 * 1024  # 1MB
 
+# суффикс blob-а, сжатого gzip; несжатый blob лежит без суффикса
+GZIP_SUFFIX = ".gz"
+
+
+def blob_path(blobs_dir: Path, sha256: str, compressed: bool = False) -> Path:
+    """Путь blob-а по sha256 с разбиением на подкаталоги: blobs/ab/cd/abcd...."""
+    path = blobs_dir / sha256[:2] / sha256[2:4] / sha256
+    return path.with_name(sha256 + GZIP_SUFFIX) if compressed else path
+
+
+def blob_paths(blobs_dir: Path, sha256: str) -> tuple[Path, Path]:
+    """Оба возможных пути blob-а: несжатый и сжатый (что выбрано, зависит от содержимого и настроек при записи)."""
+    return blob_path(blobs_dir, sha256), blob_path(blobs_dir, sha256, compressed=True)
+
+
+def existing_blob(blobs_dir: Path, sha256: str) -> Path | None:
+    for path in blob_paths(blobs_dir, sha256):
+        if path.exists():
+            return path
+    return None
+
+
+def is_compressed(path: Path, blobs_dir: Path, sha256: str) -> bool:
+    """Сжат ли файл записи: только сжатый blob этого sha256. По имени судить нельзя — файлы, сохранённые до
+    blob-хранилища, лежат под именем загрузки, и `*.gz` там — содержимое пользователя, а не сжатие хранилища."""
+    return path == blob_path(blobs_dir, sha256, compressed=True)
+
+
+class StagedUpload:
+    """Принятое содержимое, для которого ещё не решено, нужен ли новый blob.
+
+    Пока содержимое не больше `memory_limit`, оно держится в памяти и повторная загрузка
+    уже известного файла вообще не пишет на диск; большее содержимое уходит во временный файл.
 
-async def save_upload_file(upload_file: UploadFile, destination: Path) -> tuple[int, str]:
-    """Сохранить и посчитать sha256."""
-    destination.parent.mkdir(parents=True, exist_ok=True)
+    С `compress_level` > 0 содержимое хранится сжатым gzip, если сжимается хотя бы до `min_ratio` от исходного
+    размера: для содержимого в памяти это проверяется целиком, для большего — по первым `memory_limit` байтам,
+    после чего остаток сжимается потоково по мере записи во временный файл. sha256 и size — всегда от исходного
+    содержимого.
+    """
 
-    hasher = hashlib.sha256()
-    size = 0
+    def __init__(self, tmp_dir: Path, memory_limit: int, compress_level: int = 0, min_ratio: float = 0.9):
+        self.tmp_dir = tmp_dir
+        self.memory_limit = memory_limit
+        self.compress_level = compress_level
+        self.min_ratio = min_ratio
+        self.size = 0
+        self.compressed = False
+        self._hasher = hashlib.sha256()
+        self._buffer = bytearray()
+        self._tmp_path: Path | None = None
+        self._out = None
+        self._compressor = None
 
-    with destination.open("wb") as out:
-        while True:
-            chunk = await upload_file.read(CHUNK_SIZE)
+    @property
+    def sha256(self) -> str:
+        return self._hasher.hexdigest()
+
+    @property
+    def spilled(self) -> bool:
+        """Содержимое пишется во временный файл (запись и сжатие блокируют — их стоит уводить из event loop)."""
+        return self._out is not None
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        self._hasher.update(chunk)
+        if self._out is not None:
+            self._out.write(self._compressor.compress(chunk) if self._compressor is not None else chunk)
+            return
+        self._buffer += chunk
+        if len(self._buffer) > self.memory_limit:
+            self.tmp_dir.mkdir(parents=True, exist_ok=True)
+            self._tmp_path = self.tmp_dir / f"{uuid.uuid4()}.part"
+            self._out = self._tmp_path.open("wb")
+            data = bytes(self._buffer)
+            if self.compress_level > 0:
+                # решение о сжатии — по первому блоку: уже сжатые форматы (PDF, архивы) пишутся как есть
+                compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, 31)
+                head = compressor.compress(data)
+                probe = head + compressor.copy().flush()
+                if len(probe) <= len(data) * self.min_ratio:
+                    self._compressor, self.compressed, data = compressor, True, head
+            self._out.write(data)
+            self._buffer = bytearray()
+
+    def close(self) -> None:
+        if self._out is not None:
+            if self._compressor is not None:
+                self._out.write(self._compressor.flush())
+                self._compressor = None
+            self._out.close()
+            self._out = None
+
+    def _compress_buffer(self) -> bytes:
+        if self.compress_level > 0 and self._buffer:
+            # mtime=0: одинаковое содержимое даёт одинаковые байты blob-а
+            packed = gzip.compress(self._buffer, self.compress_level, mtime=0)
+            if len(packed) <= len(self._buffer) * self.min_ratio:
+                self.compressed = True
+                return packed
+        return bytes(self._buffer)
+
+    def store(self, blobs_dir: Path) -> Path:
+        """Кладёт содержимое по пути blob-а атомарно (через os.replace) и возвращает этот путь."""
+        self.close()
+        if self._tmp_path is None:
+            data = self._compress_buffer()
+            self.tmp_dir.mkdir(parents=True, exist_ok=True)
+            self._tmp_path = self.tmp_dir / f"{uuid.uuid4()}.part"
+            self._tmp_path.write_bytes(data)
+            self._buffer = bytearray()
+        destination = blob_path(blobs_dir, self.sha256, self.compressed)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(self._tmp_path, destination)
+        self._tmp_path = None
+        return destination
+
+    def discard(self) -> None:
+        self.close()
+        self._buffer = bytearray()
+        if self._tmp_path is not None:
+            self._tmp_path.unlink(missing_ok=True)
+            self._tmp_path = None
+
+
+async def stage_stream(
+    chunks: AsyncIterator[bytes], tmp_dir: Path, memory_limit: int, compress_level: int = 0, min_ratio: float = 0.9
+) -> StagedUpload:
+    """Принять поток чанков и посчитать sha256; содержимое остаётся в StagedUpload."""
+    staged = StagedUpload(tmp_dir, memory_limit, compress_level, min_ratio)
+    try:
+        async for chunk in chunks:
             if not chunk:
-                break
-            size += len(chunk)
-            hasher.update(chunk)
-            out.write(chunk)
+                continue
+            if staged.spilled or staged.size + len(chunk) > memory_limit:
+                # запись на диск и zlib отпускают GIL: большой файл сжимается, не блокируя другие запросы
+                await asyncio.to_thread(staged.write, chunk)
+            else:
+                staged.write(chunk)
+        staged.close()
+    except BaseException:
+        staged.discard()
+        raise
+    return staged
+
+
+async def _read_upload(upload_file: UploadFile) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await upload_file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
 
-    await upload_file.close()
-    return size, hasher.hexdigest()
+async def stage_upload_file(
+    upload_file: UploadFile, tmp_dir: Path, memory_limit: int, compress_level: int = 0, min_ratio: float = 0.9
+) -> StagedUpload:
+    """Принять multipart-файл и посчитать sha256."""
+    try:
+        return await stage_stream(_read_upload(upload_file), tmp_dir, memory_limit, compress_level, min_ratio)
+    finally:
+        await upload_file.close()
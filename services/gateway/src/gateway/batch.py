@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import tarfile
+import zipfile
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, AsyncIterator, Callable, Iterator
+
+CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# источник содержимого файла пачки: при вызове отдаёт его чанками
+Source = Callable[[], AsyncIterator[bytes]]
+
+
+class BatchError(ValueError):
+    pass
+
+
+@dataclass
+class BatchItem:
+    index: int
+    filename: str
+    student_id: str
+    assignment_id: str
+
+
+def parse_manifest(raw: str, default_assignment_id: str | None, max_items: int) -> list[BatchItem]:
+    """Разбирает манифест: JSON-массив `{"file", "student_id", "assignment_id"}` (или объект с ключом `items`).
+
+    `assignment_id` элемента можно опустить, если он передан полем формы для всей пачки.
+    Каждый файл упоминается в манифесте не больше одного раза.
+    """
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise BatchError(f"Manifest is not valid JSON: {e}")
+    if isinstance(data, dict):
+        data = data.get("items")
+    if not isinstance(data, list) or not data:
+        raise BatchError("Manifest must be a non-empty JSON array of items")
+    if len(data) > max_items:
+        raise BatchError(f"Too many items in one batch (max {max_items})")
+
+    items = []
+    seen = set()
+    for (i, entry) in enumerate(data):
+        if not isinstance(entry, dict):
+            raise BatchError(f"Manifest item {i} must be an object")
+        filename = entry.get("file")
+        student_id = entry.get("student_id")
+        assignment_id = entry.get("assignment_id") or default_assignment_id
+        if not all(isinstance(v, str) and v for v in (filename, student_id, assignment_id)):
+            raise BatchError(f"Manifest item {i} needs non-empty file, student_id and assignment_id")
+        if filename in seen:
+            raise BatchError(f"File '{filename}' is listed in the manifest more than once")
+        seen.add(filename)
+        items.append(BatchItem(index=i, filename=filename, student_id=student_id, assignment_id=assignment_id))
+    return items
+
+
+def _upload_source(upload) -> Source:
+    async def chunks() -> AsyncIterator[bytes]:
+        await upload.seek(0)
+        while chunk := await upload.read(CHUNK_SIZE):
+            yield chunk
+    return chunks
+
+
+def upload_sources(uploads: list, max_bytes: int) -> dict[str, Source]:
+    """Источники для файлов, переданных отдельными частями формы (по имени файла).
+
+    Суммарный размер частей ограничен так же, как распакованный объём архива.
+    """
+    sources: dict[str, Source] = {}
+    total = 0
+    for upload in uploads:
+        name = upload.filename or ""
+        if name in sources:
+            raise BatchError(f"Duplicate file name in upload: '{name}'")
+        total += upload.size or 0
+        if total > max_bytes:
+            raise BatchError(f"Uploaded files exceed {max_bytes} bytes in total")
+        sources[name] = _upload_source(upload)
+    return sources
+
+
+def _path_source(path: Path) -> Source:
+    async def chunks() -> AsyncIterator[bytes]:
+        with path.open("rb") as f:
+            while chunk := await asyncio.to_thread(f.read, CHUNK_SIZE):
+                yield chunk
+    return chunks
+
+
+def _archive_members(fileobj: IO[bytes]) -> Iterator[tuple[str, IO[bytes]]]:
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    with zf.open(info) as member:
+                        yield info.filename, member
+        return
+
+    fileobj.seek(0)
+    try:
+        tf = tarfile.open(fileobj=fileobj, mode="r:*")
+    except tarfile.TarError:
+        raise BatchError("Archive must be a zip or tar (optionally gzip/bz2/xz-compressed) file")
+    with tf:
+        for info in tf:
+            if info.isfile():
+                member = tf.extractfile(info)
+                if member is not None:
+                    name = info.name[2:] if info.name.startswith("./") else info.name
+                    yield name, member
+
+
+def extract_archive(fileobj: IO[bytes], dest: Path, max_files: int, max_bytes: int) -> dict[str, Source]:
+    """Распаковывает zip/tar во временный каталог `dest` (блокирующая, вызывать через asyncio.to_thread).
+
+    Содержимое пишется под порядковыми именами, пути из архива в файловую систему не попадают;
+    число файлов и распакованный объём ограничены (защита от zip-бомб).
+    """
+    try:
+        return _extract(fileobj, dest, max_files, max_bytes)
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, zlib.error) as e:
+        raise BatchError(f"Archive is corrupted: {e}")
+
+
+def _extract(fileobj: IO[bytes], dest: Path, max_files: int, max_bytes: int) -> dict[str, Source]:
+    sources: dict[str, Source] = {}
+    total = 0
+    for (name, member) in _archive_members(fileobj):
+        if name in sources:
+            raise BatchError(f"Duplicate file name in archive: '{name}'")
+        if len(sources) >= max_files:
+            raise BatchError(f"Too many files in archive (max {max_files})")
+        path = dest / f"{len(sources)}.bin"
+        with path.open("wb") as out:
+            while chunk := member.read(CHUNK_SIZE):
+                total += len(chunk)
+                if total > max_bytes:
+                    raise BatchError(f"Archive unpacks to more than {max_bytes} bytes")
+                out.write(chunk)
+        sources[name] = _path_source(path)
+    return sources
@@ -1,49 +1,158 @@
 from __future__ import annotations
 
+from typing import AsyncIterator
+from urllib.parse import quote
+
 import httpx
-from fastapi import UploadFile
 from .config import settings
+from .metrics import downstream
+from . import tracing
+from .upload_stream import StreamedUpload
 
 
 class ServiceUnavailable(RuntimeError):
     pass
 
 
-async def store_file(file: UploadFile) -> dict:
-    url = f"{settings.file_service_url.rstrip('/')}/files"
+# Общий клиент с пулом keep-alive соединений; открывается и закрывается вместе с приложением
+_client: httpx.AsyncClient | None = None
+
+
+async def open_client() -> None:
+    global _client
+    _client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive_connections,
+            keepalive_expiry=settings.http_keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(settings.http_default_timeout, connect=settings.http_connect_timeout),
+        http2=settings.http2,
+        event_hooks={"request": [tracing.inject_traceparent]},
+    )
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _http() -> httpx.AsyncClient:
+    if _client is None:
+        raise RuntimeError("HTTP client is not started")
+    return _client
+
+
+def _timeout(seconds: float) -> httpx.Timeout:
+    return httpx.Timeout(seconds, connect=settings.http_connect_timeout)
+
+
+@downstream("file_service", "store_file_chunks")
+async def store_file_chunks(filename: str, content_type: str, chunks: AsyncIterator[bytes]) -> dict:
+    """Передаёт файл в File Service сырым телом запроса (`POST /files/stream`) по мере чтения чанков."""
+    url = f"{settings.file_service_url.rstrip('/')}/files/stream"
+    headers = {
+        "Content-Type": content_type,
+        "X-Filename": quote(filename or "uploaded.bin"),
+    }
     try:
-        async with httpx.AsyncClient(timeout=20.0) as client:
-            files = {"file": (file.filename or "uploaded.bin", file.file, file.content_type or "application/octet-stream")}
-            resp = await client.post(url, files=files)
+        resp = await _http().post(url, content=chunks, headers=headers, timeout=_timeout(settings.store_file_timeout))
         resp.raise_for_status()
         return resp.json()
-    except (httpx.ConnectError, httpx.ReadTimeout) as e:
+    except (httpx.ConnectError, httpx.ReadTimeout, httpx.PoolTimeout) as e:
         raise ServiceUnavailable(f"File service unavailable: {e}")
     except httpx.HTTPStatusError as e:
         raise RuntimeError(f"File service error {e.response.status_code}: {e.response.text}")
 
 
-async def create_report(payload: dict) -> dict:
-    url = f"{settings.analysis_service_url.rstrip('/')}/reports"
+async def stream_file(upload: StreamedUpload) -> dict:
+    """Передаёт файл из входящего запроса в File Service чанками, без промежуточной копии."""
+    return await store_file_chunks(upload.filename, upload.content_type, upload.file_chunks())
+
+
+@downstream("analysis_service", "list_reports")
+async def list_reports(work_id: str) -> list[dict]:
+    url = f"{settings.analysis_service_url.rstrip('/')}/works/{work_id}/reports"
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            resp = await client.post(url, json=payload)
+        resp = await _http().get(url, timeout=_timeout(settings.list_reports_timeout))
         resp.raise_for_status()
         return resp.json()
-    except (httpx.ConnectError, httpx.ReadTimeout) as e:
+    except (httpx.ConnectError, httpx.ReadTimeout, httpx.PoolTimeout) as e:
         raise ServiceUnavailable(f"Analysis service unavailable: {e}")
     except httpx.HTTPStatusError as e:
         raise RuntimeError(f"Analysis service error {e.response.status_code}: {e.response.text}")
 
 
-async def list_reports(work_id: str) -> list[dict]:
-    url = f"{settings.analysis_service_url.rstrip('/')}/works/{work_id}/reports"
+@downstream("analysis_service", "enqueue_analysis")
+async def enqueue_analysis(payload: dict) -> dict:
+    url = f"{settings.analysis_service_url.rstrip('/')}/jobs"
+    try:
+        resp = await _http().post(url, json=payload, timeout=_timeout(settings.enqueue_analysis_timeout))
+        resp.raise_for_status()
+        return resp.json()
+    except (httpx.ConnectError, httpx.ReadTimeout, httpx.PoolTimeout) as e:
+        raise ServiceUnavailable(f"Analysis service unavailable: {e}")
+    except httpx.HTTPStatusError as e:
+        raise RuntimeError(f"Analysis service error {e.response.status_code}: {e.response.text}")
+
+
+@downstream("analysis_service", "enqueue_analysis_batch")
+async def enqueue_analysis_batch(payloads: list[dict]) -> list[dict]:
+    """Ставит пачку анализов в очередь одним запросом (`POST /jobs/batch`); задания возвращаются в том же порядке."""
+    url = f"{settings.analysis_service_url.rstrip('/')}/jobs/batch"
+    try:
+        resp = await _http().post(url, json=payloads, timeout=_timeout(settings.enqueue_analysis_batch_timeout))
+        resp.raise_for_status()
+        return resp.json()
+    except (httpx.ConnectError, httpx.ReadTimeout, httpx.PoolTimeout) as e:
+        raise ServiceUnavailable(f"Analysis service unavailable: {e}")
+    except httpx.HTTPStatusError as e:
+        raise RuntimeError(f"Analysis service error {e.response.status_code}: {e.response.text}")
+
+
+@downstream("analysis_service", "get_analysis_job")
+async def get_analysis_job(job_id: str) -> dict:
+    url = f"{settings.analysis_service_url.rstrip('/')}/jobs/{job_id}"
+    try:
+        resp = await _http().get(url, timeout=_timeout(settings.get_analysis_job_timeout))
+        resp.raise_for_status()
+        return resp.json()
+    except (httpx.ConnectError, httpx.ReadTimeout, httpx.PoolTimeout) as e:
+        raise ServiceUnavailable(f"Analysis service unavailable: {e}")
+    except httpx.HTTPStatusError as e:
+        raise RuntimeError(f"Analysis service error {e.response.status_code}: {e.response.text}")
+
+
+@downstream("analysis_service", "get_assignment_analytics")
+async def get_assignment_analytics(assignment_id: str, view: str, params: dict) -> dict | list | None:
+    """Сводка (`view="summary"`), кластеры дубликатов (`"clusters"`) или соседи по матрице близости (`"similarity"`)
+    задания; None — по заданию ещё нет данных."""
+    url = f"{settings.analysis_service_url.rstrip('/')}/assignments/{assignment_id}/{view}"
+    try:
+        resp = await _http().get(url, params=params, timeout=_timeout(settings.assignment_analytics_timeout))
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return resp.json()
+    except (httpx.ConnectError, httpx.ReadTimeout, httpx.PoolTimeout) as e:
+        raise ServiceUnavailable(f"Analysis service unavailable: {e}")
+    except httpx.HTTPStatusError as e:
+        raise RuntimeError(f"Analysis service error {e.response.status_code}: {e.response.text}")
+
+
+@downstream("analysis_service", "start_assignment_similarity")
+async def start_assignment_similarity(assignment_id: str, params: dict) -> dict | None:
+    """Запускает расчёт матрицы близости работ задания; None — расчёт уже идёт."""
+    url = f"{settings.analysis_service_url.rstrip('/')}/assignments/{assignment_id}/similarity"
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.get(url)
+        resp = await _http().post(url, params=params, timeout=_timeout(settings.assignment_analytics_timeout))
+        if resp.status_code == 409:
+            return None
         resp.raise_for_status()
         return resp.json()
-    except (httpx.ConnectError, httpx.ReadTimeout) as e:
+    except (httpx.ConnectError, httpx.ReadTimeout, httpx.PoolTimeout) as e:
         raise ServiceUnavailable(f"Analysis service unavailable: {e}")
     except httpx.HTTPStatusError as e:
         raise RuntimeError(f"Analysis service error {e.response.status_code}: {e.response.text}")
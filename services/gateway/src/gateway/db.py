@@ -1,21 +1,125 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy import event, inspect, make_url, text
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import settings
+from .metrics import db_commit_seconds, timed
+from . import tracing
 
 
 class Base(DeclarativeBase):
     pass
 
 
-engine = create_engine(
-    settings.db_url,
-    connect_args={"check_same_thread": False},
-    pool_pre_ping=True,
+# асинхронные драйверы для URL без явного драйвера (sqlite:///..., postgresql://...)
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg"}
+
+# размер пула по умолчанию (pool_size, max_overflow). Писатель в SQLite один: лишние соединения только
+# соревнуются за блокировку записи, а запросы сверх пула ждут соединение в его очереди (FIFO), не крутясь в busy_timeout
+_POOL_DEFAULTS = {"sqlite": (4, 0), "postgresql": (10, 10)}
+
+
+def _async_url(url: str) -> URL:
+    parsed = make_url(url)
+    return parsed.set(drivername=_ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername))
+
+
+db_url = _async_url(settings.db_url)
+backend = db_url.get_backend_name()
+_pool_size, _max_overflow = _POOL_DEFAULTS.get(backend, (10, 10))
+
+# асинхронный движок для обработчиков и воркеров: запросы к БД не блокируют event loop.
+# Пул задан явно: для aiosqlite по умолчанию открывалось бы новое соединение (и PRAGMA) на каждую сессию
+engine = create_async_engine(
+    db_url,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=settings.db_pool_size if settings.db_pool_size is not None else _pool_size,
+    max_overflow=settings.db_max_overflow if settings.db_max_overflow is not None else _max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=backend != "sqlite",
 )
 
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+def _sqlite_pragmas(dbapi_conn, _record) -> None:
+    """Профиль SQLite: WAL (читатели не блокируют писателя), synchronous=NORMAL, ожидание блокировки, mmap и кэш страниц."""
+    cur = dbapi_conn.cursor()
+    cur.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+    cur.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+    cur.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+    cur.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+    # отрицательное значение cache_size — размер в КиБ, а не в страницах
+    cur.execute(f"PRAGMA cache_size=-{int(settings.sqlite_cache_size_kib)}")
+    cur.close()
+
+
+if backend == "sqlite":
+    event.listen(engine.sync_engine, "connect", _sqlite_pragmas)
+
+
+def _span_start(conn, cursor, statement, parameters, context, executemany) -> None:
+    context._trace_span = tracing.start_span("db.query", kind=tracing.CLIENT, child_only=True, statement=statement[:500])
+
+
+def _span_end(conn, cursor, statement, parameters, context, executemany) -> None:
+    tracing.end_span(context._trace_span)
+
+
+def _span_error(exception_context) -> None:
+    ctx = exception_context.execution_context
+    if ctx is not None:
+        tracing.end_span(getattr(ctx, "_trace_span", None), exception_context.original_exception)
 
-def init_db() -> None:
+
+if tracing.enabled:
+    # спан на каждый SQL-запрос (текст без параметров): видно, на каком запросе застрял медленный обработчик.
+    # События движка вызываются в контексте корутины, выполняющей запрос, поэтому родитель — её текущий спан
+    event.listen(engine.sync_engine, "before_cursor_execute", _span_start)
+    event.listen(engine.sync_engine, "after_cursor_execute", _span_end)
+    event.listen(engine.sync_engine, "handle_error", _span_error)
+
+
+class _TimedSession(AsyncSession):
+    """Сессия, снимающая время commit (метрика db_commit_duration_seconds и спан db.commit): в нём ожидание блокировки записи SQLite."""
+
+    async def commit(self) -> None:
+        with tracing.span("db.commit", child_only=True), timed(db_commit_seconds):
+            await super().commit()
+
+
+# expire_on_commit=False: после commit атрибуты не перечитываются (в async-сессии ленивой загрузки нет)
+AsyncSessionLocal = async_sessionmaker(engine, class_=_TimedSession, autoflush=False, expire_on_commit=False)
+
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def init_db() -> None:
     from . import models  # noqa: F401
-    Base.metadata.create_all(bind=engine)
+    async with engine.begin() as conn:
+        if backend == "postgresql":
+            # реплики стартуют одновременно: таблицы создаёт одна, остальные ждут блокировку и видят готовую схему
+            await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('init_db'))"))
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+
+
+def _add_missing_columns(conn) -> None:
+    """create_all не трогает уже существующие таблицы: колонки, добавленные в модели позже, добавляются здесь.
+
+    Такие колонки должны допускать NULL (ALTER TABLE ... ADD COLUMN без NOT NULL): у записанных раньше строк там NULL.
+    """
+    inspector = inspect(conn)
+    tables = set(inspector.get_table_names())
+    quote = conn.dialect.identifier_preparer.quote
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        present = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in present:
+                type_ = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {type_}"))
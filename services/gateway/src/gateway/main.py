@@ -1,26 +1,56 @@
+import asyncio
+import datetime as dt
+import hashlib
+import json
+import mimetypes
+import shutil
+import tempfile
 import uuid
-from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException
-from sqlalchemy.orm import Session
+from pathlib import Path
+from typing import AsyncIterator
 
-from .db import SessionLocal, init_db
+import anyio
+from fastapi import FastAPI, Request, Depends, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .db import AsyncSessionLocal, get_db, init_db
 from .models import Work
-from .schemas import WorkOut, SubmitWorkResponse, ReportSummary
-from .clients import store_file, create_report, list_reports, ServiceUnavailable
+from .schemas import WorkOut, SubmitWorkResponse
+from .upload_stream import StreamedUpload, UploadFormError
+from .batch import BatchError, BatchItem, Source, extract_archive, parse_manifest, upload_sources
+from .config import settings
+from .metrics import MetricsMiddleware, render, stage
+from .tracing import TracingMiddleware
+from .clients import (
+    stream_file,
+    store_file_chunks,
+    enqueue_analysis,
+    enqueue_analysis_batch,
+    get_analysis_job,
+    list_reports,
+    get_assignment_analytics,
+    start_assignment_similarity,
+    open_client,
+    close_client,
+    ServiceUnavailable,
+)
 
 app = FastAPI(title="API Gateway", version="1.0.0")
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@app.on_event("startup")
+async def _startup():
+    await init_db()
+    await open_client()
 
 
-@app.on_event("startup")
-def _startup():
-    init_db()
+@app.on_event("shutdown")
+async def _shutdown():
+    await close_client()
 
 
 @app.get("/health")
@@ -28,6 +58,12 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    body, content_type = render()
+    return Response(content=body, media_type=content_type)
+
+
 def _work_out(w: Work) -> WorkOut:
     return WorkOut(
         id=w.id,
@@ -38,94 +74,375 @@ def _work_out(w: Work) -> WorkOut:
         file_id=w.file_id,
         file_sha256=w.file_sha256,
         last_report_id=w.last_report_id,
+        analysis_job_id=w.analysis_job_id,
         error=w.error,
     )
 
 
-@app.post("/works", response_model=SubmitWorkResponse)
-async def submit_work(
-    student_id: str = Form(...),
-    assignment_id: str = Form(...),
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-):
+async def _checkpoint(db: AsyncSession) -> None:
+    """Промежуточный статус работы. В режиме unit of work (DB_UNIT_OF_WORK) он не коммитится отдельно:
+    строка попадает в БД одной транзакцией вместе с итоговым статусом запроса.
+    """
+    if not settings.db_unit_of_work:
+        await db.commit()
+
+
+def _analysis_payload(w: Work) -> dict:
+    return {
+        "work_id": w.id,
+        "student_id": w.student_id,
+        "assignment_id": w.assignment_id,
+        "submitted_at": w.submitted_at.isoformat(),
+        "file_id": w.file_id,
+        "file_sha256": w.file_sha256,
+    }
+
+
+async def _enqueue_analysis(work: Work, db: AsyncSession) -> None:
+    """Ставит анализ работы в очередь Analysis Service (status=ANALYSIS_QUEUED)."""
+    try:
+        job = await enqueue_analysis(_analysis_payload(work))
+    except ServiceUnavailable as e:
+        work.status = "ANALYSIS_FAILED"
+        work.error = str(e)
+        await db.commit()
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        work.status = "ANALYSIS_FAILED"
+        work.error = str(e)
+        await db.commit()
+        raise HTTPException(status_code=502, detail=str(e))
+
+    work.analysis_job_id = job["id"]
+    work.status = "ANALYSIS_QUEUED"
+    work.error = None
+    await db.commit()
+
+
+async def _sync_analysis_status(work: Work, db: AsyncSession) -> None:
+    """Подтягивает состояние задания анализа из Analysis Service, пока работа в очереди."""
+    if work.status != "ANALYSIS_QUEUED" or not work.analysis_job_id:
+        return
+    try:
+        job = await get_analysis_job(work.analysis_job_id)
+    except Exception:
+        # Analysis Service недоступен — отдаём последнее известное состояние
+        return
+
+    if job["status"] == "COMPLETED" and job.get("report"):
+        work.last_report_id = job["report"]["id"]
+        work.status = "ANALYZED"
+        work.error = None
+    elif job["status"] == "FAILED":
+        work.status = "ANALYSIS_FAILED"
+        work.error = job.get("error")
+    else:
+        return
+    await db.commit()
+
+
+_SUBMIT_WORK_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["student_id", "assignment_id", "file"],
+                    "properties": {
+                        "student_id": {"type": "string"},
+                        "assignment_id": {"type": "string"},
+                        "file": {"type": "string", "format": "binary"},
+                    },
+                }
+            }
+        },
+    }
+}
+
+
+@app.post("/works", response_model=SubmitWorkResponse, openapi_extra=_SUBMIT_WORK_BODY)
+async def submit_work(request: Request, db: AsyncSession = Depends(get_db)):
+    """Принимает работу; файл передаётся в File Service потоком, без буферизации в gateway.
+
+    Поля `student_id` и `assignment_id` должны идти в форме до файла.
+    """
+    try:
+        upload = StreamedUpload(request)
+        await upload.read_until_file()
+    except UploadFormError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    student_id = upload.fields.get("student_id")
+    assignment_id = upload.fields.get("assignment_id")
+    if not student_id or not assignment_id:
+        raise HTTPException(status_code=422, detail="Form fields student_id and assignment_id must precede the file")
+
     # фиксируем факт сдачи в БД gateway
     work_id = str(uuid.uuid4())
     work = Work(
         id=work_id,
         student_id=student_id,
         assignment_id=assignment_id,
+        submitted_at=dt.datetime.utcnow(),
         status="CREATED",
     )
     db.add(work)
-    db.commit()
-    db.refresh(work)
+    await _checkpoint(db)
 
-    # сохраняем файл через File Service
+    # передаём файл в File Service чанками прямо из тела запроса
     try:
-        file_resp = await store_file(file)
+        with stage("store_file"):
+            file_resp = await stream_file(upload)
+        if file_resp["file"]["sha256"] != upload.sha256:
+            raise RuntimeError("File service sha256 does not match the uploaded content")
+    except UploadFormError as e:
+        work.status = "FILE_STORE_FAILED"
+        work.error = str(e)
+        await db.commit()
+        raise HTTPException(status_code=422, detail=str(e))
     except ServiceUnavailable as e:
         work.status = "FILE_STORE_FAILED"
         work.error = str(e)
-        db.commit()
+        await db.commit()
         raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         work.status = "FILE_STORE_FAILED"
         work.error = str(e)
-        db.commit()
+        await db.commit()
         raise HTTPException(status_code=502, detail=str(e))
 
     meta = file_resp["file"]
     work.file_id = meta["id"]
     work.file_sha256 = meta["sha256"]
     work.status = "FILE_STORED"
-    db.commit()
-    db.refresh(work)
-
-    # запускаем анализ через Analysis Service
-    report_summary = None
-    payload = {
-        "work_id": work.id,
-        "student_id": work.student_id,
-        "assignment_id": work.assignment_id,
-        "submitted_at": work.submitted_at.isoformat(),
-        "file_id": work.file_id,
+    await _checkpoint(db)
+
+    # ставим анализ в очередь Analysis Service и сразу отвечаем клиенту
+    with stage("enqueue"):
+        await _enqueue_analysis(work, db)
+    return SubmitWorkResponse(work=_work_out(work))
+
+
+_SUBMIT_BATCH_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["manifest"],
+                    "properties": {
+                        "manifest": {
+                            "type": "string",
+                            "description": 'JSON: [{"file": "...", "student_id": "...", "assignment_id": "..."}, ...]',
+                        },
+                        "assignment_id": {"type": "string", "description": "задание по умолчанию для всей пачки"},
+                        "files": {"type": "array", "items": {"type": "string", "format": "binary"}},
+                        "archive": {"type": "string", "format": "binary", "description": "zip или tar вместо files"},
+                    },
+                }
+            }
+        },
     }
+}
+
+
+async def _store_batch_item(item: BatchItem, source: Source, slots: asyncio.Semaphore) -> dict:
+    """Загружает файл элемента пачки в File Service; не больше `batch_concurrency` загрузок одновременно."""
+    hasher = hashlib.sha256()
+
+    async def chunks() -> AsyncIterator[bytes]:
+        async for chunk in source():
+            hasher.update(chunk)
+            yield chunk
+
+    async with slots:
+        content_type = mimetypes.guess_type(item.filename)[0] or "application/octet-stream"
+        file_resp = await store_file_chunks(item.filename.rsplit("/", 1)[-1], content_type, chunks())
+    if file_resp["file"]["sha256"] != hasher.hexdigest():
+        raise RuntimeError("File service sha256 does not match the uploaded content")
+    return file_resp["file"]
+
 
+async def _finish_batch_part(db: AsyncSession, part: list[tuple[BatchItem, Work | None, dict | Exception]]) -> list[bytes]:
+    """Фиксирует результаты загрузки части пачки одной транзакцией и ставит её анализы в очередь одним вызовом."""
+    stored = []
+    for (item, work, outcome) in part:
+        if work is None:
+            continue
+        if isinstance(outcome, Exception):
+            work.status = "FILE_STORE_FAILED"
+            work.error = str(outcome)
+        else:
+            work.file_id = outcome["id"]
+            work.file_sha256 = outcome["sha256"]
+            work.status = "FILE_STORED"
+            stored.append(work)
+    await _checkpoint(db)
+
+    if stored:
+        try:
+            jobs = await enqueue_analysis_batch([_analysis_payload(w) for w in stored])
+        except Exception as e:
+            for work in stored:
+                work.status = "ANALYSIS_FAILED"
+                work.error = str(e)
+        else:
+            for (work, job) in zip(stored, jobs):
+                work.analysis_job_id = job["id"]
+                work.status = "ANALYSIS_QUEUED"
+    await db.commit()
+
+    lines = []
+    for (item, work, outcome) in part:
+        line = {"index": item.index, "file": item.filename}
+        if work is None:
+            line["error"] = str(outcome)
+        else:
+            line["work"] = _work_out(work).model_dump(mode="json")
+        lines.append((json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8"))
+    return lines
+
+
+async def _run_batch(items: list[BatchItem], sources: dict[str, Source], cleanup) -> AsyncIterator[bytes]:
+    """Выполняет пачку и отдаёт результат по каждому элементу строкой NDJSON, в порядке манифеста.
+
+    Work создаются одной транзакцией заранее, файлы загружаются параллельно (не больше `batch_concurrency`),
+    а в очередь анализа элементы уходят частями по `batch_enqueue_size` строго по порядку манифеста,
+    чтобы более поздняя сдача анализировалась после более ранней. Если пачка прервана (клиент отключился),
+    работы, не дошедшие до очереди анализа, помечаются ошибкой, а не остаются в CREATED.
+    """
+    # сессия своя: зависимость get_db закрывается до того, как начнёт отдаваться потоковый ответ
+    db = AsyncSessionLocal()
+    tasks: dict[int, asyncio.Task] = {}
+    works: dict[int, Work] = {}
+    completed = False
     try:
-        rep = await create_report(payload)
-        report_summary = rep["report"]
-        work.last_report_id = report_summary["id"]
-        work.status = "ANALYZED"
-        work.error = None
-        db.commit()
-        db.refresh(work)
-    except ServiceUnavailable as e:
-        work.status = "ANALYSIS_FAILED"
-        work.error = str(e)
-        db.commit()
-        # возвращаем work + 503
-        raise HTTPException(status_code=503, detail=str(e))
-    except Exception as e:
-        work.status = "ANALYSIS_FAILED"
-        work.error = str(e)
-        db.commit()
-        raise HTTPException(status_code=502, detail=str(e))
+        now = dt.datetime.utcnow()
+        for item in items:
+            if item.filename in sources:
+                works[item.index] = Work(
+                    id=str(uuid.uuid4()),
+                    student_id=item.student_id,
+                    assignment_id=item.assignment_id,
+                    # порядок сдачи внутри пачки — порядок манифеста
+                    submitted_at=now + dt.timedelta(microseconds=item.index),
+                    status="CREATED",
+                )
+        db.add_all(works.values())
+        await db.commit()
+
+        slots = asyncio.Semaphore(settings.batch_concurrency)
+        for item in items:
+            if item.index in works:
+                tasks[item.index] = asyncio.create_task(_store_batch_item(item, sources[item.filename], slots))
+
+        queued = failed = 0
+        part = []
+        for (n, item) in enumerate(items, start=1):
+            work = works.get(item.index)
+            if work is None:
+                outcome = LookupError(f"File '{item.filename}' is missing from the upload")
+            else:
+                try:
+                    outcome = await tasks[item.index]
+                except Exception as e:
+                    outcome = e
+            part.append((item, work, outcome))
+            if len(part) >= settings.batch_enqueue_size or n == len(items):
+                for line in await _finish_batch_part(db, part):
+                    yield line
+                for (_, w, _) in part:
+                    if w is not None and w.status == "ANALYSIS_QUEUED":
+                        queued += 1
+                    else:
+                        failed += 1
+                part = []
+
+        completed = True
+        summary = {"summary": {"total": len(items), "queued": queued, "failed": failed}}
+        yield (json.dumps(summary) + "\n").encode("utf-8")
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        # при отключении клиента генератор отменяется: запись статусов и очистку не прерываем
+        with anyio.CancelScope(shield=True):
+            try:
+                if not completed and works:
+                    await _abandon_unfinished(db, works)
+            finally:
+                await db.close()
+                await cleanup()
+
 
-    return SubmitWorkResponse(work=_work_out(work), report=ReportSummary(**report_summary))
+async def _abandon_unfinished(db: AsyncSession, works: dict[int, Work]) -> None:
+    """Помечает работы прерванной пачки, так и не поставленные в очередь анализа."""
+    await db.rollback()
+    error = "Batch submission was interrupted"
+    ids = [w.id for w in works.values()]
+    for (status, failed) in (("CREATED", "FILE_STORE_FAILED"), ("FILE_STORED", "ANALYSIS_FAILED")):
+        await db.execute(
+            update(Work).where(Work.id.in_(ids), Work.status == status).values(status=failed, error=error)
+        )
+    await db.commit()
+
+
+@app.post("/works/batch", openapi_extra=_SUBMIT_BATCH_BODY)
+async def submit_batch(request: Request):
+    """Массовая сдача работ: много файлов (`files`) или zip/tar-архив (`archive`) и манифест.
+
+    Ответ — NDJSON: строка на каждый элемент манифеста по мере обработки и итоговая строка `summary`.
+    """
+    form = await request.form(max_files=settings.batch_max_files + 1, max_fields=10)
+    tmp_dir: Path | None = None
+
+    async def cleanup() -> None:
+        await form.close()
+        if tmp_dir is not None:
+            await asyncio.to_thread(shutil.rmtree, tmp_dir, True)
+
+    try:
+        manifest = form.get("manifest")
+        if not isinstance(manifest, str):
+            raise BatchError("Form field 'manifest' is required")
+        default_assignment_id = form.get("assignment_id")
+        items = parse_manifest(
+            manifest,
+            default_assignment_id if isinstance(default_assignment_id, str) else None,
+            settings.batch_max_files,
+        )
+        archive = form.get("archive")
+        if archive is not None and not isinstance(archive, str):
+            tmp_dir = Path(tempfile.mkdtemp(prefix="batch-"))
+            sources = await asyncio.to_thread(
+                extract_archive, archive.file, tmp_dir, settings.batch_max_files, settings.batch_max_bytes
+            )
+        else:
+            sources = upload_sources(
+                [f for f in form.getlist("files") if not isinstance(f, str)], settings.batch_max_bytes
+            )
+    except BatchError as e:
+        await cleanup()
+        raise HTTPException(status_code=422, detail=str(e))
+    except BaseException:
+        await cleanup()
+        raise
+
+    return StreamingResponse(_run_batch(items, sources, cleanup), media_type="application/x-ndjson")
 
 
 @app.get("/works/{work_id}", response_model=WorkOut)
-def get_work(work_id: str, db: Session = Depends(get_db)):
-    work = db.get(Work, work_id)
+async def get_work(work_id: str, db: AsyncSession = Depends(get_db)):
+    work = await db.get(Work, work_id)
     if not work:
         raise HTTPException(status_code=404, detail="Work not found")
+    await _sync_analysis_status(work, db)
     return _work_out(work)
 
 
 @app.get("/works/{work_id}/reports")
-async def get_reports(work_id: str, db: Session = Depends(get_db)):
-    work = db.get(Work, work_id)
+async def get_reports(work_id: str, db: AsyncSession = Depends(get_db)):
+    work = await db.get(Work, work_id)
     if not work:
         raise HTTPException(status_code=404, detail="Work not found")
 
@@ -138,38 +455,71 @@ async def get_reports(work_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=502, detail=str(e))
 
 
-@app.post("/works/{work_id}/retry-analysis", response_model=SubmitWorkResponse)
-async def retry_analysis(work_id: str, db: Session = Depends(get_db)):
-    work = db.get(Work, work_id)
-    if not work:
-        raise HTTPException(status_code=404, detail="Work not found")
-    if not work.file_id:
-        raise HTTPException(status_code=409, detail="Work has no stored file_id; cannot analyze")
+async def _assignment_analytics(assignment_id: str, view: str, params: dict):
+    try:
+        result = await get_assignment_analytics(assignment_id, view, params)
+    except ServiceUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="No analyzed works for assignment")
+    return result
+
+
+@app.get("/assignments/{assignment_id}/summary")
+async def get_assignment_summary(assignment_id: str, top: int = Query(20, ge=0, le=200)):
+    """Сводка по заданию: число работ, доля плагиата, кластеры дубликатов, частые слова (агрегаты Analysis Service)."""
+    return await _assignment_analytics(assignment_id, "summary", {"top": top})
+
 
-    payload = {
-        "work_id": work.id,
-        "student_id": work.student_id,
-        "assignment_id": work.assignment_id,
-        "submitted_at": work.submitted_at.isoformat(),
-        "file_id": work.file_id,
+@app.get("/assignments/{assignment_id}/clusters")
+async def get_assignment_clusters(assignment_id: str, limit: int = Query(100, ge=1, le=1000)):
+    """Группы работ задания с одинаковым или почти одинаковым текстом."""
+    return {
+        "assignment_id": assignment_id,
+        "clusters": await _assignment_analytics(assignment_id, "clusters", {"limit": limit}),
     }
 
+
+@app.post("/assignments/{assignment_id}/similarity", status_code=202)
+async def start_similarity(
+    assignment_id: str,
+    metric: str = Query("cosine", pattern="^(cosine|jaccard)$"),
+    k: int = Query(10, ge=1, le=100),
+):
+    """Запускает расчёт попарной близости всех работ задания (после дедлайна); результат — GET того же пути."""
     try:
-        rep = await create_report(payload)
-        report_summary = rep["report"]
-        work.last_report_id = report_summary["id"]
-        work.status = "ANALYZED"
-        work.error = None
-        db.commit()
-        db.refresh(work)
-        return SubmitWorkResponse(work=_work_out(work), report=ReportSummary(**report_summary))
+        run = await start_assignment_similarity(assignment_id, {"metric": metric, "k": k})
     except ServiceUnavailable as e:
-        work.status = "ANALYSIS_FAILED"
-        work.error = str(e)
-        db.commit()
         raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        work.status = "ANALYSIS_FAILED"
-        work.error = str(e)
-        db.commit()
         raise HTTPException(status_code=502, detail=str(e))
+    if run is None:
+        raise HTTPException(status_code=409, detail="Similarity matrix is already being computed")
+    return run
+
+
+@app.get("/assignments/{assignment_id}/similarity")
+async def get_similarity(
+    assignment_id: str,
+    metric: str = Query("cosine", pattern="^(cosine|jaccard)$"),
+    work_id: str | None = None,
+):
+    """Статус расчёта и ближайшие работы для каждой работы задания (или одной, `work_id`)."""
+    params = {"metric": metric}
+    if work_id is not None:
+        params["work_id"] = work_id
+    return await _assignment_analytics(assignment_id, "similarity", params)
+
+
+@app.post("/works/{work_id}/retry-analysis", response_model=SubmitWorkResponse)
+async def retry_analysis(work_id: str, db: AsyncSession = Depends(get_db)):
+    work = await db.get(Work, work_id)
+    if not work:
+        raise HTTPException(status_code=404, detail="Work not found")
+    if not work.file_id:
+        raise HTTPException(status_code=409, detail="Work has no stored file_id; cannot analyze")
+
+    await _enqueue_analysis(work, db)
+    return SubmitWorkResponse(work=_work_out(work))
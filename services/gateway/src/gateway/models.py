@@ -18,5 +18,6 @@ class Work(Base):
     file_sha256: Mapped[str | None] = mapped_column(String, nullable=True, index=True)
 
     last_report_id: Mapped[str | None] = mapped_column(String, nullable=True, index=True)
+    analysis_job_id: Mapped[str | None] = mapped_column(String, nullable=True)
 
     error: Mapped[str | None] = mapped_column(Text, nullable=True)
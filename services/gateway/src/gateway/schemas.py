@@ -11,6 +11,7 @@ class WorkOut(BaseModel):
     file_id: str | None = None
     file_sha256: str | None = None
     last_report_id: str | None = None
+    analysis_job_id: str | None = None
     error: str | None = None
 
 
@@ -22,6 +23,9 @@ class ReportSummary(BaseModel):
     plagiarism_reason: str | None = None
     plagiarized_from_work_id: str | None = None
     plagiarized_from_student_id: str | None = None
+    similarity_score: float | None = None
+    similar_work_id: str | None = None
+    containment_score: float | None = None
     created_at: dt.datetime
 
 
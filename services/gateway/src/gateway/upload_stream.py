@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import hashlib
+from collections import deque
+from typing import AsyncIterator
+
+import multipart
+from multipart.exceptions import FormParserError
+from multipart.multipart import parse_options_header
+from starlette.requests import Request
+
+
+class UploadFormError(ValueError):
+    pass
+
+
+class StreamedUpload:
+    """Потоковый разбор multipart/form-data без буферизации файла.
+
+    Текстовые поля, идущие до файла, собираются в `fields`; содержимое файловой части
+    отдаётся чанками через `file_chunks()` по мере чтения тела запроса, попутно считаются
+    размер и sha256. Поддерживается ровно одна файловая часть, и она должна идти после полей.
+    """
+
+    def __init__(self, request: Request, file_field: str = "file"):
+        _, params = parse_options_header(request.headers.get("content-type", ""))
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise UploadFormError("Expected multipart/form-data request with a boundary")
+
+        self.file_field = file_field
+        self.fields: dict[str, str] = {}
+        self.filename: str | None = None
+        self.content_type: str = "application/octet-stream"
+        self.size = 0
+        self._hasher = hashlib.sha256()
+
+        self._body = request.stream()
+        self._finished = False
+        self._pending: deque[bytes] = deque()
+        self._in_file = False
+        self._file_done = False
+        self._part_name: str | None = None
+        self._part_is_file = False
+        self._part_data = bytearray()
+        self._part_headers: dict[bytes, bytes] = {}
+        self._header_name = b""
+        self._header_value = b""
+        self._parser = multipart.MultipartParser(
+            boundary,
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+            },
+        )
+
+    @property
+    def sha256(self) -> str:
+        return self._hasher.hexdigest()
+
+    # --- колбэки парсера ---
+
+    def _on_part_begin(self) -> None:
+        self._part_name = None
+        self._part_is_file = False
+        self._part_data = bytearray()
+        self._part_headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._part_headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._part_headers.get(b"content-disposition", b""))
+        if b"name" not in options:
+            raise UploadFormError('The Content-Disposition header field "name" must be provided')
+        self._part_name = options[b"name"].decode("utf-8", errors="replace")
+        if b"filename" not in options:
+            return
+        if self._part_name != self.file_field or self._file_done or self._in_file:
+            raise UploadFormError(f"Exactly one file part named '{self.file_field}' is expected")
+        self._part_is_file = True
+        self._in_file = True
+        self.filename = options[b"filename"].decode("utf-8", errors="replace") or None
+        content_type = self._part_headers.get(b"content-type")
+        if content_type:
+            self.content_type = content_type.decode("latin-1")
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._part_is_file:
+            chunk = data[start:end]
+            self.size += len(chunk)
+            self._hasher.update(chunk)
+            self._pending.append(chunk)
+        else:
+            self._part_data += data[start:end]
+
+    def _on_part_end(self) -> None:
+        if self._part_is_file:
+            self._in_file = False
+            self._file_done = True
+        elif self._part_name is not None:
+            self.fields[self._part_name] = self._part_data.decode("utf-8", errors="replace")
+
+    # --- чтение тела ---
+
+    async def _feed(self) -> bool:
+        """Подаёт парсеру следующий чанк тела; False, когда тело закончилось."""
+        if self._finished:
+            return False
+        try:
+            chunk = await self._body.__anext__()
+        except StopAsyncIteration:
+            chunk = b""
+        try:
+            if not chunk:
+                self._finished = True
+                self._parser.finalize()
+                return False
+            self._parser.write(chunk)
+        except FormParserError as e:
+            raise UploadFormError(f"Malformed multipart body: {e}")
+        return True
+
+    async def read_until_file(self) -> None:
+        """Читает поля формы до начала файловой части."""
+        while not self._in_file and not self._file_done:
+            if not await self._feed():
+                raise UploadFormError(f"Missing file part '{self.file_field}'")
+
+    async def file_chunks(self) -> AsyncIterator[bytes]:
+        """Содержимое файла чанками; по завершении дочитывает остаток тела запроса."""
+        while True:
+            while self._pending:
+                yield self._pending.popleft()
+            if not await self._feed():
+                break
+        while self._pending:
+            yield self._pending.popleft()